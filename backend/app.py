@@ -1,8 +1,11 @@
+import asyncio
+import json
 import logging
-from typing import List
+from typing import Any, AsyncIterator, Awaitable, Dict, List
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, status, Depends, Request
+from fastapi import FastAPI, HTTPException, status, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from starlette.middleware.sessions import SessionMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
@@ -15,15 +18,23 @@ from models import (
     AskResponse,
     RenameSpaceRequest,
     UploadResponse,
+    IngestionJobResponse,
     SpaceResponse,
     SpaceDetailsResponse,
     MessageResponse
 )
 from services.query_service import QueryService
 from services.document_service import DocumentService
+from services.ingestion_service import IngestionService
+from services.ai_service import get_provider_registry, close_provider_registry
+from vector_store import get_embedding_service
+from vector_index import get_index_manager
+from pdf_utils import shutdown_extraction_pool
 from db_utils import get_all_spaces, get_documents_by_space, update_space_name, delete_space, delete_document
 from routers import auth
 from auth_utils import get_current_user
+from upload_limit import RequestBodyLimitMiddleware
+from constants import DISCONNECT_POLL_INTERVAL_SECONDS, UPLOAD_MAX_REQUEST_BYTES
 
 logging.basicConfig(
     level=logging.INFO,
@@ -44,6 +55,14 @@ app = FastAPI(
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+# Oversized uploads are turned away before Starlette spools the multipart body;
+# added first so CORS headers still go on the 413
+app.add_middleware(
+    RequestBodyLimitMiddleware,
+    max_bytes=UPLOAD_MAX_REQUEST_BYTES,
+    paths=["/documents/upload"]
+)
+
 app.add_middleware(
     SessionMiddleware,
     secret_key=settings.JWT_SECRET_KEY
@@ -61,15 +80,72 @@ app.include_router(auth.router)
 
 query_service = QueryService()
 document_service = DocumentService()
+ingestion_service = IngestionService()
 rag_pipeline = better_retrieval_service.RAGPipeline()
 
 
+@app.on_event("startup")
+async def startup_event():
+    get_provider_registry().warm()
+    ingestion_service.start()
+
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup resources on shutdown."""
     from services.auth_service import AuthService
+    ingestion_service.stop()
+    shutdown_extraction_pool()
+    logger.info("Stopped ingestion workers")
     await AuthService.close_httpx_client()
-    logger.info("Closed httpx client")
+    await close_provider_registry()
+    logger.info("Closed httpx clients")
+    rag_pipeline.shutdown()
+    logger.info("Stopped retrieval workers")
+    get_embedding_service().close()
+
+
+async def run_until_disconnected(request: Request, work: Awaitable[Any]) -> Any:
+    """Await `work`, cancelling it if the client closes the connection first."""
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                logger.info("Client disconnected, cancelled in-flight request")
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+
+
+def query_error_to_http(e: Exception) -> HTTPException:
+    if isinstance(e, ValueError):
+        logger.warning(f"Invalid query: {str(e)}")
+        return HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+
+    error_msg = str(e)
+    if "429" in error_msg or "RESOURCE_EXHAUSTED" in error_msg or "quota" in error_msg.lower():
+        logger.warning(f"Quota exceeded: {error_msg}")
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="API quota exceeded. The selected provider has run out of credits. Please try again later or switch to a different provider."
+        )
+    logger.error(f"Error processing query: {error_msg}", exc_info=e)
+    return HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail="An error occurred processing your request"
+    )
 
 
 @app.get("/", tags=["Health"])
@@ -77,6 +153,25 @@ def health_check() -> dict:
     return {"status": "running"}
 
 
+@app.get("/health/embedding-cache", tags=["Health"])
+def embedding_cache_stats() -> dict:
+    return get_embedding_service().stats()
+
+
+@app.get("/health/answer-cache", tags=["Health"])
+def answer_cache_stats() -> dict:
+    answer_cache = rag_pipeline.answer_cache
+    semantic_cache = rag_pipeline.semantic_cache
+    stats = answer_cache.stats() if answer_cache is not None else {"backend": "off"}
+    stats["semantic"] = semantic_cache.stats() if semantic_cache is not None else None
+    return stats
+
+
+@app.get("/health/vector-index", tags=["Health"])
+def vector_index_status() -> dict:
+    return get_index_manager().status()
+
+
 @app.post("/ask", response_model=AskResponse, tags=["Query"])
 @limiter.limit("30/minute")  # 30 requests per minute per IP
 async def ask_question(
@@ -84,79 +179,148 @@ async def ask_question(
     body: AskRequest,
     current_user: dict = Depends(get_current_user)
 ) -> AskResponse:
-    _ = request
     try:
         user_id = current_user["user_id"]
-        result = await rag_pipeline.process_query(
+        result = await run_until_disconnected(
+            request,
+            rag_pipeline.process_query(
+                query=body.query,
+                space_id=body.space_id,
+                user_id=user_id,
+                provider=body.answer_provider,
+                model=body.answer_model,
+                use_semantic_cache=body.use_semantic_cache,
+            )
+        )
+        return result
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        raise query_error_to_http(e)
+
+
+@app.post("/ask/stream", tags=["Query"])
+@limiter.limit("30/minute")  # 30 requests per minute per IP
+async def ask_question_stream(
+    request: Request,
+    body: AskRequest,
+    current_user: dict = Depends(get_current_user)
+) -> StreamingResponse:
+    """Server-Sent Events: one `sources` event, then `token` events, then `done` (or `error`)."""
+    try:
+        user_id = current_user["user_id"]
+        events = rag_pipeline.stream_query(
             query=body.query,
             space_id=body.space_id,
             user_id=user_id,
             provider=body.answer_provider,
             model=body.answer_model,
+            use_semantic_cache=body.use_semantic_cache,
         )
-        return result
+        # Run retrieval before responding so lookup errors still map to HTTP status codes
+        first_event = await run_until_disconnected(request, anext(events))
 
-    except ValueError as e:
-        logger.warning(f"Invalid query: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=str(e)
-        )
+    except HTTPException:
+        raise
 
     except Exception as e:
-        error_msg = str(e)
-        if "429" in error_msg or "RESOURCE_EXHAUSTED" in error_msg or "quota" in error_msg.lower():
-            logger.warning(f"Quota exceeded: {error_msg}")
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="API quota exceeded. The selected provider has run out of credits. Please try again later or switch to a different provider."
-            )
-        logger.error(f"Error processing query: {error_msg}", exc_info=True)
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="An error occurred processing your request"
-        )
-
-
-@app.post("/documents/upload", response_model=UploadResponse, tags=["Documents"])
+        raise query_error_to_http(e)
+
+    async def event_stream() -> AsyncIterator[str]:
+        yield format_sse(first_event)
+        try:
+            async for event in events:
+                yield format_sse(event)
+        except Exception as e:
+            http_error = query_error_to_http(e)
+            yield format_sse({"event": "error", "data": {"status": http_error.status_code, "detail": http_error.detail}})
+        finally:
+            await events.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post(
+    "/documents/upload",
+    response_model=UploadResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["Documents"],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "required": ["space_id"],
+                        "properties": {
+                            "space_id": {"type": "string"},
+                            "file": {"type": "string", "format": "binary"},
+                            "text_content": {"type": "string"},
+                        },
+                    }
+                }
+            },
+        }
+    }
+)
 @limiter.limit("10/minute")  # 10 uploads per minute per IP
 async def upload_document(
     request: Request,
-    space_id: str = Form(...),
-    file: UploadFile = File(None),
-    text_content: str = Form(None),
     current_user: dict = Depends(get_current_user)
 ) -> UploadResponse:
-    _ = request
+    """Validate and queue a document; poll /documents/jobs/{job_id} for progress.
+
+    The multipart form (space_id plus file or text_content) is parsed from the
+    request stream here rather than by FastAPI, so the file goes to the ingest
+    spool once, hashed and size-checked as it arrives.
+    """
+    upload = None
     try:
         user_id = current_user["user_id"]
+        upload = await ingestion_service.receive_upload(request.stream(), request.headers.get("content-type", ""))
+        space_id = upload.fields.get("space_id")
+        text_content = upload.fields.get("text_content")
+        if not space_id:
+            raise ValueError("space_id is required")
 
         # Handle text content upload
         if text_content:
-            file_id, chunk_count, filename = document_service.process_text_content(
-                text_content,
-                space_id,
-                user_id
+            upload.discard()
+            document_service.validate_text_content(text_content)
+            filename = document_service.generate_filename_from_text(text_content)
+            job = await asyncio.to_thread(
+                ingestion_service.enqueue_text, text_content, filename, space_id, user_id
+            )
+            return UploadResponse(
+                fileid=job["file_id"],
+                filename=filename,
+                job_id=job["id"],
+                status=job["status"]
             )
-            return UploadResponse(fileid=file_id, chunk_count=chunk_count, filename=filename)
 
         # Handle file upload
-        if not file:
+        if upload.filename is None:
             raise ValueError("Either file or text_content must be provided")
 
-        document_service.validate_file(file.filename, file.size)
+        job = await asyncio.to_thread(ingestion_service.enqueue_upload, upload, space_id, user_id)
 
-        file_content = file.file.read()
-        file_id, chunk_count = document_service.process_document(
-            file_content,
-            file.filename,
-            space_id,
-            user_id
+        return UploadResponse(
+            fileid=job["file_id"],
+            filename=upload.filename,
+            job_id=job["id"],
+            status=job["status"]
         )
 
-        return UploadResponse(fileid=file_id, chunk_count=chunk_count, filename=file.filename)
-
     except ValueError as e:
+        if upload is not None:
+            upload.discard()
         logger.warning(f"Invalid file upload: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -164,6 +328,8 @@ async def upload_document(
         )
 
     except Exception as e:
+        if upload is not None:
+            upload.discard()
         logger.error(f"Error uploading document: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -171,6 +337,50 @@ async def upload_document(
         )
 
 
+@app.get("/documents/jobs/{job_id}", response_model=IngestionJobResponse, tags=["Documents"])
+@limiter.limit("120/minute")  # 120 requests per minute per IP (clients poll this)
+async def get_ingestion_job_status(
+    request: Request,
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+) -> IngestionJobResponse:
+    _ = request
+    try:
+        user_id = current_user["user_id"]
+        job = ingestion_service.get_job(job_id, user_id)
+
+        if not job:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Job not found"
+            )
+
+        return IngestionJobResponse(
+            job_id=job["id"],
+            status=job["status"],
+            stage=job["stage"],
+            filename=job["filename"],
+            fileid=job["file_id"],
+            space_id=job["space_id"],
+            chunks_total=job["chunks_total"],
+            chunks_embedded=job["chunks_embedded"],
+            reused_chunks=job["reused_chunks"],
+            error=job["error"],
+            created_at=job["created_at"],
+            updated_at=job["updated_at"]
+        )
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        logger.error(f"Error retrieving ingestion job: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to retrieve job status"
+        )
+
+
 @app.get("/spaces", response_model=List[SpaceResponse], tags=["Spaces"])
 @limiter.limit("60/minute")  # 60 requests per minute per IP
 async def list_spaces(request: Request, current_user: dict = Depends(get_current_user)) -> List[SpaceResponse]:
@@ -285,6 +495,11 @@ async def delete_space_endpoint(
                 detail="Space not found"
             )
 
+        try:
+            await asyncio.to_thread(get_index_manager().drop_space_index, space_id)
+        except Exception as e:
+            logger.error(f"Error dropping vector index for space {space_id}: {str(e)}")
+
         return MessageResponse(message="Space deleted successfully")
 
     except HTTPException:
@@ -1,5 +1,6 @@
 import sys
 import logging
+from typing import Literal
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import ValidationError
 
@@ -22,6 +23,27 @@ class Settings(BaseSettings):
     OPENROUTER_API_KEY1: str = ""
     EMBEDDING_MODEL: str = "gemini-embedding-001"
     EMBEDDING_DIMENSION: int = 768
+    EMBEDDING_CACHE_SIZE: int = 2048
+    EMBEDDING_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    EMBEDDING_CACHE_PATH: str = ""
+    EMBEDDING_CACHE_DISK_SIZE: int = 100_000
+    ANSWER_CACHE_BACKEND: Literal["memory", "redis", "off"] = "memory"
+    ANSWER_CACHE_SIZE: int = 1024
+    ANSWER_CACHE_TTL_SECONDS: int = 24 * 3600
+    ANSWER_CACHE_URL: str = "redis://localhost:6379/0"
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95
+    SEMANTIC_CACHE_ENTRIES_PER_SPACE: int = 256
+    VECTOR_INDEX_TYPE: Literal["ivfflat", "hnsw"] = "ivfflat"
+    HNSW_M: int = 16
+    HNSW_EF_CONSTRUCTION: int = 64
+    IVFFLAT_LISTS: int = 100
+    DISTANCE_METRIC: Literal["l2", "cosine", "inner_product"] = "l2"
+    VECTOR_STORAGE: Literal["full", "halfvec", "binary"] = "full"
+    SEARCH_PREFIX_DIMENSION: int = 0
+    PREFIX_SEARCH_CANDIDATES: int = 100
+    INGEST_SPOOL_DIR: str = "ingest_spool"
+    INGEST_WORKERS: int = 2
 
 try:
     settings = Settings()
@@ -7,15 +7,61 @@ MAX_CHUNKS_ANALYZE_ALL = 30
 MAX_RELEVANT_CHUNKS = 5
 DISTANCE_THRESHOLD = 1.0
 
+RETRIEVAL_MAX_WORKERS = 16
+
+IVFFLAT_REBUILD_MIN_ROWS = 10000  # Retrain IVFFlat lists once the table has this many rows
+IVFFLAT_ROWS_PER_LIST = 1000
+HNSW_EF_SEARCH_MIN = 40
+HNSW_EF_SEARCH_MAX = 1000
+VECTOR_INDEX_CHECK_INTERVAL_SECONDS = 600
+EXACT_SEARCH_MAX_CHUNKS = 2000  # Spaces up to this size are searched exactly instead of through an ANN index
+SPACE_INDEX_MIN_CHUNKS = 20000  # Spaces this large get their own partial ANN index
+RESCORE_CANDIDATE_MULTIPLIER = 4  # Over-fetch from halfvec/binary indexes before full-precision rescoring
+FULL_TEXT_CONFIG = "english"  # Postgres text search configuration for documents.text_search
+RRF_K = 60  # Reciprocal rank fusion constant: score = sum(1 / (RRF_K + rank)) over the vector and full-text channels
+DISCONNECT_POLL_INTERVAL_SECONDS = 0.5
+
 CHUNK_TOKENS = 500
 CHUNK_OVERLAP = 100
 
+EMBEDDING_BATCH_SIZE = 100  # Gemini embed_content accepts at most 100 inputs per request
+EMBEDDING_BATCH_TOKEN_BUDGET = 20000
+EMBEDDING_MAX_PARALLEL_BATCHES = 4
+EMBEDDING_BATCH_MAX_RETRIES = 3
+EMBEDDING_RETRY_BASE_DELAY_SECONDS = 1.0
+
+DOCUMENT_INSERT_BATCH_SIZE = 500
+# Chunks embedded and inserted per step while a document is still being chunked
+INGEST_STREAM_BATCH_SIZE = EMBEDDING_BATCH_SIZE * EMBEDDING_MAX_PARALLEL_BATCHES
+TOKEN_COUNT_BACKFILL_BATCH = 1000
+EMBEDDING_NORMALIZE_BATCH = 1000  # Rows rewritten per committed batch when stored embeddings are normalized
+HEADER_TOKEN_CACHE_SIZE = 4096
+OVERLAP_TOKEN_CACHE_SIZE = 4096  # Overlaps between adjacent chunks, which recur whenever both are retrieved
+KNAPSACK_TOKEN_GRANULARITY = 16  # Token buckets for context packing; coarser is faster, finer packs tighter
+
 MAX_FILE_SIZE_MB = 5
 MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+UPLOAD_READ_CHUNK_BYTES = 1024 * 1024  # Uploads are copied into the ingest spool this much at a time
 MAX_PDF_PAGES = 25
+PDF_EXTRACT_PROCESSES = 4  # Pool size for page text extraction (capped at the CPU count); 1 extracts in-process
+PDF_PARALLEL_MIN_PAGES = 4  # Shorter PDFs are extracted in-process; the pool round trip is not worth it
+PDF_PAGES_PER_TASK = 8  # Upper bound on the page range one pool task extracts
+# PDFs longer than MAX_PDF_PAGES are ingested in checkpointed page batches (large-document mode)
+LARGE_DOCUMENT_MAX_PAGES = 2000
+LARGE_DOCUMENT_MAX_FILE_SIZE_MB = 100
+LARGE_DOCUMENT_MAX_FILE_SIZE_BYTES = LARGE_DOCUMENT_MAX_FILE_SIZE_MB * 1024 * 1024
+UPLOAD_MAX_FIELD_BYTES = 256 * 1024  # Non-file form fields; pasted text is at most MAX_TEXT_CHARACTERS
+UPLOAD_MAX_REQUEST_BYTES = LARGE_DOCUMENT_MAX_FILE_SIZE_BYTES + 1024 * 1024  # Largest file plus multipart framing
+LARGE_DOCUMENT_BATCH_PAGES = 20  # Pages chunked, embedded and committed per checkpoint
 MAX_TEXT_CHARACTERS = 50000  # Max characters for pasted text (roughly equivalent to 5MB text file)
 ALLOWED_FILE_EXTENSIONS = ('.pdf', '.txt', '.md')
 
+INGEST_POLL_INTERVAL_SECONDS = 1.0
+INGEST_MAX_ATTEMPTS = 3
+INGEST_STALE_JOB_SECONDS = 600  # Running jobs with no progress for this long are picked up again
+INGEST_RETRY_BASE_SECONDS = 30  # Backoff before retrying a failed job, doubled per attempt
+INGEST_RETRY_MAX_SECONDS = 600
+
 GEMINI_MODEL = "gemini-2.5-flash"
 GEMINI_MODELS = {
     "gemini-3.5-flash": "gemini-3.5-flash",
@@ -36,6 +82,16 @@ OPENROUTER_MODELS = {
     "nvidia/nemotron-3-super-120b-a12b:free": "nvidia/nemotron-3-super-120b-a12b:free",
 }
 
+CLASSIFICATION_MODEL = "gemini-2.0-flash"
+
+LLM_TIMEOUT_SECONDS = 120
+LLM_CONNECT_TIMEOUT_SECONDS = 10
+LLM_MAX_CONNECTIONS = 100
+LLM_MAX_CONCURRENCY = {  # In-flight generations per provider, per process
+    "openrouter": 32,
+    "gemini": 32,
+}
+
 TEMPERATURE = 0.4
 TOP_P = 0.9
 TOP_K = 40
@@ -1,18 +1,29 @@
 import logging
-from typing import List, Dict, Optional
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, List, Dict, Optional
 from contextlib import contextmanager
 
-from sqlalchemy import ForeignKey, create_engine, Column, String, Integer, Text, DateTime, Index
+from sqlalchemy import ForeignKey, create_engine, Column, Computed, String, Integer, Text, DateTime, Index, func
 from sqlalchemy import text as sql_text
-from sqlalchemy.orm import declarative_base, sessionmaker, Session
-from pgvector.sqlalchemy import Vector
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import declarative_base, deferred, sessionmaker, Session
+from pgvector.sqlalchemy import BIT, HALFVEC, Vector
 
 from config.config import settings
+from constants import FULL_TEXT_CONFIG
+from distance_metrics import BINARY, HALFVEC as HALFVEC_STORAGE, index_metric, index_opclass
 
 logger = logging.getLogger(__name__)
 
 DATABASE_URL = settings.DATABASE_URL
 EMBEDDING_DIMENSION = settings.EMBEDDING_DIMENSION
+VECTOR_INDEX_TYPE = settings.VECTOR_INDEX_TYPE
+DISTANCE_METRIC = settings.DISTANCE_METRIC
+VECTOR_STORAGE = settings.VECTOR_STORAGE
+SEARCH_PREFIX_DIMENSION = (
+    settings.SEARCH_PREFIX_DIMENSION if 0 < settings.SEARCH_PREFIX_DIMENSION < EMBEDDING_DIMENSION else 0
+)
 
 engine_kwargs = {
     "pool_size": 10,
@@ -59,11 +70,33 @@ class Spaces(Base):
     user_id = Column(String, ForeignKey('users.id'), nullable=False, index=True)
     name = Column(String, nullable=False)
     created_at = Column(DateTime, nullable=False)
+    # Opaque token replaced whenever the space's chunks change; keys cached answers
+    content_version = Column(String(32), nullable=False, default=lambda: new_content_version(), server_default="")
 
     __table_args__ = (
         Index('ix_spaces_user_id_space_id', 'user_id', 'id'),
     )
 
+
+def new_content_version() -> str:
+    # Random rather than a counter, so a space deleted and recreated under the same id never repeats a version
+    return uuid.uuid4().hex
+
+def _embedding_index_expression(column):
+    # Prefix / halfvec / binary indexes cover a derived expression; the column keeps the full vector for rescoring
+    dimension = EMBEDDING_DIMENSION
+    expression = column
+    if SEARCH_PREFIX_DIMENSION:
+        dimension = SEARCH_PREFIX_DIMENSION
+        expression = func.cast(func.subvector(column, 1, dimension), Vector(dimension))
+    if VECTOR_STORAGE == HALFVEC_STORAGE:
+        return func.cast(expression, HALFVEC(dimension)).label('embedding')
+    if VECTOR_STORAGE == BINARY:
+        return func.cast(func.binary_quantize(expression), BIT(dimension)).label('embedding')
+    if SEARCH_PREFIX_DIMENSION:
+        return expression.label('embedding')
+    return column
+
 class Document(Base):
     __tablename__ = "documents"
     id = Column(Integer, primary_key=True)
@@ -73,17 +106,66 @@ class Document(Base):
     space_id = Column(String, ForeignKey('spaces.id'), nullable=False, index=True)
     text = Column(Text, nullable=False)
     embedding = Column(Vector(EMBEDDING_DIMENSION), nullable=False)
+    # sha256 of (embedding model, dimension, title, chunk text); lets uploads reuse vectors
+    content_hash = Column(String(64), nullable=True, index=True)
+    # tiktoken length of `text`, computed at ingest so context budgeting does not re-encode
+    token_count = Column(Integer, nullable=True)
+    # Where the chunk sits in the extracted text; pages are 1-based and NULL for plain text
+    char_start = Column(Integer, nullable=True)
+    char_end = Column(Integer, nullable=True)
+    page_start = Column(Integer, nullable=True)
+    page_end = Column(Integer, nullable=True)
     created_at = Column(DateTime, nullable=False, server_default=sql_text("now()"))
+    # Lexical channel for hybrid search; generated by Postgres, never loaded with the row
+    text_search = deferred(Column(
+        TSVECTOR,
+        Computed(f"to_tsvector('{FULL_TEXT_CONFIG}', text)", persisted=True),
+    ))
 
     __table_args__ = (
+        Index('ix_documents_text_search', 'text_search', postgresql_using='gin'),
         Index(
             'ix_documents_embedding',
-            'embedding',
-            postgresql_using='ivfflat',
-            postgresql_ops={'embedding': 'vector_l2_ops'},
+            _embedding_index_expression(embedding),
+            postgresql_using=VECTOR_INDEX_TYPE,
+            postgresql_ops={'embedding': index_opclass(index_metric(DISTANCE_METRIC, SEARCH_PREFIX_DIMENSION), VECTOR_STORAGE)},
+            postgresql_with=(
+                {'m': settings.HNSW_M, 'ef_construction': settings.HNSW_EF_CONSTRUCTION}
+                if VECTOR_INDEX_TYPE == 'hnsw'
+                else {'lists': settings.IVFFLAT_LISTS}
+            ),
         ),
     )
 
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+    id = Column(String, primary_key=True)
+    user_id = Column(String, ForeignKey('users.id'), nullable=False, index=True)
+    space_id = Column(String, nullable=False)
+    filename = Column(String, nullable=False)
+    file_id = Column(String, nullable=False)
+    source = Column(String, nullable=False)  # "file" or "text"
+    payload_path = Column(String, nullable=False)
+    # sha256 of the spooled payload, computed while the upload streams in
+    content_sha256 = Column(String(64), nullable=True)
+    status = Column(String, nullable=False, default="queued", index=True)
+    stage = Column(String, nullable=False, default="queued")
+    chunks_total = Column(Integer, nullable=False, default=0)
+    chunks_embedded = Column(Integer, nullable=False, default=0)
+    reused_chunks = Column(Integer, nullable=False, default=0)
+    # Large-document mode: what the last committed page batch covered, so a retry resumes after it
+    checkpoint_page = Column(Integer, nullable=False, default=0)
+    checkpoint_chunk = Column(Integer, nullable=False, default=0)
+    checkpoint_char = Column(Integer, nullable=False, default=0)
+    checkpoint_reused = Column(Integer, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    # A requeued job is not claimed again before this time
+    retry_at = Column(DateTime, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+
 Base.metadata.create_all(engine)
 
 def get_all_spaces(user_id: str) -> List[Dict[str, str]]:
@@ -206,6 +288,7 @@ def delete_document(space_id: str, original_file_id: str, user_id: str) -> int:
                 Document.original_file_id == original_file_id
             ).delete()
 
+            space.content_version = new_content_version()
             session.commit()
             logger.info(f"Deleted {deleted_count} chunks for document '{original_file_id}' in space {space_id}")
             return deleted_count
@@ -236,6 +319,21 @@ def verify_space_access(space_id: str, user_id: str) -> bool:
             raise
 
 
+def get_space_content_version(space_id: str, user_id: str) -> Optional[str]:
+    """Current content version of a space, or None if the user cannot access it.
+    """
+    with get_db_session() as session:
+        try:
+            return session.query(Spaces.content_version).filter(
+                Spaces.id == space_id,
+                Spaces.user_id == user_id
+            ).scalar()
+
+        except Exception as e:
+            logger.error(f"Error reading content version of space {space_id}: {str(e)}", exc_info=True)
+            raise
+
+
 def get_user_by_email(email: str) -> Optional[Dict]:
     """Get user by email address.
     """
@@ -285,3 +383,139 @@ def create_user(user_id: str, email: str, name: str, picture: Optional[str] = No
             logger.error(f"Error creating user {email}: {str(e)}", exc_info=True)
             session.rollback()
             raise
+
+
+def _ingestion_job_to_dict(job: IngestionJob) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "user_id": job.user_id,
+        "space_id": job.space_id,
+        "filename": job.filename,
+        "file_id": job.file_id,
+        "source": job.source,
+        "payload_path": job.payload_path,
+        "content_sha256": job.content_sha256,
+        "status": job.status,
+        "stage": job.stage,
+        "chunks_total": job.chunks_total,
+        "chunks_embedded": job.chunks_embedded,
+        "reused_chunks": job.reused_chunks,
+        "checkpoint_page": job.checkpoint_page,
+        "checkpoint_chunk": job.checkpoint_chunk,
+        "checkpoint_char": job.checkpoint_char,
+        "checkpoint_reused": job.checkpoint_reused,
+        "attempts": job.attempts,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "updated_at": job.updated_at.isoformat(),
+    }
+
+def create_ingestion_job(
+    job_id: str,
+    user_id: str,
+    space_id: str,
+    filename: str,
+    file_id: str,
+    source: str,
+    payload_path: str,
+    content_sha256: Optional[str] = None
+) -> Dict[str, Any]:
+    """Queue a document for background ingestion.
+    """
+    with get_db_session() as session:
+        try:
+            now = datetime.now(timezone.utc)
+            job = IngestionJob(
+                id=job_id,
+                user_id=user_id,
+                space_id=space_id,
+                filename=filename,
+                file_id=file_id,
+                source=source,
+                payload_path=payload_path,
+                content_sha256=content_sha256,
+                status="queued",
+                stage="queued",
+                chunks_total=0,
+                chunks_embedded=0,
+                reused_chunks=0,
+                checkpoint_page=0,
+                checkpoint_chunk=0,
+                checkpoint_char=0,
+                checkpoint_reused=0,
+                attempts=0,
+                created_at=now,
+                updated_at=now
+            )
+            session.add(job)
+            session.commit()
+            logger.info(f"Queued ingestion job {job_id} for '{filename}' in space {space_id}")
+            return _ingestion_job_to_dict(job)
+
+        except Exception as e:
+            logger.error(f"Error creating ingestion job for {filename}: {str(e)}", exc_info=True)
+            session.rollback()
+            raise
+
+def get_ingestion_job(job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+    """Get an ingestion job owned by the user.
+    """
+    with get_db_session() as session:
+        try:
+            job = session.query(IngestionJob).filter(
+                IngestionJob.id == job_id,
+                IngestionJob.user_id == user_id
+            ).first()
+            return _ingestion_job_to_dict(job) if job else None
+
+        except Exception as e:
+            logger.error(f"Error retrieving ingestion job {job_id}: {str(e)}", exc_info=True)
+            raise
+
+def claim_next_ingestion_job(stale_after_seconds: int) -> Optional[Dict[str, Any]]:
+    """Atomically claim the oldest queued job whose retry time has passed, or a running job whose worker stopped reporting.
+
+    SKIP LOCKED lets several workers (or processes) poll the same table without blocking each other.
+    """
+    with get_db_session() as session:
+        try:
+            now = datetime.now(timezone.utc)
+            stale_before = now - timedelta(seconds=stale_after_seconds)
+            job = (
+                session.query(IngestionJob)
+                .filter(
+                    ((IngestionJob.status == "queued")
+                     & (IngestionJob.retry_at.is_(None) | (IngestionJob.retry_at <= now)))
+                    | ((IngestionJob.status == "running") & (IngestionJob.updated_at < stale_before))
+                )
+                .order_by(IngestionJob.created_at)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if not job:
+                return None
+
+            job.status = "running"
+            job.attempts += 1
+            job.updated_at = now
+            session.commit()
+            return _ingestion_job_to_dict(job)
+
+        except Exception as e:
+            logger.error(f"Error claiming ingestion job: {str(e)}", exc_info=True)
+            session.rollback()
+            raise
+
+def update_ingestion_job(job_id: str, **fields: Any) -> None:
+    """Update progress or status fields of an ingestion job.
+    """
+    with get_db_session() as session:
+        try:
+            fields["updated_at"] = datetime.now(timezone.utc)
+            session.query(IngestionJob).filter(IngestionJob.id == job_id).update(fields)
+            session.commit()
+
+        except Exception as e:
+            logger.error(f"Error updating ingestion job {job_id}: {str(e)}", exc_info=True)
+            session.rollback()
+            raise
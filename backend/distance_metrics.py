@@ -0,0 +1,101 @@
+"""Distance metric helpers shared by the schema, ingestion and search.
+
+`DISTANCE_METRIC` picks the pgvector operator and index opclass. For cosine
+and inner product, vectors are stored unit-normalized, so the metrics
+differ only in scale: for unit vectors, squared L2 = 2 - 2 * cos. Thresholds
+are written in L2 units and converted with `convert_threshold`.
+
+`VECTOR_STORAGE` picks what the ANN index holds: the full float32 vector,
+a `halfvec` cast (half the size) or a `binary_quantize` bit string (1/32 of
+the size, Hamming distance). The heap keeps full precision, so compressed
+indexes are only used for the first pass and candidates are rescored.
+
+Gemini embeddings are Matryoshka-style, so with SEARCH_PREFIX_DIMENSION set
+the index is built on the leading dimensions only (`subvector`), optionally
+compressed as above, and candidates are reranked with the full vector.
+"""
+import math
+from typing import Dict, List, Sequence
+
+L2 = "l2"
+COSINE = "cosine"
+INNER_PRODUCT = "inner_product"
+
+OPERATORS: Dict[str, str] = {
+    L2: "<->",
+    COSINE: "<=>",
+    # pgvector returns the *negative* inner product so smaller is closer
+    INNER_PRODUCT: "<#>",
+}
+
+OPCLASSES: Dict[str, str] = {
+    L2: "vector_l2_ops",
+    COSINE: "vector_cosine_ops",
+    INNER_PRODUCT: "vector_ip_ops",
+}
+
+FULL = "full"
+HALFVEC = "halfvec"
+BINARY = "binary"
+
+
+def index_metric(metric: str, prefix_dimension: int = 0) -> str:
+    """A prefix of a unit vector is not unit length, so inner product is ranked by cosine there."""
+    if prefix_dimension and metric == INNER_PRODUCT:
+        return COSINE
+    return metric
+
+
+def index_opclass(metric: str, storage: str = FULL) -> str:
+    if storage == BINARY:
+        return "bit_hamming_ops"
+    if storage == HALFVEC:
+        return OPCLASSES[metric].replace("vector_", "halfvec_", 1)
+    return OPCLASSES[metric]
+
+
+def storage_expression(column: str, storage: str, dimension: int, prefix_dimension: int = 0) -> str:
+    """SQL for the value the index is built on; must match the index expression exactly."""
+    if prefix_dimension:
+        column = f"(subvector({column}, 1, {prefix_dimension})::vector({prefix_dimension}))"
+        dimension = prefix_dimension
+    if storage == HALFVEC:
+        return f"({column}::halfvec({dimension}))"
+    if storage == BINARY:
+        return f"(binary_quantize({column})::bit({dimension}))"
+    return column
+
+
+def distance_sql(
+    column: str,
+    query: str,
+    metric: str,
+    storage: str = FULL,
+    dimension: int = 0,
+    prefix_dimension: int = 0,
+) -> str:
+    operator = "<~>" if storage == BINARY else OPERATORS[index_metric(metric, prefix_dimension)]
+    return (
+        f"{storage_expression(column, storage, dimension, prefix_dimension)} {operator} "
+        f"{storage_expression(query, storage, dimension, prefix_dimension)}"
+    )
+
+
+def normalizes(metric: str) -> bool:
+    return metric != L2
+
+
+def normalize(vector: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm == 0:
+        return list(vector)
+    return [x / norm for x in vector]
+
+
+def convert_threshold(l2_threshold: float, metric: str) -> float:
+    """Convert an L2 distance threshold to the equivalent distance for `metric`."""
+    if metric == COSINE:
+        return l2_threshold * l2_threshold / 2
+    if metric == INNER_PRODUCT:
+        return l2_threshold * l2_threshold / 2 - 1
+    return l2_threshold
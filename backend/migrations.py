@@ -0,0 +1,205 @@
+"""Idempotent schema migrations for databases created before a column or index existed.
+
+`Base.metadata.create_all` only creates missing tables, so columns added to
+existing tables are applied here. Run with `python migrations.py`.
+Each migration is committed when it returns; backfills over the documents
+table also commit after every batch, so locks are held briefly and a rerun
+continues where an interrupted one stopped.
+"""
+import logging
+from typing import Callable, List, Tuple
+
+from sqlalchemy import text as sql_text
+
+from config.config import settings
+from constants import EMBEDDING_NORMALIZE_BATCH, FULL_TEXT_CONFIG, TOKEN_COUNT_BACKFILL_BATCH
+from db_utils import engine
+from distance_metrics import normalizes
+from pdf_utils import count_tokens
+from vector_index import INDEX_NAME, VectorIndexManager
+
+logger = logging.getLogger(__name__)
+
+
+def _document_content_hash(connection) -> None:
+    connection.execute(sql_text(
+        "ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)"
+    ))
+    connection.execute(sql_text(
+        "CREATE INDEX IF NOT EXISTS ix_documents_content_hash ON documents (content_hash)"
+    ))
+    # Existing rows were embedded with the current model and used the filename as title
+    result = connection.execute(
+        sql_text("""
+            UPDATE documents
+            SET content_hash = encode(sha256(convert_to(
+                :model || chr(31) || :dimension || chr(31) || original_file_id || chr(31) || text,
+                'UTF8'
+            )), 'hex')
+            WHERE content_hash IS NULL
+        """),
+        {"model": settings.EMBEDDING_MODEL, "dimension": str(settings.EMBEDDING_DIMENSION)},
+    )
+    logger.info(f"Backfilled content_hash for {result.rowcount} chunks")
+
+
+def _normalize_embeddings(connection) -> None:
+    if not normalizes(settings.DISTANCE_METRIC):
+        return
+    # l2_normalize needs pgvector >= 0.7; already-unit rows are skipped so reruns are cheap
+    normalized = 0
+    after = 0
+    while True:
+        ids = connection.execute(sql_text("""
+            WITH batch AS (
+                SELECT id FROM documents
+                WHERE id > :after AND abs(vector_norm(embedding) - 1) > 1e-6
+                ORDER BY id
+                LIMIT :batch
+            )
+            UPDATE documents AS d
+            SET embedding = l2_normalize(d.embedding)
+            FROM batch
+            WHERE d.id = batch.id
+            RETURNING d.id
+        """), {"after": after, "batch": EMBEDDING_NORMALIZE_BATCH}).scalars().all()
+        if not ids:
+            break
+        connection.commit()
+        normalized += len(ids)
+        after = max(ids)
+    logger.info(f"Normalized {normalized} stored embeddings for {settings.DISTANCE_METRIC} distance")
+
+
+def _embedding_index_opclass(connection) -> None:
+    """Rebuild embedding indexes built for a different index type, metric, VECTOR_STORAGE or search prefix.
+
+    Rows need no rewrite for halfvec/binary storage: the index is built on a
+    cast of the full-precision column. Use `python vector_index.py rebuild`
+    instead to switch a large table without blocking writes.
+    """
+    manager = VectorIndexManager()
+    expected_prefix = (
+        f"subvector(embedding, 1, {manager.prefix_dimension})" if manager.prefix_dimension else None
+    )
+    stale = connection.execute(sql_text("""
+        SELECT i.indexname
+        FROM pg_indexes AS i
+        JOIN pg_namespace AS n ON n.nspname = i.schemaname
+        JOIN pg_class AS c ON c.relname = i.indexname AND c.relnamespace = n.oid
+        JOIN pg_am AS am ON am.oid = c.relam
+        WHERE i.tablename = 'documents'
+          AND i.indexname LIKE :name
+          AND (
+            am.amname <> :index_type
+            OR i.indexdef !~ ('[( ]' || :opclass || '\\M')
+            OR (CAST(:prefix AS text) IS NULL AND i.indexdef LIKE '%subvector(%')
+            OR (CAST(:prefix AS text) IS NOT NULL AND strpos(i.indexdef, :prefix) = 0)
+          )
+    """), {
+        "name": f"{INDEX_NAME}%",
+        "index_type": manager.index_type,
+        "opclass": manager.opclass,
+        "prefix": expected_prefix,
+    }).scalars().all()
+    if not stale:
+        return
+
+    # Per-space partial indexes are recreated by the ingestion worker as spaces grow
+    for name in stale:
+        connection.execute(sql_text(f"DROP INDEX IF EXISTS {name}"))
+    connection.execute(sql_text(
+        manager.index_ddl(INDEX_NAME, manager.index_options(None), concurrently=False)
+    ))
+    logger.info(
+        f"Rebuilt embedding index as {manager.index_type} with {manager.opclass} "
+        f"(dropped {len(stale)} stale indexes)"
+    )
+
+
+def _document_text_search(connection) -> None:
+    # Adding a stored generated column rewrites the table once
+    connection.execute(sql_text(
+        "ALTER TABLE documents ADD COLUMN IF NOT EXISTS text_search tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('{FULL_TEXT_CONFIG}', text)) STORED"
+    ))
+    connection.execute(sql_text(
+        "CREATE INDEX IF NOT EXISTS ix_documents_text_search ON documents USING gin (text_search)"
+    ))
+
+
+def _document_token_count(connection) -> None:
+    connection.execute(sql_text("ALTER TABLE documents ADD COLUMN IF NOT EXISTS token_count INTEGER"))
+    backfilled = 0
+    while True:
+        rows = connection.execute(sql_text(
+            "SELECT id, text FROM documents WHERE token_count IS NULL ORDER BY id LIMIT :batch"
+        ), {"batch": TOKEN_COUNT_BACKFILL_BATCH}).all()
+        if not rows:
+            break
+        connection.execute(
+            sql_text("UPDATE documents SET token_count = :token_count WHERE id = :id"),
+            [{"id": row.id, "token_count": count_tokens(row.text)} for row in rows],
+        )
+        connection.commit()
+        backfilled += len(rows)
+    logger.info(f"Backfilled token_count for {backfilled} chunks")
+
+
+def _document_chunk_positions(connection) -> None:
+    # Older chunks keep NULL positions; they were cut from token slices, not the extracted text
+    for column in ("char_start", "char_end", "page_start", "page_end"):
+        connection.execute(sql_text(f"ALTER TABLE documents ADD COLUMN IF NOT EXISTS {column} INTEGER"))
+
+
+def _ingestion_job_content_sha256(connection) -> None:
+    connection.execute(sql_text(
+        "ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS content_sha256 VARCHAR(64)"
+    ))
+
+
+def _ingestion_job_checkpoints(connection) -> None:
+    for column in ("checkpoint_page", "checkpoint_chunk", "checkpoint_char", "checkpoint_reused"):
+        connection.execute(sql_text(
+            f"ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS {column} INTEGER NOT NULL DEFAULT 0"
+        ))
+
+
+def _space_content_version(connection) -> None:
+    connection.execute(sql_text(
+        "ALTER TABLE spaces ADD COLUMN IF NOT EXISTS content_version VARCHAR(32) NOT NULL DEFAULT ''"
+    ))
+
+
+def _ingestion_job_retry_at(connection) -> None:
+    connection.execute(sql_text(
+        "ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS retry_at TIMESTAMP"
+    ))
+
+
+MIGRATIONS: List[Tuple[str, Callable]] = [
+    ("document_content_hash", _document_content_hash),
+    ("normalize_embeddings", _normalize_embeddings),
+    ("embedding_index_opclass", _embedding_index_opclass),
+    ("document_text_search", _document_text_search),
+    ("document_token_count", _document_token_count),
+    ("document_chunk_positions", _document_chunk_positions),
+    ("ingestion_job_content_sha256", _ingestion_job_content_sha256),
+    ("ingestion_job_checkpoints", _ingestion_job_checkpoints),
+    ("space_content_version", _space_content_version),
+    ("ingestion_job_retry_at", _ingestion_job_retry_at),
+]
+
+
+def run_migrations() -> None:
+    for name, migration in MIGRATIONS:
+        logger.info(f"Applying migration: {name}")
+        with engine.connect() as connection:
+            migration(connection)
+            connection.commit()
+    logger.info("Migrations complete")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    run_migrations()
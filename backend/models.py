@@ -8,6 +8,7 @@ class AskRequest(BaseModel):
     is_first_message: bool = Field(default=False, description="Flag to clear chat history")
     answer_provider: Optional[str] = Field(default=None, description="Model provider override: 'openrouter' or 'gemini'")
     answer_model: Optional[str] = Field(default=None, description="Model name override")
+    use_semantic_cache: bool = Field(default=True, description="Allow answers cached for similar earlier questions")
 
 
 class RenameSpaceRequest(BaseModel):
@@ -25,6 +26,9 @@ class DebugInfo(BaseModel):
     context_tokens: int
     chunks_used: int
     chunks_available: int
+    search_plan: Optional[str] = None
+    cache_hit: bool = False
+    cache_similarity: Optional[float] = None
 
 
 class AskResponse(BaseModel):
@@ -38,9 +42,26 @@ class ErrorResponse(BaseModel):
 
 
 class UploadResponse(BaseModel):
+    """A queued upload; chunk counts are reported by IngestionJobResponse once it runs."""
     fileid: str
-    chunk_count: int
     filename: Optional[str] = None
+    job_id: str
+    status: str
+
+
+class IngestionJobResponse(BaseModel):
+    job_id: str
+    status: str
+    stage: str
+    filename: str
+    fileid: str
+    space_id: str
+    chunks_total: int
+    chunks_embedded: int
+    reused_chunks: int
+    error: Optional[str] = None
+    created_at: str
+    updated_at: str
 
 
 class SpaceResponse(BaseModel):
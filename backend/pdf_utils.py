@@ -1,69 +1,443 @@
+import io
 import logging
+import math
+import multiprocessing
 import os
-from typing import List, Optional
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from collections import deque
+from itertools import islice
+from typing import BinaryIO, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 
 from PyPDF2 import PdfReader
 import tiktoken
 
-from constants import CHUNK_TOKENS, CHUNK_OVERLAP, TIKTOKEN_ENCODING, MAX_PDF_PAGES
+from constants import (
+    CHUNK_TOKENS,
+    CHUNK_OVERLAP,
+    TIKTOKEN_ENCODING,
+    MAX_PDF_PAGES,
+    PDF_EXTRACT_PROCESSES,
+    PDF_PARALLEL_MIN_PAGES,
+    PDF_PAGES_PER_TASK,
+)
 
 logger = logging.getLogger(__name__)
 
+# (page number, text); page is None for plain-text sources
+Page = Tuple[Optional[int], str]
+# Document content in memory, or a binary file such as a spooled upload
+DocumentSource = Union[bytes, BinaryIO]
 
-def extract_text(file_path: str) -> Optional[str]:
-    ext = os.path.splitext(file_path)[1].lower()
 
+class TextChunk(NamedTuple):
+    """A chunk, its token count and where it sits in the extracted text."""
+    text: str
+    token_count: int
+    char_start: int
+    char_end: int
+    page_start: Optional[int] = None
+    page_end: Optional[int] = None
+
+
+class _Unit(NamedTuple):
+    text: str
+    tokens: int
+    start: int
+    page: Optional[int]
+    paragraph_end: bool
+
+
+_SENTENCE_END = re.compile(r'[.!?]["\')\]]*(?=\s)')
+_PARAGRAPH_BREAK = re.compile(r'\n[ \t]*\n')
+_WORD = re.compile(r'\s*\S+\s*$|\s*\S+')
+
+
+def extract_text(file_path: str) -> Optional[str]:
     try:
-        if ext in [".txt", ".md"]:
-            return _extract_from_text_file(file_path)
-        elif ext == ".pdf":
-            return _extract_from_pdf(file_path)
-        else:
-            raise ValueError("Unsupported file type. Only .pdf, .txt, and .md are allowed.")
+        return "\n".join(text for _, text in iter_pages(file_path))
 
     except Exception as e:
         logger.error(f"Error extracting text from {file_path}: {str(e)}", exc_info=True)
         return None
 
 
-def _extract_from_text_file(file_path: str) -> str:
-    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-        return f.read().replace("\x00", "")
+def iter_pages(file_path: str) -> Iterator[Page]:
+    """Yield the text of a document file page by page."""
+    with open(file_path, "rb") as f:
+        yield from iter_document_pages(f, file_path)
+
+
+def iter_document_pages(
+    source: DocumentSource,
+    filename: str,
+    start_page: int = 0,
+    max_pages: int = MAX_PDF_PAGES,
+    stop_page: Optional[int] = None
+) -> Iterator[Page]:
+    """Yield the text of an uploaded document page by page without copying it to disk.
 
+    `source` is the content itself or a binary file at its start. PDF pages are
+    extracted in parallel on the extraction process pool and come back in page
+    order, so chunking can start on the first pages. Only PDF pages
+    [`start_page`, `stop_page`) are read, so an ingest can resume or go in batches.
+    """
+    ext = os.path.splitext(filename)[1].lower()
 
-def _extract_from_pdf(file_path: str) -> str:
-    reader = PdfReader(file_path)
+    if ext in [".txt", ".md"]:
+        yield None, _decode_text(source if isinstance(source, bytes) else source.read())
+    elif ext == ".pdf":
+        yield from _iter_pdf_pages(source, start_page, max_pages, stop_page)
+    else:
+        raise ValueError("Unsupported file type. Only .pdf, .txt, and .md are allowed.")
+
+
+def _decode_text(content: bytes) -> str:
+    # Same result as reading the file in text mode: invalid bytes dropped, newlines universal
+    text = content.decode("utf-8", errors="ignore")
+    return text.replace("\r\n", "\n").replace("\r", "\n").replace("\x00", "")
+
+
+def pdf_page_count(source: DocumentSource) -> int:
+    reader = PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+    return len(reader.pages)
+
+
+def _iter_pdf_pages(
+    source: DocumentSource,
+    start_page: int,
+    max_pages: int,
+    stop_page: Optional[int] = None
+) -> Iterator[Page]:
+    reader = PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
     num_pages = len(reader.pages)
 
-    if num_pages > MAX_PDF_PAGES:
-        raise ValueError(f"PDF has {num_pages} pages. Maximum allowed is {MAX_PDF_PAGES} pages.")
+    if num_pages > max_pages:
+        raise ValueError(f"PDF has {num_pages} pages. Maximum allowed is {max_pages} pages.")
+    if stop_page is not None:
+        num_pages = min(num_pages, stop_page)
+
+    ranges = _page_ranges(start_page, num_pages)
+    pool = get_extraction_pool() if len(ranges) > 1 else None
+    with ExitStack() as stack:
+        if pool is None:
+            results = (_extract_pages(reader, start, stop) for start, stop in ranges)
+        else:
+            results = _extract_on_pool(pool, stack.enter_context(_pool_path(source)), ranges)
+
+        done = start_page
+        try:
+            for (_, stop), pages in zip(ranges, results):
+                yield from pages
+                done = stop
+        except BrokenProcessPool:
+            logger.warning("PDF extraction pool is unavailable; extracting the rest in this process")
+            shutdown_extraction_pool()
+            yield from _extract_pages(reader, done, num_pages)
+
 
-    text_parts = []
+def _page_ranges(start_page: int, num_pages: int) -> List[Tuple[int, int]]:
+    remaining = num_pages - start_page
+    if remaining <= 0:
+        return []
+    if remaining < PDF_PARALLEL_MIN_PAGES or _extraction_workers() < 2:
+        return [(start_page, num_pages)]
+    # A few small ranges per worker keeps pages streaming back in order without
+    # sending the whole PDF to the pool once per page
+    size = min(PDF_PAGES_PER_TASK, max(1, math.ceil(remaining / (_extraction_workers() * 2))))
+    return [(start, min(start + size, num_pages)) for start in range(start_page, num_pages, size)]
 
-    for i, page in enumerate(reader.pages):
-        page_text = page.extract_text()
+
+def _extract_on_pool(
+    pool: ProcessPoolExecutor,
+    path: str,
+    ranges: List[Tuple[int, int]]
+) -> Iterator[List[Page]]:
+    """Yield range results in order, with at most two ranges per worker in flight.
+
+    Bounding the window keeps memory flat however long the PDF is, even when
+    the consumer (embedding) is slower than extraction.
+    """
+    pending = deque()
+    remaining = iter(ranges)
+    for start, stop in islice(remaining, _extraction_workers() * 2):
+        pending.append(pool.submit(_extract_page_range, path, start, stop))
+    try:
+        while pending:
+            pages = pending.popleft().result()
+            for start, stop in islice(remaining, 1):
+                pending.append(pool.submit(_extract_page_range, path, start, stop))
+            yield pages
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+@contextmanager
+def _pool_path(source: DocumentSource) -> Iterator[str]:
+    """Path pool workers open the PDF from.
+
+    Spooled uploads are already on disk. Anything else is written to a temporary
+    file once, rather than pickled into every range task.
+    """
+    name = getattr(source, "name", None)
+    if not isinstance(source, bytes) and isinstance(name, str) and os.path.isfile(name):
+        yield name
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as spooled:
+        if isinstance(source, bytes):
+            spooled.write(source)
+        else:
+            source.seek(0)
+            shutil.copyfileobj(source, spooled)
+    try:
+        yield spooled.name
+    finally:
+        os.remove(spooled.name)
+
+
+def _extract_page_range(path: str, start: int, stop: int) -> List[Page]:
+    """Extract pages [start, stop); runs in a pool process, so it only takes picklable arguments."""
+    return _extract_pages(PdfReader(path), start, stop)
+
+
+def _extract_pages(reader: PdfReader, start: int, stop: int) -> List[Page]:
+    pages = []
+    for i in range(start, stop):
+        page_text = reader.pages[i].extract_text()
         if page_text and page_text.strip():
-            text_parts.append(page_text)
+            pages.append((i + 1, page_text.replace("\x00", "")))
+    return pages
 
-    return "\n".join(text_parts).replace("\x00", "")
 
+_extraction_pool: Optional[ProcessPoolExecutor] = None
+_extraction_pool_lock = threading.Lock()
 
-def chunk_text(
-    text: str,
+
+def _extraction_workers() -> int:
+    return min(PDF_EXTRACT_PROCESSES, os.cpu_count() or 1)
+
+
+def get_extraction_pool() -> Optional[ProcessPoolExecutor]:
+    """Process pool for PDF text extraction, which is CPU-bound and holds the GIL.
+
+    Workers are spawned rather than forked because the API process runs threads.
+    """
+    global _extraction_pool
+    if _extraction_workers() < 2:
+        return None
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            try:
+                _extraction_pool = ProcessPoolExecutor(
+                    max_workers=_extraction_workers(),
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            except (OSError, NotImplementedError) as e:
+                logger.warning(f"Cannot start PDF extraction pool, extracting in-process: {str(e)}")
+                return None
+        return _extraction_pool
+
+
+def shutdown_extraction_pool() -> None:
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is not None:
+            _extraction_pool.shutdown(wait=False, cancel_futures=True)
+            _extraction_pool = None
+
+
+@lru_cache(maxsize=None)
+def get_encoder() -> tiktoken.Encoding:
+    return tiktoken.get_encoding(TIKTOKEN_ENCODING)
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoder().encode(text))
+
+
+def iter_chunks(
+    pages: Iterable[Page],
     chunk_tokens: int = CHUNK_TOKENS,
-    overlap: int = CHUNK_OVERLAP
-) -> List[str]:
-    text = text.replace("\x00", "")
-    encoder = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+    overlap: int = CHUNK_OVERLAP,
+    char_offset: int = 0
+) -> Iterator[TextChunk]:
+    """Chunk extracted pages in one pass, yielding each chunk as soon as it is complete.
+
+    Chunks end on a sentence, preferring a paragraph or page end once half the
+    budget is used, and start with up to `overlap` tokens of whole sentences from
+    the previous chunk. Pieces are encoded once to fill the budget; each chunk's
+    token count encodes its final text, so it matches `count_tokens(chunk.text)`
+    as stored for older rows. Offsets index into the pages joined with newlines, the way
+    `extract_text` returns them; pass `char_offset` (see `pages_end_offset`) when
+    `pages` continue a document chunked in parts.
+    """
+    encoder = get_encoder()
+    window: List[_Unit] = []
+    window_tokens = 0
+    carried = 0  # leading units repeated from the previous chunk
+
+    for piece in _iter_pieces(pages, char_offset):
+        for unit in _fit(piece, encoder, chunk_tokens):
+            while window and window_tokens + unit.tokens > chunk_tokens:
+                if carried == len(window):
+                    # Only the overlap is left and it does not fit next to this unit
+                    window, window_tokens, carried = [], 0, 0
+                    break
+                cut = _cut_index(window, carried, chunk_tokens)
+                chunk = _make_chunk(window[:cut], encoder)
+                if chunk:
+                    yield chunk
+                tail = _overlap_tail(window[:cut], overlap)
+                window = tail + window[cut:]
+                window_tokens = sum(u.tokens for u in window)
+                carried = len(tail)
+
+            window.append(unit)
+            window_tokens += unit.tokens
+
+    if len(window) > carried:
+        chunk = _make_chunk(window, encoder)
+        if chunk:
+            yield chunk
+
+
+def pages_end_offset(pages: Iterable[Page], char_offset: int = 0) -> int:
+    """Offset just past `pages` when they start at `char_offset` of the joined text."""
+    for page, page_text in pages:
+        char_offset += len(page_text.replace("\x00", "")) + (1 if char_offset else 0)
+    return char_offset
+
+
+def _iter_pieces(pages: Iterable[Page], char_offset: int = 0) -> Iterator[Tuple[str, int, Optional[int], bool]]:
+    """Cut pages at sentence, paragraph and page ends into (text, start, page, paragraph_end).
+
+    Pieces are contiguous; whitespace between two cuts stays with the piece before it.
+    """
+    offset = char_offset
+    for page, page_text in pages:
+        page_text = page_text.replace("\x00", "")
+        if offset:
+            # Pages are joined with a newline
+            page_text = "\n" + page_text
+
+        previous = None
+        position = 0
+        for end, paragraph_end in _boundaries(page_text):
+            piece = page_text[position:end]
+            if not piece:
+                continue
+            if previous is None:
+                previous = (piece, offset + position, page, paragraph_end)
+            elif not piece.strip():
+                previous = (previous[0] + piece, previous[1], page, previous[3] or paragraph_end)
+            elif not previous[0].strip():
+                previous = (previous[0] + piece, previous[1], page, paragraph_end)
+            else:
+                yield previous
+                previous = (piece, offset + position, page, paragraph_end)
+            position = end
+
+        if previous is not None:
+            yield previous
+        offset += len(page_text)
+
+
+def _boundaries(text: str) -> List[Tuple[int, bool]]:
+    cuts = {match.end(): False for match in _SENTENCE_END.finditer(text)}
+    cuts.update({match.start(): True for match in _PARAGRAPH_BREAK.finditer(text)})
+    cuts[len(text)] = True
+    return sorted(cuts.items())
+
+
+def _fit(
+    piece: Tuple[str, int, Optional[int], bool],
+    encoder: tiktoken.Encoding,
+    chunk_tokens: int
+) -> Iterator[_Unit]:
+    """Turn a piece into units no longer than a chunk, splitting between words if needed."""
+    text, start, page, paragraph_end = piece
     tokens = encoder.encode(text)
-    chunks = []
+    if len(tokens) <= chunk_tokens:
+        yield _Unit(text, len(tokens), start, page, paragraph_end)
+        return
+
+    words = list(_WORD.finditer(text))
+    for i, word in enumerate(words):
+        last = i == len(words) - 1
+        word_tokens = encoder.encode(word.group())
+        if len(word_tokens) <= chunk_tokens:
+            yield _Unit(word.group(), len(word_tokens), start + word.start(), page, paragraph_end and last)
+            continue
+        # A single "word" longer than a chunk (e.g. an inline blob) is cut on tokens
+        position = start + word.start()
+        for j in range(0, len(word_tokens), chunk_tokens):
+            sliced = word_tokens[j:j + chunk_tokens]
+            sliced_text = encoder.decode(sliced)
+            end_of_word = j + chunk_tokens >= len(word_tokens)
+            yield _Unit(sliced_text, len(sliced), position, page, paragraph_end and last and end_of_word)
+            position += len(sliced_text)
+
 
-    step_size = chunk_tokens - overlap
+def _cut_index(window: List[_Unit], carried: int, chunk_tokens: int) -> int:
+    # End on the last paragraph or page break once half the budget is used, otherwise on a sentence
+    tokens = 0
+    cut = len(window)
+    for i, unit in enumerate(window):
+        tokens += unit.tokens
+        if unit.paragraph_end and i >= carried and tokens >= chunk_tokens // 2:
+            cut = i + 1
+    return cut
+
+
+def _overlap_tail(units: List[_Unit], overlap: int) -> List[_Unit]:
+    tail_tokens = 0
+    count = 0
+    for unit in reversed(units[1:]):
+        if tail_tokens + unit.tokens > overlap:
+            break
+        tail_tokens += unit.tokens
+        count += 1
+    return units[len(units) - count:] if count else []
+
+
+def _make_chunk(units: List[_Unit], encoder: tiktoken.Encoding) -> Optional[TextChunk]:
+    text = "".join(unit.text for unit in units)
+    stripped = text.strip()
+    if not stripped:
+        return None
+    char_start = units[0].start + len(text) - len(text.lstrip())
+    return TextChunk(
+        text=stripped,
+        token_count=len(encoder.encode(stripped)),
+        char_start=char_start,
+        char_end=char_start + len(stripped),
+        page_start=units[0].page,
+        page_end=units[-1].page,
+    )
 
-    for i in range(0, len(tokens), step_size):
-        chunk_token_slice = tokens[i:i + chunk_tokens]
-        chunk_text = encoder.decode(chunk_token_slice)
-        chunks.append(chunk_text)
 
+def chunk_text_with_token_counts(
+    text: str,
+    chunk_tokens: int = CHUNK_TOKENS,
+    overlap: int = CHUNK_OVERLAP
+) -> List[Tuple[str, int]]:
+    """Chunk text and return each chunk with its token count, so it never has to be re-encoded."""
+    chunks = [(chunk.text, chunk.token_count) for chunk in iter_chunks([(None, text)], chunk_tokens, overlap)]
     logger.info(f"Split text into {len(chunks)} chunks")
     return chunks
+
+
+def chunk_text(
+    text: str,
+    chunk_tokens: int = CHUNK_TOKENS,
+    overlap: int = CHUNK_OVERLAP
+) -> List[str]:
+    return [chunk for chunk, _ in chunk_text_with_token_counts(text, chunk_tokens, overlap)]
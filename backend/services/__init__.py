@@ -1,5 +1,7 @@
 __all__ = [
     "AIService",
+    "AnswerCache",
+    "CachedEmbeddingService",
     "ContextBuilder",
     "DocumentService",
     "GeminiEmbeddingService",
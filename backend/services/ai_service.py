@@ -1,58 +1,269 @@
+import asyncio
 import logging
-from typing import Optional
-from openai import OpenAI
+import threading
+from typing import AsyncIterator, Dict, NamedTuple, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI
 from google import genai
 
 from config.config import settings
-from constants import OPENROUTER_MODEL, OPENROUTER_MODELS, GEMINI_MODEL, GEMINI_MODELS
+from constants import (
+    OPENROUTER_MODEL,
+    OPENROUTER_MODELS,
+    GEMINI_MODEL,
+    GEMINI_MODELS,
+    LLM_TIMEOUT_SECONDS,
+    LLM_CONNECT_TIMEOUT_SECONDS,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_CONCURRENCY,
+    CLASSIFICATION_MODEL,
+    QUERY_TYPE_SPECIFIC,
+    QUERY_TYPE_ANALYZE_ALL,
+    QUERY_TYPE_PREV_CONTEXT,
+    QUERY_TYPE_CROSS_DOCUMENT,
+)
+from prompts import CLASSIFICATION_PROMPT_TEMPLATE
 
 logger = logging.getLogger(__name__)
 
 
-class AIService:
+class ProviderClients(NamedTuple):
+    client: object
+    fallback_client: Optional[object]
+    default_model: str
 
-    def __init__(self):
-        self._init_provider("openrouter")
 
-    def _init_provider(self, provider: str):
-        self.provider = provider.lower()
+class ProviderRegistry:
+    """Builds each provider's clients once per process and keeps them warm.
+
+    Clients are read-only after construction, so concurrent requests can use
+    different providers without touching shared state, and every request
+    reuses the same connection pools.
+    """
 
-        if self.provider == "openrouter":
-            self.client = OpenAI(
-                base_url="https://openrouter.ai/api/v1",
-                api_key=settings.OPENROUTER_API_KEY
+    PROVIDERS = ("openrouter", "gemini")
+
+    def __init__(self):
+        self.httpx_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS),
+            limits=httpx.Limits(
+                max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                max_connections=LLM_MAX_CONNECTIONS
             )
-            self.fallback_client = None
+        )
+        self._providers: Dict[str, ProviderClients] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str) -> ProviderClients:
+        provider = provider.lower()
+        clients = self._providers.get(provider)
+        if clients is None:
+            with self._lock:
+                clients = self._providers.get(provider)
+                if clients is None:
+                    clients = self._build(provider)
+                    self._providers[provider] = clients
+        return clients
+
+    def semaphore(self, provider: str) -> asyncio.Semaphore:
+        if provider not in self._semaphores:
+            self._semaphores[provider] = asyncio.Semaphore(LLM_MAX_CONCURRENCY[provider])
+        return self._semaphores[provider]
+
+    def warm(self) -> None:
+        for provider in self.PROVIDERS:
+            self.get(provider)
+
+    async def aclose(self) -> None:
+        await self.httpx_client.aclose()
+
+    def _build(self, provider: str) -> ProviderClients:
+        logger.info(f"Initializing {provider} client")
+        if provider == "openrouter":
+            fallback_client = None
             if settings.OPENROUTER_API_KEY1:
-                self.fallback_client = OpenAI(
+                fallback_client = AsyncOpenAI(
                     base_url="https://openrouter.ai/api/v1",
-                    api_key=settings.OPENROUTER_API_KEY1
+                    api_key=settings.OPENROUTER_API_KEY1,
+                    http_client=self.httpx_client
                 )
-        elif self.provider == "gemini":
-            self.client = genai.Client(api_key=settings.GEMINI_API_KEY)
-            self.fallback_client = None
+            return ProviderClients(
+                client=AsyncOpenAI(
+                    base_url="https://openrouter.ai/api/v1",
+                    api_key=settings.OPENROUTER_API_KEY,
+                    http_client=self.httpx_client
+                ),
+                fallback_client=fallback_client,
+                default_model=OPENROUTER_MODEL
+            )
+        elif provider == "gemini":
+            return ProviderClients(
+                client=genai.Client(api_key=settings.GEMINI_API_KEY),
+                fallback_client=None,
+                default_model=GEMINI_MODEL
+            )
         else:
-            raise ValueError(f"Unknown ANSWER_PROVIDER: {self.provider}. Must be 'openrouter' or 'gemini'.")
+            raise ValueError(f"Unknown ANSWER_PROVIDER: {provider}. Must be 'openrouter' or 'gemini'.")
 
-    def _resolve_model(self, model: str = None) -> str:
-        if model:
-            return model
-        return OPENROUTER_MODEL if self.provider == "openrouter" else GEMINI_MODEL
 
-    def generate_response(self, prompt: str, max_tokens: int = 2000, provider: str = None, model: str = None) -> Optional[str]:
-        if provider and provider.lower() != self.provider:
-            self._init_provider(provider)
+_provider_registry: Optional[ProviderRegistry] = None
 
-        resolved_model = self._resolve_model(model)
 
-        if self.provider == "openrouter":
-            return self._generate_openrouter(prompt, max_tokens, resolved_model)
-        else:
-            return self._generate_gemini(prompt, max_tokens, resolved_model)
+def get_provider_registry() -> ProviderRegistry:
+    global _provider_registry
+    if _provider_registry is None:
+        _provider_registry = ProviderRegistry()
+    return _provider_registry
+
+
+async def close_provider_registry() -> None:
+    global _provider_registry
+    if _provider_registry is not None:
+        await _provider_registry.aclose()
+        _provider_registry = None
+
+
+class AIService:
+    """Async LLM access for OpenRouter and Gemini.
+
+    Calls are awaitable so in-flight generations do not block the event loop;
+    each provider has its own concurrency limit and a request timeout.
+    The provider is chosen per call from the shared ProviderRegistry.
+    """
+
+    def __init__(self, default_provider: str = "openrouter", registry: Optional[ProviderRegistry] = None):
+        self.default_provider = default_provider
+        self._registry = registry
+
+    @property
+    def registry(self) -> ProviderRegistry:
+        return self._registry or get_provider_registry()
+
+    def _resolve_provider(self, provider: str = None) -> str:
+        return (provider or self.default_provider).lower()
+
+    def resolve_model(self, provider: str = None, model: str = None) -> Tuple[str, str]:
+        """The provider and model a call with these overrides would actually use."""
+        provider = self._resolve_provider(provider)
+        return provider, model or self.registry.get(provider).default_model
+
+    async def generate_response(self, prompt: str, max_tokens: int = 2000, provider: str = None, model: str = None) -> Optional[str]:
+        provider = self._resolve_provider(provider)
+        clients = self.registry.get(provider)
+        resolved_model = model or clients.default_model
+
+        async with self.registry.semaphore(provider):
+            async with asyncio.timeout(LLM_TIMEOUT_SECONDS):
+                if provider == "openrouter":
+                    return await self._generate_openrouter(clients, prompt, max_tokens, resolved_model)
+                else:
+                    return await self._generate_gemini(clients, prompt, max_tokens, resolved_model)
+
+    async def stream_response(self, prompt: str, max_tokens: int = 2000, provider: str = None, model: str = None) -> AsyncIterator[str]:
+        """Yield answer text as the provider streams it."""
+        provider = self._resolve_provider(provider)
+        clients = self.registry.get(provider)
+        resolved_model = model or clients.default_model
+
+        async with self.registry.semaphore(provider):
+            if provider == "openrouter":
+                stream = self._stream_openrouter(clients, prompt, max_tokens, resolved_model)
+            else:
+                stream = self._stream_gemini(clients, prompt, max_tokens, resolved_model)
+            try:
+                while True:
+                    # Each wait, the first token included, has a deadline, so a stalled
+                    # upstream cannot hold the concurrency slot forever
+                    async with asyncio.timeout(LLM_TIMEOUT_SECONDS):
+                        try:
+                            text = await anext(stream)
+                        except StopAsyncIteration:
+                            break
+                    yield text
+            finally:
+                await stream.aclose()
+
+    async def classify(self, query: str) -> str:
+        """Classify a query into one of the QueryService query types."""
+        try:
+            classification_prompt = CLASSIFICATION_PROMPT_TEMPLATE.format(query=query)
+
+            async with self.registry.semaphore("gemini"):
+                async with asyncio.timeout(LLM_TIMEOUT_SECONDS):
+                    response = await self.registry.get("gemini").client.aio.models.generate_content(
+                        model=CLASSIFICATION_MODEL,
+                        contents=classification_prompt,
+                        config={
+                            "temperature": 0.05,
+                            "max_output_tokens": 10,
+                        }
+                    )
+
+            classification = response.text.strip().lower()
+
+            if classification not in [QUERY_TYPE_SPECIFIC, QUERY_TYPE_ANALYZE_ALL, QUERY_TYPE_PREV_CONTEXT, QUERY_TYPE_CROSS_DOCUMENT]:
+                logger.warning(f"Invalid classification '{classification}', defaulting to 'specific'")
+                classification = QUERY_TYPE_SPECIFIC
+
+            logger.info(f"Query classified as: {classification}")
+            return classification
+
+        except Exception as e:
+            logger.error(f"Error classifying query with AI: {str(e)}, defaulting to 'specific'")
+            return QUERY_TYPE_SPECIFIC
+
+    async def _stream_openrouter(self, clients: ProviderClients, prompt: str, max_tokens: int, model: str) -> AsyncIterator[str]:
+        candidates = [clients.client] + ([clients.fallback_client] if clients.fallback_client else [])
+
+        for attempt, client in enumerate(candidates):
+            started = False
+            try:
+                stream = await client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=max_tokens,
+                    stream=True
+                )
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        started = True
+                        yield delta
+                return
+
+            except Exception as e:
+                # Only fall back if nothing has been sent yet; a half-streamed answer cannot be retried
+                if started or attempt == len(candidates) - 1:
+                    logger.error(f"Error streaming AI response: {str(e)}")
+                    raise
+                logger.error(f"Error streaming AI response with primary key: {str(e)}")
+                logger.info("Attempting to use fallback OpenRouter API key...")
+
+    async def _stream_gemini(self, clients: ProviderClients, prompt: str, max_tokens: int, model: str) -> AsyncIterator[str]:
+        try:
+            stream = await clients.client.aio.models.generate_content_stream(
+                model=model,
+                contents=prompt,
+                config={
+                    "temperature": 0.4,
+                    "max_output_tokens": max_tokens,
+                }
+            )
+            async for chunk in stream:
+                if chunk.text:
+                    yield chunk.text
+
+        except Exception as e:
+            logger.error(f"Error streaming AI response with Gemini: {str(e)}")
+            raise
 
-    def _generate_openrouter(self, prompt: str, max_tokens: int, model: str) -> Optional[str]:
+    async def _generate_openrouter(self, clients: ProviderClients, prompt: str, max_tokens: int, model: str) -> Optional[str]:
         try:
-            response = self.client.chat.completions.create(
+            response = await clients.client.chat.completions.create(
                 model=model,
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=max_tokens
@@ -67,10 +278,10 @@ class AIService:
         except Exception as e:
             logger.error(f"Error generating AI response with primary key: {str(e)}")
 
-            if self.fallback_client:
+            if clients.fallback_client:
                 logger.info("Attempting to use fallback OpenRouter API key...")
                 try:
-                    response = self.fallback_client.chat.completions.create(
+                    response = await clients.fallback_client.chat.completions.create(
                         model=model,
                         messages=[{"role": "user", "content": prompt}],
                         max_tokens=max_tokens
@@ -89,9 +300,9 @@ class AIService:
             else:
                 raise
 
-    def _generate_gemini(self, prompt: str, max_tokens: int, model: str) -> Optional[str]:
+    async def _generate_gemini(self, clients: ProviderClients, prompt: str, max_tokens: int, model: str) -> Optional[str]:
         try:
-            response = self.client.models.generate_content(
+            response = await clients.client.aio.models.generate_content(
                 model=model,
                 contents=prompt,
                 config={
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from cachetools import TTLCache
+
+from config.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Collapse case, whitespace and trailing punctuation so trivial rewordings share an entry."""
+    return re.sub(r"[\s?!.]+$", "", " ".join(query.casefold().split()))
+
+
+class MemoryAnswerBackend:
+    """LRU/TTL store inside this process; each API process keeps its own."""
+
+    name = "memory"
+
+    def __init__(self, maxsize: int, ttl_seconds: int) -> None:
+        self._entries: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = value
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": int(self._entries.maxsize)}
+
+    def close(self) -> None:
+        pass
+
+
+class RedisAnswerBackend:
+    """
+    Store shared by every API process on any Redis-compatible server
+    (Redis, Valkey, KeyDB, ...). Entries expire after the TTL; LRU eviction
+    is left to the server's `maxmemory-policy allkeys-lru`.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, ttl_seconds: int, prefix: str = "papertalk:answer:") -> None:
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("ANSWER_CACHE_BACKEND=redis requires the 'redis' package") from e
+
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, socket_timeout=1.0)
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._client.get(self.prefix + key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key: str, value: str) -> None:
+        self._client.set(self.prefix + key, value, ex=self.ttl_seconds)
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+    def close(self) -> None:
+        self._client.close()
+
+
+class AnswerCache:
+    """
+    Whole /ask results keyed by (space, space content version, normalized
+    query, provider, model). Uploads and deletions replace the space's
+    content version, so answers over old content are never looked up again
+    and age out of the backend. A failing backend is treated as a miss.
+    """
+
+    def __init__(self, backend) -> None:
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, space_id: str, content_version: str, query: str, provider: str, model: str) -> Optional[Dict[str, Any]]:
+        try:
+            value = self.backend.get(self._key(space_id, content_version, query, provider, model))
+        except Exception as e:
+            logger.warning(f"Answer cache lookup failed: {str(e)}")
+            value = None
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(value)
+
+    def put(
+        self,
+        space_id: str,
+        content_version: str,
+        query: str,
+        provider: str,
+        model: str,
+        result: Dict[str, Any],
+    ) -> None:
+        try:
+            self.backend.set(
+                self._key(space_id, content_version, query, provider, model),
+                json.dumps(result, default=str),
+            )
+        except Exception as e:
+            logger.warning(f"Answer cache store failed: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {"backend": self.backend.name, "hits": self.hits, "misses": self.misses}
+        stats.update(self.backend.stats())
+        return stats
+
+    def close(self) -> None:
+        self.backend.close()
+
+    @staticmethod
+    def _key(space_id: str, content_version: str, query: str, provider: str, model: str) -> str:
+        parts = (space_id, content_version, normalize_query(query), provider, model)
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class SemanticAnswerCache:
+    """
+    Past answers indexed by query embedding for paraphrased questions.
+    Entries are grouped by (space, content version, provider, model); a
+    lookup returns the closest answer in the group if its cosine similarity
+    reaches `threshold`. Each group keeps its newest `max_per_scope`
+    entries and scans them with one matrix product; every entry expires
+    `ttl_seconds` after it was stored. In-process only.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        max_per_scope: int,
+        max_scopes: int,
+        ttl_seconds: int,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.threshold = threshold
+        self.max_per_scope = max_per_scope
+        self.ttl_seconds = ttl_seconds
+        self._timer = timer
+        # scope -> (unit vectors as rows, serialized results, store times); idle scopes
+        # are dropped after the TTL, entries in busy ones expire one by one
+        self._scopes: TTLCache = TTLCache(maxsize=max_scopes, ttl=ttl_seconds, timer=timer)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        space_id: str,
+        content_version: str,
+        provider: str,
+        model: str,
+        embedding: List[float],
+    ) -> Optional[Tuple[Dict[str, Any], float]]:
+        """The closest cached result and its similarity, or None below the threshold."""
+        query = self._unit(embedding)
+        with self._lock:
+            entry = self._scopes.get((space_id, content_version, provider, model))
+            if entry is not None and len(query) == entry[0].shape[1]:
+                similarities = np.where(self._live(entry[2]), entry[0] @ query, -np.inf)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.hits += 1
+                    return json.loads(entry[1][best]), float(similarities[best])
+            self.misses += 1
+            return None
+
+    def put(
+        self,
+        space_id: str,
+        content_version: str,
+        provider: str,
+        model: str,
+        embedding: List[float],
+        result: Dict[str, Any],
+    ) -> None:
+        scope = (space_id, content_version, provider, model)
+        vector = self._unit(embedding)[np.newaxis, :]
+        value = json.dumps(result, default=str)
+        with self._lock:
+            now = np.array([self._timer()])
+            entry = self._scopes.get(scope)
+            if entry is None or entry[0].shape[1] != vector.shape[1]:
+                vectors, values, stored = vector, [value], now
+            else:
+                live = self._live(entry[2])
+                vectors = np.vstack([entry[0][live], vector])[-self.max_per_scope:]
+                values = ([v for v, keep in zip(entry[1], live) if keep] + [value])[-self.max_per_scope:]
+                stored = np.concatenate([entry[2][live], now])[-self.max_per_scope:]
+            self._scopes[scope] = (vectors, values, stored)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "scopes": len(self._scopes),
+                "threshold": self.threshold,
+            }
+
+    def _live(self, stored: np.ndarray) -> np.ndarray:
+        return stored > self._timer() - self.ttl_seconds
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+_answer_cache: Optional[AnswerCache] = None
+_semantic_answer_cache: Optional[SemanticAnswerCache] = None
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """The process-wide answer cache, or None when ANSWER_CACHE_BACKEND is "off"."""
+    global _answer_cache
+    if _answer_cache is None and settings.ANSWER_CACHE_BACKEND != "off":
+        if settings.ANSWER_CACHE_BACKEND == "redis":
+            backend = RedisAnswerBackend(settings.ANSWER_CACHE_URL, settings.ANSWER_CACHE_TTL_SECONDS)
+        else:
+            backend = MemoryAnswerBackend(settings.ANSWER_CACHE_SIZE, settings.ANSWER_CACHE_TTL_SECONDS)
+        _answer_cache = AnswerCache(backend)
+        logger.info(f"Answer cache enabled ({backend.name})")
+    return _answer_cache
+
+
+def get_semantic_answer_cache() -> Optional[SemanticAnswerCache]:
+    """The process-wide semantic answer cache, or None when SEMANTIC_CACHE_ENABLED is false."""
+    global _semantic_answer_cache
+    if _semantic_answer_cache is None and settings.SEMANTIC_CACHE_ENABLED:
+        _semantic_answer_cache = SemanticAnswerCache(
+            threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+            max_per_scope=settings.SEMANTIC_CACHE_ENTRIES_PER_SPACE,
+            max_scopes=settings.ANSWER_CACHE_SIZE,
+            ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+        )
+        logger.info(f"Semantic answer cache enabled (threshold {settings.SEMANTIC_CACHE_THRESHOLD})")
+    return _semantic_answer_cache
@@ -1,11 +1,16 @@
 import asyncio
 import re
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
 from pydantic import BaseModel, Field
 from services.ai_service import AIService
+from services.answer_cache import get_answer_cache, get_semantic_answer_cache
 from services.context_builder import ContextBuilder
 from prompts import SYNTHESIS_PROMPT_TEMPLATE
-from vector_store import query_documents_hybrid, expand_query
+from constants import RETRIEVAL_MAX_WORKERS
+from vector_store import query_documents_hybrid_batch, expand_query, get_embedding_service
+from db_utils import get_space_content_version
 import logging
 
 logger = logging.getLogger(__name__)
@@ -71,22 +76,20 @@ class StrategyService:
         return " ".join(keywords[:8])
 
 class RetrievalService:
-    
-    async def _search_single(
-        self,
-        query: str,
-        space_id: str,
-        user_id: str,
-        top_k: int
-    ) -> List[Dict[str, Any]]:
-        """Execute single search asynchronously"""
-        return query_documents_hybrid(
-            query=query,
-            top_k=top_k,
-            space_id=space_id,
-            user_id=user_id
+    """
+    Runs the blocking vector searches on a bounded thread pool shared by all
+    requests, so the event loop stays free while Postgres and Gemini work.
+    """
+
+    def __init__(self, max_workers: int = RETRIEVAL_MAX_WORKERS):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="retrieval"
         )
 
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
     async def execute_searches_parallel(
         self,
         searches: List[str],
@@ -95,39 +98,36 @@ class RetrievalService:
         top_k: int = 10
     ) -> Dict[str, List[Dict[str, Any]]]:
         """
-        Execute multiple searches in parallel
+        Execute all searches as one batched embedding call and one SQL round trip
         Returns: {search_query: [results]}
         """
-        tasks = [
-            self._search_single(search, space_id, user_id, top_k)
-            for search in searches
-        ]
-
-        results = await asyncio.gather(*tasks)
-
-        # Map search queries to their results
-        search_results = {
-            search: result
-            for search, result in zip(searches, results)
-        }
-
-        return search_results
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            self.executor,
+            partial(
+                query_documents_hybrid_batch,
+                queries=searches,
+                top_k=top_k,
+                space_id=space_id,
+                user_id=user_id
+            )
+        )
+        # Cancelling the await (client went away) drops the job if it has not started yet
+        return await future
 
 class SynthesisService:
     def __init__(self):
         self.ai_service = AIService()
         self.context_builder = ContextBuilder()
 
-    def synthesize_answer(
+    def build_prompt(
         self,
         query: str,
         search_results: Dict[str, List[Dict[str, Any]]],
         strategy: SearchStrategy,
-        provider: str = None,
-        model: str = None,
     ) -> Dict[str, Any]:
         """
-        Synthesize final answer from all search results
+        Build the synthesis prompt, sources and debug info from all search results
         """
 
         all_chunks = []
@@ -150,17 +150,48 @@ class SynthesisService:
             context=context
         )
 
-        answer = self.ai_service.generate_response(prompt, provider=provider, model=model)
-
         return {
-            "answer": answer,
+            "prompt": prompt,
             "sources": sources,
             "debug": {
                 "context_tokens": tokens,
                 "chunks_used": len(unique_chunks),
-                "chunks_available": len(all_chunks)
+                "chunks_available": len(all_chunks),
+                "search_plan": getattr(search_results, "plan", None)
             }
         }
+
+    async def synthesize_answer(
+        self,
+        query: str,
+        search_results: Dict[str, List[Dict[str, Any]]],
+        strategy: SearchStrategy,
+        provider: str = None,
+        model: str = None,
+    ) -> Dict[str, Any]:
+        """
+        Synthesize final answer from all search results
+        """
+        prepared = self.build_prompt(query, search_results, strategy)
+
+        answer = await self.ai_service.generate_response(prepared["prompt"], provider=provider, model=model)
+
+        return {
+            "answer": answer,
+            "sources": prepared["sources"],
+            "debug": prepared["debug"]
+        }
+
+    def stream_answer(
+        self,
+        prepared: Dict[str, Any],
+        provider: str = None,
+        model: str = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream the answer for a prompt built by build_prompt
+        """
+        return self.ai_service.stream_response(prepared["prompt"], provider=provider, model=model)
     
     def _deduplicate_chunks(self, chunks: List[Dict]) -> List[Dict]:
         """Remove duplicate chunks by doc_id"""
@@ -177,7 +208,108 @@ class RAGPipeline:
         self.strategy_service = StrategyService()
         self.retrieval_service = RetrievalService()
         self.synthesis_service = SynthesisService()
-    
+        self.answer_cache = get_answer_cache()
+        self.semantic_cache = get_semantic_answer_cache()
+
+    def shutdown(self):
+        self.retrieval_service.shutdown()
+        if self.answer_cache is not None:
+            self.answer_cache.close()
+
+    async def _cache_scope(
+        self,
+        space_id: str,
+        user_id: str,
+        provider: str = None,
+        model: str = None,
+    ) -> Optional[Tuple[str, str, str]]:
+        """
+        Content version, provider and model to key the answer caches with,
+        or None when both caches are off or the space is not the user's
+        """
+        if self.answer_cache is None and self.semantic_cache is None:
+            return None
+
+        content_version = await asyncio.to_thread(get_space_content_version, space_id, user_id)
+        if content_version is None:
+            # Unknown or foreign space: retrieval raises the usual error
+            return None
+
+        provider, model = self.synthesis_service.ai_service.resolve_model(provider, model)
+        return content_version, provider, model
+
+    async def _cached_answer(
+        self,
+        query: str,
+        space_id: str,
+        scope: Tuple[str, str, str],
+        use_semantic_cache: bool = True,
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[List[float]]]:
+        """
+        Try the exact cache, then the semantic one. Also returns the query
+        embedding, so a miss can be stored in the semantic cache afterwards
+        """
+        content_version, provider, model = scope
+        if self.answer_cache is not None:
+            cached = self.answer_cache.get(space_id, content_version, query, provider, model)
+            if cached is not None:
+                logger.info("Answer cache hit")
+                cached["debug"]["cache_hit"] = True
+                return cached, None
+
+        if not use_semantic_cache or self.semantic_cache is None:
+            return None, None
+
+        try:
+            # Same text as the strategy's first search, so retrieval reuses it from the embedding cache
+            embedding = await asyncio.to_thread(get_embedding_service().embed_query, " ".join(query.split()))
+        except Exception as e:
+            logger.warning(f"Could not embed query for the semantic cache: {str(e)}")
+            return None, None
+
+        match = self.semantic_cache.get(space_id, content_version, provider, model, embedding)
+        if match is None:
+            return None, embedding
+
+        cached, similarity = match
+        logger.info(f"Semantic answer cache hit (similarity {similarity:.3f})")
+        cached["debug"].update(cache_hit=True, cache_similarity=similarity)
+        return cached, embedding
+
+    def _store_answer(
+        self,
+        query: str,
+        space_id: str,
+        scope: Tuple[str, str, str],
+        embedding: Optional[List[float]],
+        result: Dict[str, Any],
+    ) -> None:
+        content_version, provider, model = scope
+        if self.answer_cache is not None:
+            self.answer_cache.put(space_id, content_version, query, provider, model, result)
+        if embedding is not None:
+            self.semantic_cache.put(space_id, content_version, provider, model, embedding, result)
+
+    async def _retrieve(
+        self,
+        query: str,
+        space_id: str,
+        user_id: str,
+    ) -> Tuple[SearchStrategy, Dict[str, List[Dict[str, Any]]]]:
+        logger.info(f"Stage 1: Building retrieval strategy for query: {query}")
+        strategy = self.strategy_service.generate_strategy(query, space_id)
+
+        logger.info(f"Generated {len(strategy.searches)} searches")
+
+        logger.info("Stage 2: Executing parallel searches")
+        search_results = await self.retrieval_service.execute_searches_parallel(
+            searches=strategy.searches,
+            space_id=space_id,
+            user_id=user_id,
+            top_k=10
+        )
+        return strategy, search_results
+
     async def process_query(
         self,
         query: str,
@@ -185,35 +317,90 @@ class RAGPipeline:
         user_id: str,
         provider: str = None,
         model: str = None,
+        use_semantic_cache: bool = True,
     ) -> Dict[str, Any]:
         """
         Main pipeline execution
         """
         try:
-            logger.info(f"Stage 1: Building retrieval strategy for query: {query}")
-            strategy = self.strategy_service.generate_strategy(query, space_id)
+            embedding = None
+            scope = await self._cache_scope(space_id, user_id, provider, model)
+            if scope:
+                _, provider, model = scope
+                cached, embedding = await self._cached_answer(query, space_id, scope, use_semantic_cache)
+                if cached is not None:
+                    return cached
 
-            logger.info(f"Generated {len(strategy.searches)} searches")
-
-            logger.info("Stage 2: Executing parallel searches")
-            search_results = await self.retrieval_service.execute_searches_parallel(
-                searches=strategy.searches,
-                space_id=space_id,
-                user_id=user_id,
-                top_k=10
-            )
+            strategy, search_results = await self._retrieve(query, space_id, user_id)
 
             logger.info("Stage 3: Synthesizing final answer")
-            result = self.synthesis_service.synthesize_answer(
+            result = await self.synthesis_service.synthesize_answer(
                 query=query,
                 search_results=search_results,
                 strategy=strategy,
                 provider=provider,
                 model=model,
             )
+            result["debug"]["cache_hit"] = False
             logger.info("Pipeline complete")
 
+            if scope and result["answer"]:
+                self._store_answer(query, space_id, scope, embedding, result)
             return result
         except Exception as e:
             logger.error(f"Pipeline error: {str(e)}", exc_info=True)
             raise
+
+    async def stream_query(
+        self,
+        query: str,
+        space_id: str,
+        user_id: str,
+        provider: str = None,
+        model: str = None,
+        use_semantic_cache: bool = True,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming pipeline: yields a "sources" event once retrieval finishes,
+        then one "token" event per streamed chunk and a final "done" event
+        """
+        try:
+            embedding = None
+            scope = await self._cache_scope(space_id, user_id, provider, model)
+            if scope:
+                _, provider, model = scope
+                cached, embedding = await self._cached_answer(query, space_id, scope, use_semantic_cache)
+                if cached is not None:
+                    # A cached answer goes out as a single token event
+                    yield {"event": "sources", "data": {"sources": cached["sources"], "debug": cached["debug"]}}
+                    yield {"event": "token", "data": {"text": cached["answer"]}}
+                    yield {"event": "done", "data": {}}
+                    return
+
+            strategy, search_results = await self._retrieve(query, space_id, user_id)
+
+            prepared = self.synthesis_service.build_prompt(query, search_results, strategy)
+            prepared["debug"]["cache_hit"] = False
+            yield {
+                "event": "sources",
+                "data": {"sources": prepared["sources"], "debug": prepared["debug"]}
+            }
+
+            logger.info("Stage 3: Streaming final answer")
+            answer_parts = []
+            tokens = self.synthesis_service.stream_answer(prepared, provider=provider, model=model)
+            async for text in tokens:
+                answer_parts.append(text)
+                yield {"event": "token", "data": {"text": text}}
+
+            logger.info("Pipeline complete")
+            # Only a stream that ran to the end is cached; a disconnect cancels before this point
+            if scope and answer_parts:
+                self._store_answer(
+                    query, space_id, scope, embedding,
+                    {"answer": "".join(answer_parts), "sources": prepared["sources"], "debug": prepared["debug"]}
+                )
+            yield {"event": "done", "data": {}}
+        except Exception as e:
+            logger.error(f"Pipeline error: {str(e)}", exc_info=True)
+            raise
@@ -1,13 +1,88 @@
-from typing import List, Dict, Any, Tuple
-import tiktoken
+import math
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Sequence, Tuple
 
-from constants import TIKTOKEN_ENCODING
+from config.config import settings
+from constants import HEADER_TOKEN_CACHE_SIZE, KNAPSACK_TOKEN_GRANULARITY, OVERLAP_TOKEN_CACHE_SIZE
+from distance_metrics import convert_threshold
+from pdf_utils import get_encoder
+
+
+def knapsack_select(
+    weights: Sequence[int],
+    values: Sequence[float],
+    capacity: int,
+    granularity: int = KNAPSACK_TOKEN_GRANULARITY
+) -> List[int]:
+    """0/1 knapsack: indexes of the items with the highest total value that fit in `capacity`.
+
+    Weights are rounded up to `granularity` tokens to keep the table small; rounding
+    up means the chosen set always fits the real budget.
+    """
+    units = capacity // granularity
+    if units <= 0 or not weights:
+        return []
+    scaled = [math.ceil(weight / granularity) for weight in weights]
+
+    best = [0.0] * (units + 1)
+    taken = [[False] * (units + 1) for _ in weights]
+    for item, (weight, value) in enumerate(zip(scaled, values)):
+        for budget in range(units, weight - 1, -1):
+            candidate = best[budget - weight] + value
+            if candidate > best[budget]:
+                best[budget] = candidate
+                taken[item][budget] = True
+
+    chosen = []
+    budget = units
+    for item in range(len(weights) - 1, -1, -1):
+        if taken[item][budget]:
+            chosen.append(item)
+            budget -= scaled[item]
+    return sorted(chosen)
+
+
+def stitch_overlap(left: str, right: str, min_overlap: int = 16) -> Optional[str]:
+    """Join two consecutive chunks, dropping the text `right` repeats from the end of `left`."""
+    probe = right[:min_overlap]
+    if len(probe) < min_overlap:
+        return None
+    # Search from the earliest possible start so the longest overlap wins
+    position = left.find(probe, max(0, len(left) - len(right)))
+    while position != -1:
+        if right.startswith(left[position:]):
+            return left + right[len(left) - position:]
+        position = left.find(probe, position + 1)
+    return None
+
+
+def _file_key(chunk: Dict[str, Any]) -> str:
+    # doc_ids are "doc_{file_id}_{chunk_index}"; two uploads can share a filename
+    doc_id = chunk.get('doc_id')
+    if isinstance(doc_id, str) and doc_id.count('_') >= 2:
+        return doc_id.rsplit('_', 1)[0]
+    return chunk.get('filename', 'N/A')
 
 
 class ContextBuilder:
 
-    def __init__(self):
-        self.encoder = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+    def __init__(self, metric: str = settings.DISTANCE_METRIC):
+        self.encoder = get_encoder()
+        self.metric = metric
+        # Chunk bodies carry a stored token_count; only the short headers are encoded, and they repeat
+        self._header_tokens = lru_cache(maxsize=HEADER_TOKEN_CACHE_SIZE)(self.count_tokens)
+        # The text two adjacent chunks share is the same every time both are retrieved
+        self._overlap_tokens = lru_cache(maxsize=OVERLAP_TOKEN_CACHE_SIZE)(self.count_tokens)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoder.encode(text))
+
+    def _chunk_tokens(self, header: str, chunk: Dict[str, Any]) -> int:
+        token_count = chunk.get('token_count')
+        if token_count is None:
+            # Rows stored before token_count existed
+            token_count = self.count_tokens(chunk['text'])
+        return self._header_tokens(header) + token_count
 
     def build_context_for_analyze_all(
         self,
@@ -18,36 +93,59 @@ class ContextBuilder:
         sources = []
         current_tokens = 0
 
-        for i, chunk in enumerate(chunks, 1):
-            chunk_text = chunk['text']
-            chunk_context = f"[Document: {chunk['filename']}, Section {chunk['chunk_index']}]\n{chunk_text}"
+        for span in self._merge_adjacent(chunks):
+            span_text, span_tokens, used = "", 0, []
+            for chunk in span:
+                if used:
+                    text, added = self._extend(span_text, chunk)
+                else:
+                    text, added = chunk['text'], self._chunk_tokens("", chunk)
+                header_tokens = self._header_tokens(self._section_header(span[0], chunk))
+                if current_tokens + header_tokens + span_tokens + added > max_tokens:
+                    break
+                span_text, span_tokens = text, span_tokens + added
+                used.append(chunk)
 
-            chunk_tokens = len(self.encoder.encode(chunk_context))
-            if current_tokens + chunk_tokens > max_tokens:
-                break
+            if used:
+                header = self._section_header(used[0], used[-1])
+                context_parts.append(f"{header}{span_text}")
+                current_tokens += self._header_tokens(header) + span_tokens
+                for chunk in used:
+                    sources.append({
+                        "doc_id": chunk['doc_id'],
+                        "filename": chunk.get('filename', 'N/A'),
+                        "chunk_text": chunk['text'],
+                        "relevance_score": "all_docs"
+                    })
 
-            context_parts.append(chunk_context)
-            current_tokens += chunk_tokens
-            sources.append({
-                "doc_id": chunk['doc_id'],
-                "filename": chunk.get('filename', 'N/A'),
-                "chunk_text": chunk['text'],
-                "relevance_score": "all_docs"
-            })
+            if len(used) < len(span):
+                break
 
         context = "\n\n---\n\n".join(context_parts)
         return context, sources, current_tokens
 
+    @staticmethod
+    def _section_header(first: Dict[str, Any], last: Dict[str, Any]) -> str:
+        if first is last:
+            return f"[Document: {first['filename']}, Section {first['chunk_index']}]\n"
+        return f"[Document: {first['filename']}, Sections {first['chunk_index']}-{last['chunk_index']}]\n"
+
     def build_context_for_specific_query(
         self,
         chunks: List[Dict[str, Any]],
         max_tokens: int,
         distance_threshold: float
     ) -> Tuple[str, List[Dict[str, Any]], int]:
+        # Thresholds are tuned in L2 units; translate them to the configured metric
+        distance_threshold = convert_threshold(distance_threshold, self.metric)
+        # The distance cutoff is for vector-only hits; a lexical match is kept however far its embedding is
         filtered_chunks = [
             chunk for chunk in chunks
-            if chunk.get('distance', 999) < distance_threshold
+            if chunk.get('lexical') or chunk.get('distance', 999) < distance_threshold
         ]
+        # Rank by the fused hybrid score when the search provides one
+        if all('score' in chunk for chunk in filtered_chunks):
+            filtered_chunks.sort(key=lambda chunk: chunk['score'], reverse=True)
 
         # Prioritize multi-document representation
         seen_filenames = set()
@@ -66,40 +164,100 @@ class ContextBuilder:
         # Combine prioritized chunks first, then remaining
         ordered_chunks = priority_chunks + remaining_chunks
 
-        context_parts = []
-        sources = []
-        current_tokens = 0
-
         # Cache document type hints by filename
         doc_type_hint_cache = {}
 
-        for i, chunk in enumerate(ordered_chunks, 1):
-            chunk_text = chunk['text']
-            filename = chunk.get('filename', 'N/A')
-            
-            # Use cached document type hint if available
+        def source_header(number: int, filename: str) -> str:
             if filename not in doc_type_hint_cache:
                 doc_type_hint_cache[filename] = self._get_document_type_hint(filename)
-            doc_type_hint = doc_type_hint_cache[filename]
+            return f"[Source {number} - {filename}{doc_type_hint_cache[filename]}]\n"
 
-            chunk_context = f"[Source {i} - {filename}{doc_type_hint}]\n{chunk_text}"
+        # Headers are costed with the chunk's position in the candidate list; the final
+        # source number is never larger, so the real cost can only be lower
+        weights = [
+            self._chunk_tokens(source_header(i, chunk.get('filename', 'N/A')), chunk)
+            for i, chunk in enumerate(ordered_chunks, 1)
+        ]
+        values = [
+            chunk['score'] if 'score' in chunk else distance_threshold - chunk.get('distance', 999)
+            for chunk in ordered_chunks
+        ]
 
-            chunk_tokens = len(self.encoder.encode(chunk_context))
-            if current_tokens + chunk_tokens > max_tokens:
-                break
+        # Keep the diversity step first: pack the best chunk of each document, then fill
+        # the rest of the budget from the remaining chunks
+        diverse = len(priority_chunks)
+        selected = knapsack_select(weights[:diverse], values[:diverse], max_tokens)
+        budget_left = max_tokens - sum(weights[i] for i in selected)
+        selected += [
+            diverse + i
+            for i in knapsack_select(weights[diverse:], values[diverse:], budget_left)
+        ]
+
+        spans = self._merge_adjacent([ordered_chunks[i] for i in sorted(selected)])
+
+        context_parts = []
+        sources = []
+        current_tokens = 0
+
+        for number, span in enumerate(spans, 1):
+            filename = span[0].get('filename', 'N/A')
+            header = source_header(number, filename)
+            span_text = span[0]['text']
+            span_tokens = self._chunk_tokens(header, span[0])
+            for chunk in span[1:]:
+                span_text, added = self._extend(span_text, chunk)
+                span_tokens += added
 
-            context_parts.append(chunk_context)
-            current_tokens += chunk_tokens
-            sources.append({
-                "doc_id": chunk['doc_id'],
-                "filename": filename,
-                "chunk_text": chunk['text'],
-                "relevance_score": chunk.get('distance', 'N/A')
-            })
+            context_parts.append(f"{header}{span_text}")
+            current_tokens += span_tokens
+            for chunk in span:
+                sources.append({
+                    "doc_id": chunk['doc_id'],
+                    "filename": filename,
+                    "chunk_text": chunk['text'],
+                    "relevance_score": chunk.get('distance', 'N/A')
+                })
 
         context = "\n\n---\n\n".join(context_parts)
         return context, sources, current_tokens
-    
+
+    def _extend(self, span_text: str, chunk: Dict[str, Any]) -> Tuple[str, int]:
+        """Append a stitchable chunk to a span; returns the new text and the tokens it adds."""
+        stitched = stitch_overlap(span_text, chunk['text'])
+        repeated = chunk['text'][:len(span_text) + len(chunk['text']) - len(stitched)]
+        return stitched, self._chunk_tokens("", chunk) - self._overlap_tokens(repeated)
+
+    def _merge_adjacent(self, chunks: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Group consecutive chunk indexes of the same file into spans that can be stitched.
+
+        Spans keep the order of their best-ranked chunk.
+        """
+        spans: List[List[Dict[str, Any]]] = []
+        rank = {id(chunk): i for i, chunk in enumerate(chunks)}
+        by_file: Dict[str, List[Dict[str, Any]]] = {}
+        for chunk in chunks:
+            by_file.setdefault(_file_key(chunk), []).append(chunk)
+
+        for file_chunks in by_file.values():
+            if any(chunk.get('chunk_index') is None for chunk in file_chunks):
+                spans.extend([chunk] for chunk in file_chunks)
+                continue
+
+            span_text = None
+            for chunk in sorted(file_chunks, key=lambda c: c['chunk_index']):
+                previous = spans[-1][-1] if span_text is not None else None
+                if previous is not None and chunk['chunk_index'] == previous['chunk_index'] + 1:
+                    stitched = stitch_overlap(span_text, chunk['text'])
+                    if stitched is not None:
+                        spans[-1].append(chunk)
+                        span_text = stitched
+                        continue
+                spans.append([chunk])
+                span_text = chunk['text']
+
+        spans.sort(key=lambda span: min(rank[id(chunk)] for chunk in span))
+        return spans
+
     def _get_document_type_hint(self, filename: str) -> str:
         """Add document type hints to help LLM understand source types"""
         filename_lower = filename.lower()
@@ -1,25 +1,74 @@
 import logging
 import os
 import re
-from typing import Tuple, Optional
-
-from pdf_utils import extract_text, chunk_text
-from vector_store import upload_document
-from constants import MAX_FILE_SIZE_BYTES, ALLOWED_FILE_EXTENSIONS, MAX_TEXT_CHARACTERS
+import uuid
+from typing import Callable, Iterator, NamedTuple, Tuple, Optional
+
+from pdf_utils import (
+    DocumentSource,
+    Page,
+    iter_document_pages,
+    iter_chunks,
+    pages_end_offset,
+    pdf_page_count,
+)
+from vector_store import upload_chunks, delete_file_chunks, offset_progress, ProgressCallback
+from constants import (
+    MAX_FILE_SIZE_BYTES,
+    ALLOWED_FILE_EXTENSIONS,
+    MAX_TEXT_CHARACTERS,
+    MAX_PDF_PAGES,
+    LARGE_DOCUMENT_MAX_PAGES,
+    LARGE_DOCUMENT_MAX_FILE_SIZE_BYTES,
+    LARGE_DOCUMENT_BATCH_PAGES,
+)
 
 logger = logging.getLogger(__name__)
 
 
+def _source_size(file_content: DocumentSource) -> int:
+    if isinstance(file_content, bytes):
+        return len(file_content)
+    return os.fstat(file_content.fileno()).st_size
+
+
+class DocumentValidationError(ValueError):
+    """The document or text itself is unusable; processing it again cannot succeed."""
+
+
+class IngestCheckpoint(NamedTuple):
+    """Progress of a large-document ingest up to its last committed page batch."""
+    pages_done: int = 0
+    chunks_done: int = 0
+    chars_done: int = 0
+    reused_done: int = 0
+
+
 class DocumentService:
 
+    def max_upload_bytes(self, filename: str) -> int:
+        # Any PDF may turn out to be long enough for large-document mode; the page
+        # count is only checked by the ingestion worker (see process_document)
+        if filename.lower().endswith(".pdf"):
+            return LARGE_DOCUMENT_MAX_FILE_SIZE_BYTES
+        return MAX_FILE_SIZE_BYTES
+
     def validate_file(self, filename: str, file_size: int) -> None:
         if not filename.lower().endswith(ALLOWED_FILE_EXTENSIONS):
-            raise ValueError(f"Unsupported file type. Only {', '.join(ALLOWED_FILE_EXTENSIONS)} are allowed.")
+            raise DocumentValidationError(f"Unsupported file type. Only {', '.join(ALLOWED_FILE_EXTENSIONS)} are allowed.")
+
+        max_bytes = self.max_upload_bytes(filename)
+        if file_size > max_bytes:
+            raise DocumentValidationError(f"File too large. Maximum size is {max_bytes // (1024 * 1024)}MB.")
 
-        if file_size > MAX_FILE_SIZE_BYTES:
-            raise ValueError(f"File too large. Maximum size is {MAX_FILE_SIZE_BYTES // (1024 * 1024)}MB.")
+    def validate_text_content(self, text_content: str) -> None:
+        if not text_content or not text_content.strip():
+            raise DocumentValidationError("Text content cannot be empty")
 
-    def _generate_filename_from_text(self, text: str) -> str:
+        if len(text_content) > MAX_TEXT_CHARACTERS:
+            raise DocumentValidationError(f"Text content exceeds maximum length of {MAX_TEXT_CHARACTERS:,} characters")
+
+    def generate_filename_from_text(self, text: str) -> str:
         """Generate a filename from the first few words of text content."""
         # Remove extra whitespace and newlines
         cleaned_text = re.sub(r'\s+', ' ', text.strip())
@@ -43,53 +92,158 @@ class DocumentService:
         self,
         text_content: str,
         space_id: str,
-        user_id: str
-    ) -> Tuple[str, int, str]:
-        """Process pasted text content as a document."""
-        if not text_content or not text_content.strip():
-            raise ValueError("Text content cannot be empty")
+        user_id: str,
+        filename: Optional[str] = None,
+        file_id: Optional[str] = None,
+        progress: Optional[ProgressCallback] = None
+    ) -> Tuple[str, int, str, int]:
+        """Process pasted text content as a document.
 
-        if len(text_content) > MAX_TEXT_CHARACTERS:
-            raise ValueError(f"Text content exceeds maximum length of {MAX_TEXT_CHARACTERS:,} characters")
+        Returns the file id, chunk count, generated filename and reused embedding count.
+        """
+        self.validate_text_content(text_content)
 
         # Generate filename from first few words
-        filename = self._generate_filename_from_text(text_content)
+        filename = filename or self.generate_filename_from_text(text_content)
 
-        # Chunk the text
-        chunks = chunk_text(text_content)
+        # Chunk the text and upload to vector store as chunks are produced
+        if progress:
+            progress("chunking")
+        file_id, chunk_count, reused_chunks = upload_chunks(
+            iter_chunks([(None, text_content)]), space_id, user_id, filename, file_id, progress
+        )
 
-        # Upload to vector store
-        file_id = upload_document(chunks, space_id, user_id, filename)
+        logger.info(f"Uploaded text content as '{filename}' with {chunk_count} chunks to space {space_id}")
 
-        logger.info(f"Uploaded text content as '{filename}' with {len(chunks)} chunks to space {space_id}")
-
-        return file_id, len(chunks), filename
+        return file_id, chunk_count, filename, reused_chunks
 
     def process_document(
         self,
-        file_content: bytes,
+        file_content: DocumentSource,
         filename: str,
         space_id: str,
-        user_id: str
-    ) -> Tuple[str, int]:
-        temp_file_path = f"temp_{filename}"
-
+        user_id: str,
+        file_id: Optional[str] = None,
+        progress: Optional[ProgressCallback] = None,
+        checkpoint: Optional[IngestCheckpoint] = None,
+        on_checkpoint: Optional[Callable[[IngestCheckpoint], None]] = None
+    ) -> Tuple[str, int, int]:
+        """Returns the file id, chunk count and reused embedding count.
+
+        PDFs longer than MAX_PDF_PAGES, and jobs resuming from a checkpoint, use large-document
+        mode; only they may exceed MAX_FILE_SIZE_BYTES.
+        """
+        if progress:
+            progress("extracting")
+        if checkpoint is not None or self._is_large_document(file_content, filename):
+            return self._process_large_document(
+                file_content, filename, space_id, user_id, file_id, progress,
+                checkpoint or IngestCheckpoint(), on_checkpoint
+            )
+        if _source_size(file_content) > MAX_FILE_SIZE_BYTES:
+            raise DocumentValidationError(
+                f"File too large. Maximum size is {MAX_FILE_SIZE_BYTES // (1024 * 1024)}MB "
+                f"for documents of up to {MAX_PDF_PAGES} pages."
+            )
+
+        # Pages are extracted from memory, chunked and embedded as one pipeline
+        chunks = iter_chunks(self._pages(file_content, filename))
+
+        file_id, chunk_count, reused_chunks = upload_chunks(
+            chunks, space_id, user_id, filename, file_id, progress
+        )
+
+        logger.info(f"Uploaded document {filename} with {chunk_count} chunks to space {space_id}")
+
+        return file_id, chunk_count, reused_chunks
+
+    def _process_large_document(
+        self,
+        file_content: DocumentSource,
+        filename: str,
+        space_id: str,
+        user_id: str,
+        file_id: Optional[str],
+        progress: Optional[ProgressCallback],
+        checkpoint: IngestCheckpoint,
+        on_checkpoint: Optional[Callable[[IngestCheckpoint], None]]
+    ) -> Tuple[str, int, int]:
+        """Ingest a long PDF LARGE_DOCUMENT_BATCH_PAGES pages at a time.
+
+        Each batch is committed on its own and then checkpointed, so memory stays
+        bounded by the batch and a retry starts after the last checkpoint. The
+        checkpoint counts every page read, blank ones included.
+        """
+        file_id = file_id or str(uuid.uuid4())
+        if checkpoint.pages_done:
+            logger.info(f"Resuming {filename} after page {checkpoint.pages_done} ({checkpoint.chunks_done} chunks stored)")
+        # A batch that was committed but not checkpointed is redone; drop its chunks first
+        delete_file_chunks(space_id, file_id, from_index=checkpoint.chunks_done)
+
+        num_pages = self._page_count(file_content, filename)
+        for start in range(checkpoint.pages_done, num_pages, LARGE_DOCUMENT_BATCH_PAGES):
+            stop = min(start + LARGE_DOCUMENT_BATCH_PAGES, num_pages)
+            batch = list(self._pages(
+                file_content, filename, start_page=start, max_pages=LARGE_DOCUMENT_MAX_PAGES, stop_page=stop
+            ))
+            stored = reused = 0
+            if batch:
+                _, stored, reused = upload_chunks(
+                    iter_chunks(batch, char_offset=checkpoint.chars_done),
+                    space_id,
+                    user_id,
+                    filename,
+                    file_id,
+                    offset_progress(
+                        progress,
+                        chunks_total=checkpoint.chunks_done,
+                        chunks_embedded=checkpoint.chunks_done,
+                        reused_chunks=checkpoint.reused_done
+                    ),
+                    first_index=checkpoint.chunks_done
+                )
+            checkpoint = IngestCheckpoint(
+                pages_done=stop,
+                chunks_done=checkpoint.chunks_done + stored,
+                chars_done=pages_end_offset(batch, checkpoint.chars_done),
+                reused_done=checkpoint.reused_done + reused
+            )
+            if on_checkpoint:
+                on_checkpoint(checkpoint)
+
+        logger.info(
+            f"Uploaded large document {filename} with {checkpoint.chunks_done} chunks "
+            f"from {checkpoint.pages_done} pages to space {space_id}"
+        )
+        return file_id, checkpoint.chunks_done, checkpoint.reused_done
+
+    def _is_large_document(self, file_content: DocumentSource, filename: str) -> bool:
+        if not filename.lower().endswith(".pdf"):
+            return False
+        return self._page_count(file_content, filename) > MAX_PDF_PAGES
+
+    def _page_count(self, file_content: DocumentSource, filename: str) -> int:
         try:
-            with open(temp_file_path, "wb") as f:
-                f.write(file_content)
-
-            text = extract_text(temp_file_path)
-            if text is None:
-                raise ValueError("Failed to extract text from document")
-
-            chunks = chunk_text(text)
+            return pdf_page_count(file_content)
+        except Exception as e:
+            logger.error(f"Error reading {filename}: {str(e)}", exc_info=True)
+            raise DocumentValidationError("Failed to extract text from document") from e
 
-            file_id = upload_document(chunks, space_id, user_id, filename)
-
-            logger.info(f"Uploaded document {filename} with {len(chunks)} chunks to space {space_id}")
-
-            return file_id, len(chunks)
-
-        finally:
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
+    def _pages(
+        self,
+        file_content: DocumentSource,
+        filename: str,
+        start_page: int = 0,
+        max_pages: int = MAX_PDF_PAGES,
+        stop_page: Optional[int] = None
+    ) -> Iterator[Page]:
+        try:
+            yield from iter_document_pages(file_content, filename, start_page, max_pages, stop_page)
+        except DocumentValidationError:
+            raise
+        except ValueError as e:
+            # Unsupported type or too many pages
+            raise DocumentValidationError(str(e)) from e
+        except Exception as e:
+            logger.error(f"Error extracting text from {filename}: {str(e)}", exc_info=True)
+            raise DocumentValidationError("Failed to extract text from document") from e
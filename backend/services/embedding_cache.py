@@ -0,0 +1,183 @@
+import array
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cachetools import TTLCache
+
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, int, str, str]
+
+# Expired and over-cap disk rows are deleted on open and then every this many writes
+DISK_PRUNE_INTERVAL = 256
+
+
+class CachedEmbeddingService:
+    """
+    Wraps an embedding service with an in-process LRU/TTL cache for query
+    embeddings and an optional SQLite tier that survives restarts. The
+    SQLite tier keeps at most `disk_maxsize` rows, evicting the oldest.
+    Document embeddings are passed straight through.
+    """
+
+    def __init__(
+        self,
+        service,
+        maxsize: int,
+        ttl_seconds: int,
+        disk_path: Optional[str] = None,
+        disk_maxsize: int = 100_000,
+    ) -> None:
+        self.service = service
+        self.model_name = service.model_name
+        self.output_dimensionality = service.output_dimensionality
+        self.normalize = service.normalize
+        self.ttl_seconds = ttl_seconds
+        self.disk_maxsize = disk_maxsize
+        self._memory: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        self._lock = threading.Lock()
+        self._disk: Optional[sqlite3.Connection] = None
+        self._disk_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "key TEXT PRIMARY KEY, embedding BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._disk.execute(
+                "CREATE INDEX IF NOT EXISTS query_embeddings_created_at ON query_embeddings (created_at)"
+            )
+            self._disk_prune()
+            self._disk.commit()
+            logger.info(f"Embedding cache disk tier enabled at {disk_path}")
+
+    def embed_documents(
+        self,
+        texts: List[str],
+        title: Optional[str] = None,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> List[List[float]]:
+        return self.service.embed_documents(texts, title=title, progress=progress)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        results: Dict[str, List[float]] = {}
+        missing: List[str] = []
+        for text in dict.fromkeys(texts):
+            cached = self._get(self._key(text))
+            if cached is None:
+                missing.append(text)
+            else:
+                results[text] = cached
+
+        if missing:
+            embeddings = self.service.embed_queries(missing)
+            if len(embeddings) != len(missing):
+                raise ValueError(
+                    f"Embedding provider returned {len(embeddings)} vectors for {len(missing)} queries"
+                )
+            for text, embedding in zip(missing, embeddings):
+                self._put(self._key(text), embedding)
+                results[text] = embedding
+
+        return [results[text] for text in texts]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "size": len(self._memory),
+                "maxsize": int(self._memory.maxsize),
+            }
+
+    def close(self) -> None:
+        if self._disk is not None:
+            with self._lock:
+                self._disk.close()
+                self._disk = None
+
+    def _key(self, text: str) -> CacheKey:
+        # Normalized and raw vectors must not be served for each other after a metric switch
+        task = "RETRIEVAL_QUERY:normalized" if self.normalize else "RETRIEVAL_QUERY"
+        return (self.model_name, self.output_dimensionality, task, text)
+
+    def _get(self, key: CacheKey) -> Optional[List[float]]:
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self.hits += 1
+                return embedding
+
+            embedding = self._disk_get(key)
+            if embedding is not None:
+                self.disk_hits += 1
+                self._memory[key] = embedding
+                return embedding
+
+            self.misses += 1
+            return None
+
+    def _put(self, key: CacheKey, embedding: List[float]) -> None:
+        with self._lock:
+            self._memory[key] = embedding
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, embedding, created_at) VALUES (?, ?, ?)",
+                    (self._disk_key(key), array.array("d", embedding).tobytes(), time.time()),
+                )
+                self._disk_writes += 1
+                if self._disk_writes % DISK_PRUNE_INTERVAL == 0:
+                    self._disk_prune()
+                self._disk.commit()
+
+    def _disk_prune(self) -> None:
+        """Delete expired rows, then the oldest rows beyond `disk_maxsize`."""
+        expired = self._disk.execute(
+            "DELETE FROM query_embeddings WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+        ).rowcount
+        evicted = self._disk.execute(
+            "DELETE FROM query_embeddings WHERE key IN ("
+            "SELECT key FROM query_embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_maxsize,),
+        ).rowcount
+        if expired or evicted:
+            logger.info(f"Embedding cache disk tier pruned {expired} expired and {evicted} oldest rows")
+
+    def _disk_get(self, key: CacheKey) -> Optional[List[float]]:
+        if self._disk is None:
+            return None
+
+        row = self._disk.execute(
+            "SELECT embedding, created_at FROM query_embeddings WHERE key = ?",
+            (self._disk_key(key),),
+        ).fetchone()
+        if row is None:
+            return None
+
+        blob, created_at = row
+        if time.time() - created_at > self.ttl_seconds:
+            self._disk.execute("DELETE FROM query_embeddings WHERE key = ?", (self._disk_key(key),))
+            self._disk.commit()
+            return None
+
+        return array.array("d", blob).tolist()
+
+    @staticmethod
+    def _disk_key(key: CacheKey) -> str:
+        return hashlib.sha256("\x1f".join(str(part) for part in key).encode("utf-8")).hexdigest()
@@ -1,13 +1,37 @@
 import logging
-from typing import List, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
 
+import httpx
 from google import genai
-from google.genai import types
+from google.genai import errors, types
+
+from distance_metrics import normalize as normalize_vector
+from constants import (
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_BATCH_TOKEN_BUDGET,
+    EMBEDDING_MAX_PARALLEL_BATCHES,
+    EMBEDDING_BATCH_MAX_RETRIES,
+    EMBEDDING_RETRY_BASE_DELAY_SECONDS,
+)
 
 
 logger = logging.getLogger(__name__)
 
 
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used only for batch sizing."""
+    return len(text) // 4 + 1
+
+
+def _is_transient(error: Exception) -> bool:
+    """Timeouts, network errors, rate limits and server errors; anything else fails the same way again."""
+    if isinstance(error, errors.APIError):
+        return error.code == 429 or (error.code or 0) >= 500
+    return isinstance(error, (httpx.TransportError, TimeoutError, ConnectionError))
+
+
 class GeminiEmbeddingService:
     def __init__(
         self,
@@ -15,16 +39,103 @@ class GeminiEmbeddingService:
         model_name: str,
         output_dimensionality: int,
         client: Optional[genai.Client] = None,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        batch_token_budget: int = EMBEDDING_BATCH_TOKEN_BUDGET,
+        max_parallel_batches: int = EMBEDDING_MAX_PARALLEL_BATCHES,
+        max_retries: int = EMBEDDING_BATCH_MAX_RETRIES,
+        retry_base_delay: float = EMBEDDING_RETRY_BASE_DELAY_SECONDS,
+        sleep: Callable[[float], None] = time.sleep,
+        normalize: bool = False,
     ) -> None:
         self.model_name = model_name
         self.output_dimensionality = output_dimensionality
+        # Reduced-dimension Gemini embeddings are not unit length; cosine/IP search wants them to be
+        self.normalize = normalize
         self.client = client or genai.Client(api_key=api_key)
+        self.batch_size = batch_size
+        self.batch_token_budget = batch_token_budget
+        self.max_parallel_batches = max_parallel_batches
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self._sleep = sleep
 
-    def embed_documents(self, texts: List[str], title: Optional[str] = None) -> List[List[float]]:
+    def embed_documents(
+        self,
+        texts: List[str],
+        title: Optional[str] = None,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> List[List[float]]:
+        """Embed document chunks; `progress` is called with the number of texts embedded so far."""
         if not texts:
             return []
 
-        logger.info("Requesting %s document embeddings from Gemini", len(texts))
+        batches = self._split_batches(texts)
+        logger.info(
+            "Requesting %s document embeddings from Gemini in %s batches",
+            len(texts),
+            len(batches),
+        )
+
+        if len(batches) == 1:
+            embeddings = self._embed_batch_with_retry(batches[0], title)
+            if progress:
+                progress(len(embeddings))
+            return embeddings
+
+        embeddings: List[List[float]] = []
+        workers = min(self.max_parallel_batches, len(batches))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed-batch") as executor:
+            # map() yields in submission order, so vectors line up with the input chunks
+            results = executor.map(lambda batch: self._embed_batch_with_retry(batch, title), batches)
+            for batch_embeddings in results:
+                embeddings.extend(batch_embeddings)
+                if progress:
+                    progress(len(embeddings))
+        return embeddings
+
+    def _split_batches(self, texts: List[str]) -> List[List[str]]:
+        """Split texts into provider-sized batches by count and approximate token budget."""
+        batches: List[List[str]] = []
+        current: List[str] = []
+        current_tokens = 0
+
+        for text in texts:
+            tokens = estimate_tokens(text)
+            if current and (
+                len(current) >= self.batch_size
+                or current_tokens + tokens > self.batch_token_budget
+            ):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+
+        if current:
+            batches.append(current)
+        return batches
+
+    def _embed_batch_with_retry(self, texts: List[str], title: Optional[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            try:
+                embeddings = self._embed_batch(texts, title)
+                if len(embeddings) != len(texts):
+                    raise ValueError(
+                        f"Embedding provider returned {len(embeddings)} vectors for {len(texts)} texts"
+                    )
+                return embeddings
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or not _is_transient(e):
+                    raise
+                delay = self.retry_base_delay * (2 ** (attempt - 1))
+                logger.warning(
+                    "Embedding batch of %s failed (%s), retry %s/%s in %.1fs",
+                    len(texts), e, attempt, self.max_retries, delay,
+                )
+                self._sleep(delay)
+
+    def _embed_batch(self, texts: List[str], title: Optional[str]) -> List[List[float]]:
         response = self.client.models.embed_content(
             model=self.model_name,
             contents=texts,
@@ -34,16 +145,28 @@ class GeminiEmbeddingService:
                 output_dimensionality=self.output_dimensionality,
             ),
         )
-        return [embedding.values for embedding in response.embeddings]
+        return self._vectors(response)
 
     def embed_query(self, text: str) -> List[float]:
-        logger.info("Requesting query embedding from Gemini")
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        logger.info("Requesting %s query embeddings from Gemini", len(texts))
         response = self.client.models.embed_content(
             model=self.model_name,
-            contents=[text],
+            contents=texts,
             config=types.EmbedContentConfig(
                 task_type="RETRIEVAL_QUERY",
                 output_dimensionality=self.output_dimensionality,
             ),
         )
-        return response.embeddings[0].values
+        return self._vectors(response)
+
+    def _vectors(self, response) -> List[List[float]]:
+        vectors = [embedding.values for embedding in response.embeddings]
+        if self.normalize:
+            return [normalize_vector(vector) for vector in vectors]
+        return vectors
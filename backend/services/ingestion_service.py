@@ -0,0 +1,394 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterable, BinaryIO, Callable, Dict, List, Optional
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from config.config import settings
+from constants import (
+    INGEST_POLL_INTERVAL_SECONDS,
+    INGEST_MAX_ATTEMPTS,
+    INGEST_RETRY_BASE_SECONDS,
+    INGEST_RETRY_MAX_SECONDS,
+    INGEST_STALE_JOB_SECONDS,
+    UPLOAD_MAX_FIELD_BYTES,
+    UPLOAD_READ_CHUNK_BYTES,
+)
+from db_utils import (
+    create_ingestion_job,
+    get_ingestion_job,
+    claim_next_ingestion_job,
+    update_ingestion_job,
+)
+from services.document_service import DocumentService, DocumentValidationError, IngestCheckpoint
+from vector_store import delete_file_chunks
+from vector_index import get_index_manager
+
+logger = logging.getLogger(__name__)
+
+
+class MultipartSpool:
+    """
+    Parses a multipart/form-data upload as its body arrives. The file part is
+    written straight to `path` and hashed on the way, checked against the
+    limit `file_limit(filename)` returns; other fields are kept in memory.
+    Call `write` with body chunks, then `finish`; `discard` removes the file.
+    """
+
+    def __init__(self, content_type: str, path: str, file_limit: Callable[[str], int]) -> None:
+        mimetype, options = parse_options_header(content_type)
+        if mimetype != b"multipart/form-data" or b"boundary" not in options:
+            raise ValueError("Expected a multipart/form-data upload")
+
+        self.path = path
+        self.fields: Dict[str, str] = {}
+        self.filename: Optional[str] = None
+        self.size = 0
+        self._file_limit = file_limit
+        self._max_bytes = 0
+        self._digest = hashlib.sha256()
+        self._file: Optional[BinaryIO] = None
+        self._in_file = False
+        self._name = ""
+        self._data = bytearray()
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._parser = MultipartParser(options[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+        })
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    def write(self, data: bytes) -> None:
+        self._parser.write(data)
+
+    def finish(self, data: bytes = b"") -> None:
+        if data:
+            self._parser.write(data)
+        self._parser.finalize()
+        self._close_file()
+
+    def discard(self) -> None:
+        self._close_file()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+        self._data = bytearray()
+        self._in_file = False
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition"))
+        if b"name" not in options:
+            raise ValueError('The Content-Disposition header field "name" must be provided.')
+        self._name = options[b"name"].decode("utf-8", errors="replace")
+        if b"filename" not in options:
+            return
+        if self.filename is not None:
+            raise ValueError("Only one file can be uploaded at a time")
+        self.filename = options[b"filename"].decode("utf-8", errors="replace")
+        # Rejects unsupported types before any of the file is written
+        self._max_bytes = self._file_limit(self.filename)
+        self._file = open(self.path, "wb")
+        self._in_file = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        block = data[start:end]
+        if not self._in_file:
+            if len(self._data) + len(block) > UPLOAD_MAX_FIELD_BYTES:
+                raise ValueError(f"Form field '{self._name}' is too large")
+            self._data.extend(block)
+            return
+        self.size += len(block)
+        if self.size > self._max_bytes:
+            raise ValueError(f"File too large. Maximum size is {self._max_bytes // (1024 * 1024)}MB.")
+        self._digest.update(block)
+        self._file.write(block)
+
+    def _on_part_end(self) -> None:
+        if self._in_file:
+            self._close_file()
+        else:
+            self.fields[self._name] = self._data.decode("utf-8", errors="replace")
+
+
+class IngestionService:
+    """
+    Background document ingestion backed by the `ingestion_jobs` table.
+
+    Uploads are spooled to INGEST_SPOOL_DIR and queued; worker threads claim
+    jobs with SKIP LOCKED, so several API processes or a standalone worker
+    (`python -m services.ingestion_service`) can share one queue.
+    """
+
+    def __init__(self, spool_dir: str = settings.INGEST_SPOOL_DIR):
+        self.spool_dir = spool_dir
+        self.document_service = DocumentService()
+        self._stop = threading.Event()
+        self._workers: List[threading.Thread] = []
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    async def receive_upload(self, body: AsyncIterable[bytes], content_type: str) -> MultipartSpool:
+        """Parse a multipart upload body into the spool as it arrives; no other copy is made.
+
+        Parsing and file writes run off the event loop, UPLOAD_READ_CHUNK_BYTES at a time.
+        """
+        upload = MultipartSpool(content_type, os.path.join(self.spool_dir, str(uuid.uuid4())), self._file_limit)
+        try:
+            pending: List[bytes] = []
+            pending_bytes = 0
+            async for chunk in body:
+                pending.append(chunk)
+                pending_bytes += len(chunk)
+                if pending_bytes >= UPLOAD_READ_CHUNK_BYTES:
+                    await asyncio.to_thread(upload.write, b"".join(pending))
+                    pending, pending_bytes = [], 0
+            await asyncio.to_thread(upload.finish, b"".join(pending))
+        except Exception:
+            upload.discard()
+            raise
+        return upload
+
+    def enqueue_upload(self, upload: MultipartSpool, space_id: str, user_id: str) -> Dict[str, Any]:
+        """Queue the file a finished MultipartSpool wrote to the spool."""
+        try:
+            return create_ingestion_job(
+                job_id=os.path.basename(upload.path),
+                user_id=user_id,
+                space_id=space_id,
+                filename=upload.filename,
+                file_id=str(uuid.uuid4()),
+                source="file",
+                payload_path=upload.path,
+                content_sha256=upload.sha256
+            )
+        except Exception:
+            upload.discard()
+            raise
+
+    def enqueue_text(self, text_content: str, filename: str, space_id: str, user_id: str) -> Dict[str, Any]:
+        return self._enqueue(io.BytesIO(text_content.encode("utf-8")), "text", filename, space_id, user_id)
+
+    def _file_limit(self, filename: str) -> int:
+        self.document_service.validate_file(filename, 0)
+        return self.document_service.max_upload_bytes(filename)
+
+    def get_job(self, job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        return get_ingestion_job(job_id, user_id)
+
+    def start(self, num_workers: int = settings.INGEST_WORKERS) -> None:
+        self._stop.clear()
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._run_worker, name=f"ingest-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Started {num_workers} ingestion workers")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        for worker in self._workers:
+            worker.join(timeout=timeout)
+        self._workers = []
+
+    def _enqueue(
+        self,
+        stream: BinaryIO,
+        source: str,
+        filename: str,
+        space_id: str,
+        user_id: str
+    ) -> Dict[str, Any]:
+        job_id = str(uuid.uuid4())
+        payload_path = os.path.join(self.spool_dir, job_id)
+
+        try:
+            content_sha256 = self._spool(stream, payload_path)
+            return create_ingestion_job(
+                job_id=job_id,
+                user_id=user_id,
+                space_id=space_id,
+                filename=filename,
+                file_id=str(uuid.uuid4()),
+                source=source,
+                payload_path=payload_path,
+                content_sha256=content_sha256
+            )
+        except Exception:
+            if os.path.exists(payload_path):
+                os.remove(payload_path)
+            raise
+
+    def _spool(self, stream: BinaryIO, payload_path: str) -> str:
+        """Write `stream` to the spool in bounded reads and return its sha256."""
+        digest = hashlib.sha256()
+        with open(payload_path, "wb") as f:
+            while block := stream.read(UPLOAD_READ_CHUNK_BYTES):
+                digest.update(block)
+                f.write(block)
+        return digest.hexdigest()
+
+    def _run_worker(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job = claim_next_ingestion_job(INGEST_STALE_JOB_SECONDS)
+            except Exception:
+                self._stop.wait(INGEST_POLL_INTERVAL_SECONDS)
+                continue
+
+            if job is None:
+                self._stop.wait(INGEST_POLL_INTERVAL_SECONDS)
+                continue
+
+            try:
+                self.process_job(job)
+            except Exception as e:
+                # Typically the job status write failing during a database outage; the job stays
+                # running and is reclaimed once it goes stale, and this worker keeps polling
+                logger.error(f"Ingestion job {job['id']} could not be recorded: {str(e)}", exc_info=True)
+                self._stop.wait(INGEST_POLL_INTERVAL_SECONDS)
+                continue
+            self._maintain_indexes(job["space_id"])
+
+    def process_job(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        logger.info(f"Processing ingestion job {job_id} ('{job['filename']}', attempt {job['attempts']})")
+
+        def progress(stage: str, **counts: int) -> None:
+            update_ingestion_job(job_id, stage=stage, **counts)
+
+        def save_checkpoint(checkpoint: IngestCheckpoint) -> None:
+            update_ingestion_job(
+                job_id,
+                checkpoint_page=checkpoint.pages_done,
+                checkpoint_chunk=checkpoint.chunks_done,
+                checkpoint_char=checkpoint.chars_done,
+                checkpoint_reused=checkpoint.reused_done
+            )
+
+        checkpoint = None
+        if job.get("checkpoint_page"):
+            checkpoint = IngestCheckpoint(
+                job["checkpoint_page"], job["checkpoint_chunk"], job["checkpoint_char"], job["checkpoint_reused"]
+            )
+
+        try:
+            with open(job["payload_path"], "rb") as payload:
+                if job["source"] == "text":
+                    _, chunk_count, _, reused_chunks = self.document_service.process_text_content(
+                        payload.read().decode("utf-8"),
+                        job["space_id"],
+                        job["user_id"],
+                        filename=job["filename"],
+                        file_id=job["file_id"],
+                        progress=progress
+                    )
+                else:
+                    # Extraction reads the spooled file directly
+                    _, chunk_count, reused_chunks = self.document_service.process_document(
+                        payload,
+                        job["filename"],
+                        job["space_id"],
+                        job["user_id"],
+                        file_id=job["file_id"],
+                        progress=progress,
+                        checkpoint=checkpoint,
+                        on_checkpoint=save_checkpoint
+                    )
+
+            update_ingestion_job(
+                job_id,
+                status="completed",
+                stage="done",
+                chunks_total=chunk_count,
+                chunks_embedded=chunk_count,
+                reused_chunks=reused_chunks,
+                error=None
+            )
+            self._remove_payload(job)
+            logger.info(f"Ingestion job {job_id} completed with {chunk_count} chunks")
+
+        except DocumentValidationError as e:
+            # Bad input will not succeed on retry
+            logger.warning(f"Ingestion job {job_id} rejected: {str(e)}")
+            update_ingestion_job(job_id, status="failed", error=str(e))
+            self._discard(job)
+
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {str(e)}", exc_info=True)
+            if job["attempts"] >= INGEST_MAX_ATTEMPTS:
+                update_ingestion_job(job_id, status="failed", error="Failed to process document")
+                self._discard(job)
+            else:
+                # Back off so a short provider or database outage does not use up every attempt
+                delay = min(INGEST_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1), INGEST_RETRY_MAX_SECONDS)
+                update_ingestion_job(
+                    job_id,
+                    status="queued",
+                    stage="queued",
+                    error=str(e),
+                    retry_at=datetime.now(timezone.utc) + timedelta(seconds=delay)
+                )
+
+    def _maintain_indexes(self, space_id: str) -> None:
+        # Retrains IVFFlat lists once the table has outgrown the ones built at startup,
+        # and gives spaces that have grown large their own partial index
+        try:
+            index_manager = get_index_manager()
+            index_manager.maybe_rebuild()
+            index_manager.maybe_index_space(space_id)
+        except Exception as e:
+            logger.error(f"Vector index maintenance failed: {str(e)}")
+
+    def _discard(self, job: Dict[str, Any]) -> None:
+        # Large-document mode commits page batches as it goes; a failed job must not leave them behind
+        if job["source"] == "file":
+            try:
+                delete_file_chunks(job["space_id"], job["file_id"])
+            except Exception as e:
+                logger.error(f"Could not remove partial chunks of job {job['id']}: {str(e)}")
+        self._remove_payload(job)
+
+    def _remove_payload(self, job: Dict[str, Any]) -> None:
+        if os.path.exists(job["payload_path"]):
+            os.remove(job["payload_path"])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    service = IngestionService()
+    service.start(max(1, settings.INGEST_WORKERS))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        service.stop()
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import re
 from typing import Dict, Any, List, Tuple
@@ -7,7 +8,6 @@ from services.ai_service import AIService
 from vector_store import (
     query_documents_hybrid,
     expand_query,
-    classify_query,
     get_all_chunks_from_space
 )
 from prompts import (
@@ -44,21 +44,21 @@ class QueryService:
         self.ai_service = AIService()
         self.chat_history: Dict[str, List[Tuple[str, str]]] = {}
 
-    def process_query(self, space_id: str, query: str, is_first_message: bool = False, user_id: str = None) -> Dict[str, Any]:
+    async def process_query(self, space_id: str, query: str, is_first_message: bool = False, user_id: str = None) -> Dict[str, Any]:
         if is_first_message:
             self.chat_history[space_id] = []
             logger.info(f"Cleared chat history for space: {space_id}")
 
-        query_type = classify_query(query)
+        query_type = await self.ai_service.classify(query)
 
         if query_type == QUERY_TYPE_ANALYZE_ALL:
-            result = self._process_analyze_all_query(space_id, query, user_id)
+            result = await self._process_analyze_all_query(space_id, query, user_id)
         elif query_type == QUERY_TYPE_PREV_CONTEXT:
-            result = self._process_prev_context_query(space_id, query, user_id)
+            result = await self._process_prev_context_query(space_id, query, user_id)
         elif query_type == QUERY_TYPE_CROSS_DOCUMENT:
-            result = self._process_cross_document_query(space_id, query, user_id)
+            result = await self._process_cross_document_query(space_id, query, user_id)
         else:
-            result = self._process_specific_query(space_id, query, user_id)
+            result = await self._process_specific_query(space_id, query, user_id)
 
         if space_id not in self.chat_history:
             self.chat_history[space_id] = []
@@ -105,8 +105,9 @@ class QueryService:
         return len(actual_entities) > 0
         return len(actual_entities) > 0
 
-    def _process_analyze_all_query(self, space_id: str, query: str, user_id: str = None) -> Dict[str, Any]:
-        relevant_chunks = get_all_chunks_from_space(
+    async def _process_analyze_all_query(self, space_id: str, query: str, user_id: str = None) -> Dict[str, Any]:
+        relevant_chunks = await asyncio.to_thread(
+            get_all_chunks_from_space,
             space_id,
             max_chunks=MAX_CHUNKS_ANALYZE_ALL,
             user_id=user_id
@@ -125,7 +126,7 @@ class QueryService:
             query=query
         )
 
-        answer = self.ai_service.generate_response(prompt)
+        answer = await self.ai_service.generate_response(prompt)
 
         if not answer:
             raise Exception("Failed to generate response")
@@ -140,12 +141,12 @@ class QueryService:
             }
         }
 
-    def _process_prev_context_query(self, space_id: str, query: str, user_id: str = None) -> Dict[str, Any]:
+    async def _process_prev_context_query(self, space_id: str, query: str, user_id: str = None) -> Dict[str, Any]:
         history = self.chat_history.get(space_id, [])
 
         if not history:
             logger.warning(f"No chat history found for space {space_id}, falling back to specific query")
-            return self._process_specific_query(space_id, query, user_id)
+            return await self._process_specific_query(space_id, query, user_id)
 
         chat_history_text = ""
         for i, (user_msg, assistant_msg) in enumerate(history, 1):
@@ -156,7 +157,7 @@ class QueryService:
             query=query
         )
 
-        answer = self.ai_service.generate_response(prompt)
+        answer = await self.ai_service.generate_response(prompt)
 
         if not answer:
             raise Exception("Failed to generate response")
@@ -171,12 +172,13 @@ class QueryService:
             }
         }
 
-    def _process_specific_query(self, space_id: str, query: str, user_id: str = None) -> Dict[str, Any]:
+    async def _process_specific_query(self, space_id: str, query: str, user_id: str = None) -> Dict[str, Any]:
         # Enhance query with chat history context for entity recognition
         enhanced_query = self._enhance_query_with_context(space_id, query)
         expanded_query = expand_query(enhanced_query)
         
-        relevant_chunks = query_documents_hybrid(
+        relevant_chunks = await asyncio.to_thread(
+            query_documents_hybrid,
             expanded_query,
             top_k=TOP_K_CHUNKS,
             space_id=space_id,
@@ -186,7 +188,7 @@ class QueryService:
         if not relevant_chunks:
             # Fallback: Try as cross-document query if no specific results found
             logger.info("No specific results found, trying cross-document approach")
-            return self._process_cross_document_query(space_id, query, user_id)
+            return await self._process_cross_document_query(space_id, query, user_id)
 
         relevant_chunks = relevant_chunks[:MAX_RELEVANT_CHUNKS]
 
@@ -200,14 +202,14 @@ class QueryService:
         unique_filenames = set(chunk.get('filename', 'N/A') for chunk in relevant_chunks)
         if len(unique_filenames) == 1 and self._query_mentions_entities(query):
             logger.info("Single document result for entity query, trying cross-document approach")
-            return self._process_cross_document_query(space_id, query, user_id)
+            return await self._process_cross_document_query(space_id, query, user_id)
 
         prompt = SPECIFIC_QUERY_PROMPT_TEMPLATE.format(
             context=context,
             query=query
         )
 
-        answer = self.ai_service.generate_response(prompt)
+        answer = await self.ai_service.generate_response(prompt)
 
         if not answer:
             raise Exception("Failed to generate response")
@@ -222,7 +224,7 @@ class QueryService:
             }
         }
 
-    def _process_cross_document_query(self, space_id: str, query: str, user_id: str = None) -> Dict[str, Any]:
+    async def _process_cross_document_query(self, space_id: str, query: str, user_id: str = None) -> Dict[str, Any]:
         """
         Document-aware two-stage retrieval for cross-document queries:
         1. Retrieve initial relevant chunks using semantic search
@@ -230,7 +232,8 @@ class QueryService:
         3. Synthesize results from multiple documents
         """
 
-        source_chunks = query_documents_hybrid(
+        source_chunks = await asyncio.to_thread(
+            query_documents_hybrid,
             query,
             top_k=10,
             space_id=space_id,
@@ -250,11 +253,12 @@ class QueryService:
             original_query=query
         )
 
-        extracted_info = self.ai_service.generate_response(extract_prompt)
+        extracted_info = await self.ai_service.generate_response(extract_prompt)
         logger.info(f"Extracted info from source: {extracted_info[:200]}...")
 
         enhanced_query = f"{extracted_info} {query}"
-        target_chunks = query_documents_hybrid(
+        target_chunks = await asyncio.to_thread(
+            query_documents_hybrid,
             enhanced_query,
             top_k=TOP_K_CHUNKS,
             space_id=space_id,
@@ -295,7 +299,7 @@ class QueryService:
             query=query
         )
 
-        answer = self.ai_service.generate_response(prompt)
+        answer = await self.ai_service.generate_response(prompt)
 
         if not answer:
             raise Exception("Failed to generate response")
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+from unittest.mock import AsyncMock, Mock, patch
+
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("DATABASE_URL", "sqlite:///test.db")
+os.environ.setdefault("FRONTEND_URL", "http://localhost:3000")
+os.environ.setdefault("BACKEND_URL", "http://localhost:8000")
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test-client-id")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test-client-secret")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("OPENROUTER_API_KEY", "test-openrouter-key")
+
+from services.ai_service import AIService, ProviderClients, ProviderRegistry
+
+
+def completion(text):
+    return Mock(choices=[Mock(message=Mock(content=text))])
+
+
+class AIServiceTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = ProviderRegistry()
+
+    def tearDown(self):
+        asyncio.run(self.registry.aclose())
+
+    def use_clients(self, provider, client, fallback_client=None, default_model="default-model"):
+        self.registry._providers[provider] = ProviderClients(client, fallback_client, default_model)
+
+    def test_generations_overlap_instead_of_blocking(self):
+        async def slow_create(**kwargs):
+            await asyncio.sleep(0.2)
+            return completion("answer")
+
+        client = Mock()
+        client.chat.completions.create = AsyncMock(side_effect=slow_create)
+        self.use_clients("openrouter", client)
+        service = AIService(registry=self.registry)
+
+        async def run():
+            return await asyncio.gather(*[service.generate_response("p") for _ in range(5)])
+
+        started = time.perf_counter()
+        answers = asyncio.run(run())
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(answers, ["answer"] * 5)
+        self.assertLess(elapsed, 0.6)
+
+    def test_stalled_stream_times_out_and_releases_slot(self):
+        async def stalled_stream():
+            yield Mock(choices=[Mock(delta=Mock(content="Hel"))])
+            await asyncio.sleep(10)
+
+        client = Mock()
+        client.chat.completions.create = AsyncMock(side_effect=lambda **kwargs: stalled_stream())
+        self.use_clients("openrouter", client)
+        service = AIService(registry=self.registry)
+
+        async def run():
+            received = []
+            with self.assertRaises(TimeoutError):
+                async for text in service.stream_response("p"):
+                    received.append(text)
+            return received, self.registry.semaphore("openrouter").locked()
+
+        with patch("services.ai_service.LLM_TIMEOUT_SECONDS", 0.05), \
+                patch.dict("services.ai_service.LLM_MAX_CONCURRENCY", {"openrouter": 1}):
+            received, locked = asyncio.run(run())
+
+        self.assertEqual(["Hel"], received)
+        self.assertFalse(locked)
+
+    def test_openrouter_falls_back_to_secondary_key(self):
+        client = Mock()
+        client.chat.completions.create = AsyncMock(side_effect=RuntimeError("401"))
+        fallback = Mock()
+        fallback.chat.completions.create = AsyncMock(return_value=completion("from fallback"))
+        self.use_clients("openrouter", client, fallback)
+        service = AIService(registry=self.registry)
+
+        answer = asyncio.run(service.generate_response("p"))
+
+        self.assertEqual(answer, "from fallback")
+
+    def test_per_call_provider_does_not_change_shared_service(self):
+        openrouter = Mock()
+        openrouter.chat.completions.create = AsyncMock(return_value=completion("openrouter"))
+        gemini = Mock()
+        gemini.aio.models.generate_content = AsyncMock(return_value=Mock(text="gemini"))
+        self.use_clients("openrouter", openrouter, default_model="or-model")
+        self.use_clients("gemini", gemini, default_model="gemini-model")
+        service = AIService(registry=self.registry)
+
+        async def run():
+            return await asyncio.gather(
+                service.generate_response("p", provider="gemini"),
+                service.generate_response("p"),
+                service.generate_response("p", provider="GEMINI", model="gemini-2.5-pro"),
+            )
+
+        self.assertEqual(asyncio.run(run()), ["gemini", "openrouter", "gemini"])
+        self.assertEqual(service.default_provider, "openrouter")
+        models = [call.kwargs["model"] for call in gemini.aio.models.generate_content.call_args_list]
+        self.assertEqual(models, ["gemini-model", "gemini-2.5-pro"])
+
+    def test_registry_builds_each_provider_once(self):
+        with patch.object(self.registry, "_build", side_effect=lambda p: ProviderClients(Mock(), None, p)) as build:
+            first = self.registry.get("gemini")
+            second = self.registry.get("Gemini")
+
+        self.assertIs(first, second)
+        build.assert_called_once_with("gemini")
+
+    def test_unknown_provider_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.registry.get("unknown")
+
+    def test_classify_defaults_to_specific_on_unexpected_label(self):
+        gemini = Mock()
+        gemini.aio.models.generate_content = AsyncMock(return_value=Mock(text="poetry"))
+        self.use_clients("gemini", gemini)
+        service = AIService(registry=self.registry)
+
+        self.assertEqual(asyncio.run(service.classify("write a poem")), "specific")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import sys
+import unittest
+from unittest.mock import Mock
+
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("DATABASE_URL", "sqlite:///test.db")
+os.environ.setdefault("FRONTEND_URL", "http://localhost:3000")
+os.environ.setdefault("BACKEND_URL", "http://localhost:8000")
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test-client-id")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test-client-secret")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("OPENROUTER_API_KEY", "test-openrouter-key")
+
+from services.answer_cache import AnswerCache, MemoryAnswerBackend, SemanticAnswerCache, normalize_query
+
+
+RESULT = {"answer": "a", "sources": [{"doc_id": "d1"}], "debug": {"context_tokens": 1}}
+
+
+class AnswerCacheTests(unittest.TestCase):
+    def test_normalized_query_shares_entry(self):
+        self.assertEqual(normalize_query("  What is  RAG?? "), "what is rag")
+        cache = AnswerCache(MemoryAnswerBackend(maxsize=8, ttl_seconds=60))
+
+        cache.put("space", "v1", "What is RAG?", "openrouter", "m", RESULT)
+
+        self.assertEqual(cache.get("space", "v1", "what is   rag", "openrouter", "m"), RESULT)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_key_covers_space_version_and_model(self):
+        cache = AnswerCache(MemoryAnswerBackend(maxsize=8, ttl_seconds=60))
+        cache.put("space", "v1", "q", "openrouter", "m", RESULT)
+
+        self.assertIsNone(cache.get("other", "v1", "q", "openrouter", "m"))
+        self.assertIsNone(cache.get("space", "v2", "q", "openrouter", "m"))
+        self.assertIsNone(cache.get("space", "v1", "q", "gemini", "m"))
+        self.assertIsNone(cache.get("space", "v1", "q", "openrouter", "m2"))
+        self.assertEqual(cache.stats()["misses"], 4)
+
+    def test_lru_evicts_least_recently_used_answer(self):
+        cache = AnswerCache(MemoryAnswerBackend(maxsize=2, ttl_seconds=60))
+        cache.put("space", "v1", "a", "p", "m", RESULT)
+        cache.put("space", "v1", "b", "p", "m", RESULT)
+        cache.get("space", "v1", "a", "p", "m")
+        cache.put("space", "v1", "c", "p", "m", RESULT)
+
+        self.assertIsNotNone(cache.get("space", "v1", "a", "p", "m"))
+        self.assertIsNone(cache.get("space", "v1", "b", "p", "m"))
+
+    def test_hits_are_independent_copies(self):
+        cache = AnswerCache(MemoryAnswerBackend(maxsize=8, ttl_seconds=60))
+        cache.put("space", "v1", "q", "p", "m", RESULT)
+
+        cache.get("space", "v1", "q", "p", "m")["debug"]["cache_hit"] = True
+
+        self.assertNotIn("cache_hit", cache.get("space", "v1", "q", "p", "m")["debug"])
+
+    def test_failing_backend_is_a_miss(self):
+        backend = Mock()
+        backend.get.side_effect = ConnectionError("down")
+        backend.set.side_effect = ConnectionError("down")
+        cache = AnswerCache(backend)
+
+        cache.put("space", "v1", "q", "p", "m", RESULT)
+
+        self.assertIsNone(cache.get("space", "v1", "q", "p", "m"))
+
+
+class SemanticAnswerCacheTests(unittest.TestCase):
+    def make_cache(self, **kwargs):
+        options = {"threshold": 0.9, "max_per_scope": 8, "max_scopes": 8, "ttl_seconds": 60}
+        options.update(kwargs)
+        return SemanticAnswerCache(**options)
+
+    def test_closest_entry_above_threshold_is_returned(self):
+        cache = self.make_cache()
+        cache.put("space", "v1", "p", "m", [1.0, 0.0], {"answer": "summary"})
+        cache.put("space", "v1", "p", "m", [0.0, 2.0], {"answer": "authors"})
+
+        result, similarity = cache.get("space", "v1", "p", "m", [0.1, 3.0])
+
+        self.assertEqual(result, {"answer": "authors"})
+        self.assertAlmostEqual(similarity, 0.9994, places=3)
+        self.assertIsNone(cache.get("space", "v1", "p", "m", [1.0, 1.0]))
+
+    def test_entries_are_scoped_to_space_version_and_model(self):
+        cache = self.make_cache()
+        cache.put("space", "v1", "p", "m", [1.0, 0.0], {"answer": "a"})
+
+        self.assertIsNone(cache.get("space", "v2", "p", "m", [1.0, 0.0]))
+        self.assertIsNone(cache.get("other", "v1", "p", "m", [1.0, 0.0]))
+        self.assertIsNone(cache.get("space", "v1", "p", "m2", [1.0, 0.0]))
+        self.assertEqual(cache.stats()["misses"], 3)
+
+    def test_scope_keeps_newest_entries(self):
+        cache = self.make_cache(max_per_scope=2)
+        cache.put("space", "v1", "p", "m", [1.0, 0.0, 0.0], {"answer": "first"})
+        cache.put("space", "v1", "p", "m", [0.0, 1.0, 0.0], {"answer": "second"})
+        cache.put("space", "v1", "p", "m", [0.0, 0.0, 1.0], {"answer": "third"})
+
+        self.assertIsNone(cache.get("space", "v1", "p", "m", [1.0, 0.0, 0.0]))
+        self.assertEqual(cache.get("space", "v1", "p", "m", [0.0, 1.0, 0.0])[0], {"answer": "second"})
+
+    def test_entries_expire_individually_in_a_busy_scope(self):
+        now = [0.0]
+        cache = self.make_cache(ttl_seconds=60, timer=lambda: now[0])
+        cache.put("space", "v1", "p", "m", [1.0, 0.0], {"answer": "old"})
+        now[0] = 45.0
+        cache.put("space", "v1", "p", "m", [0.0, 1.0], {"answer": "new"})
+        now[0] = 90.0
+
+        # The second write kept the scope alive, but the first entry is past its own TTL
+        self.assertIsNone(cache.get("space", "v1", "p", "m", [1.0, 0.0]))
+        self.assertEqual(cache.get("space", "v1", "p", "m", [0.0, 1.0])[0], {"answer": "new"})
+
+        # Storing drops expired entries instead of carrying them until the scope is full
+        cache.put("space", "v1", "p", "m", [1.0, 1.0], {"answer": "newest"})
+        self.assertEqual(2, len(cache._scopes[("space", "v1", "p", "m")][1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
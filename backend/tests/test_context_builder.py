@@ -0,0 +1,180 @@
+import os
+import sys
+import unittest
+from unittest.mock import Mock, patch
+
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("DATABASE_URL", "sqlite:///test.db")
+os.environ.setdefault("FRONTEND_URL", "http://localhost:3000")
+os.environ.setdefault("BACKEND_URL", "http://localhost:8000")
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test-client-id")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test-client-secret")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("OPENROUTER_API_KEY", "test-openrouter-key")
+
+from services import context_builder
+
+
+def make_builder():
+    # Whitespace "tokenizer" keeps the tests offline and the arithmetic obvious
+    encoder = Mock()
+    encoder.encode.side_effect = lambda text: text.split()
+    with patch.object(context_builder, "get_encoder", return_value=encoder):
+        builder = context_builder.ContextBuilder(metric="l2")
+    return builder, encoder
+
+
+def chunk(doc_id, text, filename="paper.pdf", chunk_index=0, distance=0.2, token_count=None):
+    return {
+        "doc_id": doc_id,
+        "text": text,
+        "filename": filename,
+        "chunk_index": chunk_index,
+        "distance": distance,
+        "token_count": token_count,
+    }
+
+
+class ContextBuilderTests(unittest.TestCase):
+    def test_stored_token_counts_are_used_instead_of_encoding_chunks(self):
+        builder, encoder = make_builder()
+        chunks = [
+            chunk("a", "one two three", chunk_index=0, token_count=3),
+            chunk("b", "four five", chunk_index=1, token_count=2),
+        ]
+
+        _, sources, tokens = builder.build_context_for_analyze_all(chunks, max_tokens=100)
+
+        self.assertEqual(["a", "b"], [s["doc_id"] for s in sources])
+        # "[Document: paper.pdf, Section N]" is 4 whitespace tokens
+        self.assertEqual(4 + 3 + 4 + 2, tokens)
+        encoded = [call.args[0] for call in encoder.encode.call_args_list]
+        self.assertNotIn("one two three", encoded)
+
+    def test_headers_are_encoded_once_per_distinct_header(self):
+        builder, encoder = make_builder()
+        chunks = [chunk("a", "x", token_count=1)]
+
+        builder.build_context_for_specific_query(chunks, max_tokens=100, distance_threshold=1.0)
+        builder.build_context_for_specific_query(chunks, max_tokens=100, distance_threshold=1.0)
+
+        self.assertEqual(1, encoder.encode.call_count)
+
+    def test_missing_token_count_falls_back_to_encoding(self):
+        builder, _ = make_builder()
+
+        _, _, tokens = builder.build_context_for_analyze_all([chunk("a", "one two", token_count=None)], max_tokens=100)
+
+        self.assertEqual(4 + 2, tokens)
+
+    def test_packer_skips_an_oversized_chunk_instead_of_stopping(self):
+        builder, _ = make_builder()
+        chunks = [
+            chunk("big", " ".join(["w"] * 80), filename="a.txt", distance=0.1, token_count=80),
+            chunk("b", "small b", filename="b.txt", distance=0.3, token_count=2),
+            chunk("c", "small c", filename="c.txt", distance=0.4, token_count=2),
+        ]
+
+        _, sources, tokens = builder.build_context_for_specific_query(chunks, max_tokens=32, distance_threshold=1.0)
+
+        self.assertEqual(["b", "c"], [s["doc_id"] for s in sources])
+        self.assertLessEqual(tokens, 32)
+
+    def test_packer_prefers_total_relevance_over_rank_order(self):
+        builder, _ = make_builder()
+        chunks = [
+            chunk("top", " ".join(["w"] * 40), filename="a.txt", distance=0.2, token_count=40),
+            chunk("b", " ".join(["w"] * 20), filename="b.txt", distance=0.25, token_count=20),
+            chunk("c", " ".join(["w"] * 20), filename="c.txt", distance=0.3, token_count=20),
+        ]
+
+        _, sources, tokens = builder.build_context_for_specific_query(chunks, max_tokens=64, distance_threshold=1.0)
+
+        self.assertEqual(["b", "c"], [s["doc_id"] for s in sources])
+        self.assertLessEqual(tokens, 64)
+
+    def test_fused_score_ranks_and_lexical_hits_skip_distance_cutoff(self):
+        builder, _ = make_builder()
+        semantic = chunk("semantic", "w " * 20, filename="a.txt", distance=0.2, token_count=20)
+        semantic.update(score=0.016, lexical=False)
+        lexical = chunk("lexical", "ERR_4021 w", filename="b.txt", distance=1.6, token_count=20)
+        lexical.update(score=0.032, lexical=True)
+        far = chunk("far", "w", filename="c.txt", distance=1.6, token_count=1)
+        far.update(score=0.05, lexical=False)
+
+        _, sources, _ = builder.build_context_for_specific_query(
+            [semantic, lexical, far], max_tokens=32, distance_threshold=1.0
+        )
+
+        # Only one of the two fits; the lexical hit has the higher fused score despite its distance
+        self.assertEqual(["lexical"], [s["doc_id"] for s in sources])
+
+    def test_adjacent_chunks_are_merged_without_repeating_the_overlap(self):
+        builder, _ = make_builder()
+        first = "alpha beta gamma delta epsilon zeta eta"
+        second = "epsilon zeta eta theta iota"
+        chunks = [
+            chunk("second", second, chunk_index=4, distance=0.2, token_count=5),
+            chunk("first", first, chunk_index=3, distance=0.3, token_count=7),
+        ]
+
+        context, sources, tokens = builder.build_context_for_specific_query(chunks, max_tokens=100, distance_threshold=1.0)
+
+        self.assertEqual(1, context.count("[Source"))
+        self.assertIn("alpha beta gamma delta epsilon zeta eta theta iota", context)
+        self.assertEqual(["first", "second"], [s["doc_id"] for s in sources])
+        # "[Source 1 - paper.pdf (PDF Document)]" is 6 tokens; "epsilon zeta eta" is counted once
+        self.assertEqual(6 + 7 + 5 - 3, tokens)
+
+    def test_overlap_of_adjacent_chunks_is_encoded_once_across_queries(self):
+        builder, encoder = make_builder()
+        chunks = [
+            chunk("first", "alpha beta gamma delta epsilon zeta eta", chunk_index=3, token_count=7),
+            chunk("second", "epsilon zeta eta theta iota", chunk_index=4, token_count=5),
+        ]
+
+        builder.build_context_for_specific_query(chunks, max_tokens=100, distance_threshold=1.0)
+        builder.build_context_for_specific_query(chunks, max_tokens=100, distance_threshold=1.0)
+
+        encoded = [call.args[0] for call in encoder.encode.call_args_list]
+        self.assertEqual(1, encoded.count("epsilon zeta eta"))
+
+    def test_analyze_all_stitches_neighbouring_sections(self):
+        builder, _ = make_builder()
+        chunks = [
+            chunk("doc_f1_0", "alpha beta gamma delta epsilon zeta eta", chunk_index=0, token_count=7),
+            chunk("doc_f1_1", "epsilon zeta eta theta iota", chunk_index=1, token_count=5),
+            chunk("doc_f2_0", "epsilon zeta eta theta iota", chunk_index=1, token_count=5),
+        ]
+
+        context, sources, tokens = builder.build_context_for_analyze_all(chunks, max_tokens=100)
+
+        self.assertIn("[Document: paper.pdf, Sections 0-1]\nalpha beta gamma delta epsilon zeta eta theta iota", context)
+        # Same filename but a different upload, so it is not stitched
+        self.assertEqual(2, context.count("[Document:"))
+        self.assertEqual(["doc_f1_0", "doc_f1_1", "doc_f2_0"], [s["doc_id"] for s in sources])
+        self.assertEqual((4 + 7 + 5 - 3) + (4 + 5), tokens)
+
+    def test_analyze_all_stops_inside_a_span_when_the_budget_runs_out(self):
+        builder, _ = make_builder()
+        chunks = [
+            chunk("doc_f1_0", "alpha beta gamma delta epsilon zeta eta", chunk_index=0, token_count=7),
+            chunk("doc_f1_1", "epsilon zeta eta theta iota", chunk_index=1, token_count=5),
+        ]
+
+        context, sources, tokens = builder.build_context_for_analyze_all(chunks, max_tokens=12)
+
+        self.assertEqual("[Document: paper.pdf, Section 0]\nalpha beta gamma delta epsilon zeta eta", context)
+        self.assertEqual(["doc_f1_0"], [s["doc_id"] for s in sources])
+        self.assertEqual(4 + 7, tokens)
+
+    def test_knapsack_select_respects_capacity(self):
+        chosen = context_builder.knapsack_select([10, 20, 30], [1.0, 2.5, 3.0], 50, granularity=1)
+
+        self.assertEqual([1, 2], chosen)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,11 +5,13 @@ import unittest
 from pathlib import Path
 from unittest.mock import patch
 
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.sql.schema import MetaData
 
 
 class DocumentIndexTests(unittest.TestCase):
-    def load_db_utils(self):
+    def load_db_utils(self, index_type="ivfflat", metric="l2", storage="full", prefix_dimension=0):
         module_name = "test_db_utils_module"
         module_path = Path(__file__).resolve().parents[1] / "db_utils.py"
         spec = importlib.util.spec_from_file_location(module_name, module_path)
@@ -18,6 +20,13 @@ class DocumentIndexTests(unittest.TestCase):
         fake_settings = types.SimpleNamespace(
             DATABASE_URL="postgresql://localhost/test",
             EMBEDDING_DIMENSION=768,
+            VECTOR_INDEX_TYPE=index_type,
+            HNSW_M=16,
+            HNSW_EF_CONSTRUCTION=64,
+            IVFFLAT_LISTS=100,
+            DISTANCE_METRIC=metric,
+            VECTOR_STORAGE=storage,
+            SEARCH_PREFIX_DIMENSION=prefix_dimension,
         )
 
         config_module = types.ModuleType("config.config")
@@ -54,6 +63,50 @@ class DocumentIndexTests(unittest.TestCase):
             embedding_index.dialect_options["postgresql"]["ops"],
         )
 
+    def test_hnsw_index_uses_configured_build_parameters(self):
+        module = self.load_db_utils(index_type="hnsw")
+
+        indexes = {index.name: index for index in module.Document.__table__.indexes}
+        options = indexes["ix_documents_embedding"].dialect_options["postgresql"]
+
+        self.assertEqual("hnsw", options["using"])
+        self.assertEqual({"m": 16, "ef_construction": 64}, options["with"])
+
+    def test_inner_product_metric_uses_ip_opclass(self):
+        module = self.load_db_utils(metric="inner_product")
+
+        indexes = {index.name: index for index in module.Document.__table__.indexes}
+        options = indexes["ix_documents_embedding"].dialect_options["postgresql"]
+
+        self.assertEqual({"embedding": "vector_ip_ops"}, options["ops"])
+
+    def test_binary_storage_indexes_quantized_expression(self):
+        module = self.load_db_utils(index_type="hnsw", storage="binary")
+
+        indexes = {index.name: index for index in module.Document.__table__.indexes}
+        embedding_index = indexes["ix_documents_embedding"]
+        ddl = str(CreateIndex(embedding_index).compile(dialect=postgresql.dialect()))
+
+        self.assertIn("CAST(binary_quantize(embedding) AS BIT(768)) bit_hamming_ops", ddl)
+
+    def test_prefix_search_indexes_leading_dimensions(self):
+        module = self.load_db_utils(index_type="hnsw", metric="inner_product", prefix_dimension=128)
+
+        indexes = {index.name: index for index in module.Document.__table__.indexes}
+        ddl = str(CreateIndex(indexes["ix_documents_embedding"]).compile(dialect=postgresql.dialect()))
+
+        self.assertIn("CAST(subvector(embedding, 1, 128) AS VECTOR(128)) vector_cosine_ops", ddl)
+
+    def test_text_search_is_generated_and_gin_indexed(self):
+        module = self.load_db_utils()
+
+        table = module.Document.__table__
+        indexes = {index.name: index for index in table.indexes}
+
+        self.assertEqual("gin", indexes["ix_documents_text_search"].dialect_options["postgresql"]["using"])
+        self.assertIn("to_tsvector('english', text)", str(table.c.text_search.computed.sqltext))
+        self.assertTrue(table.c.text_search.computed.persisted)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,128 @@
+import os
+import sys
+import types
+import unittest
+from importlib import import_module, reload
+from unittest.mock import Mock, patch
+
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("DATABASE_URL", "sqlite:///test.db")
+os.environ.setdefault("FRONTEND_URL", "http://localhost:3000")
+os.environ.setdefault("BACKEND_URL", "http://localhost:8000")
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test-client-id")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test-client-secret")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("OPENROUTER_API_KEY", "test-openrouter-key")
+
+
+class LargeDocumentTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        fake_db_utils = types.ModuleType("db_utils")
+        fake_db_utils.get_db_session = Mock()
+        fake_db_utils.engine = Mock()
+        fake_db_utils.Document = Mock()
+        fake_db_utils.Spaces = Mock()
+        fake_db_utils.verify_space_access = Mock(return_value=True)
+        fake_db_utils.new_content_version = Mock(return_value="version-2")
+        sys.modules["db_utils"] = fake_db_utils
+        reload(import_module("vector_store"))
+        cls.module = reload(import_module("services.document_service"))
+
+    def setUp(self):
+        self.service = self.module.DocumentService()
+        self.pages = [(i, f"Text of page {i}.") for i in range(1, 6)]
+        self.page_requests = []
+
+        def iter_document_pages(source, filename, start_page, max_pages, stop_page=None):
+            self.page_requests.append((start_page, max_pages))
+            return iter([page for page in self.pages if start_page < page[0] <= (stop_page or len(self.pages))])
+
+        def upload_chunks(chunks, space_id, user_id, filename, file_id, progress, first_index):
+            chunks = list(chunks)
+            self.uploads.append((first_index, [chunk.page_start for chunk in chunks]))
+            return file_id, len(chunks), 1
+
+        self.uploads = []
+        encoder = Mock()
+        encoder.encode.side_effect = lambda text: text.split()
+        patches = [
+            patch.object(self.module, "pdf_page_count", return_value=len(self.pages)),
+            patch.object(self.module, "iter_document_pages", side_effect=iter_document_pages),
+            patch.object(self.module, "upload_chunks", side_effect=upload_chunks),
+            patch.object(self.module, "delete_file_chunks"),
+            patch.object(self.module, "MAX_PDF_PAGES", 3),
+            patch.object(self.module, "LARGE_DOCUMENT_BATCH_PAGES", 2),
+            patch("pdf_utils.get_encoder", return_value=encoder),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_long_pdf_is_stored_in_checkpointed_page_batches(self):
+        checkpoints = []
+
+        file_id, chunk_count, reused = self.service.process_document(
+            b"%PDF", "book.pdf", "space", "user", file_id="file-1", on_checkpoint=checkpoints.append
+        )
+
+        # Each two-page batch fits in one chunk; chunk numbering continues across batches
+        self.assertEqual(("file-1", 3, 3), (file_id, chunk_count, reused))
+        self.assertEqual([(0, [1]), (1, [3]), (2, [5])], self.uploads)
+        self.assertEqual([2, 4, 5], [checkpoint.pages_done for checkpoint in checkpoints])
+        joined = "\n".join(text for _, text in self.pages)
+        self.assertEqual(len(joined), checkpoints[-1].chars_done)
+        self.assertEqual((0, self.module.LARGE_DOCUMENT_MAX_PAGES), self.page_requests[0])
+
+    def test_checkpoint_counts_blank_pages_that_were_read(self):
+        # Pages 4 and 5 have no text; the last checkpoint still covers them
+        self.pages = self.pages[:3]
+        checkpoints = []
+
+        self.service.process_document(
+            b"%PDF", "book.pdf", "space", "user", file_id="file-1", on_checkpoint=checkpoints.append
+        )
+
+        self.assertEqual([(0, [1]), (1, [3])], self.uploads)
+        self.assertEqual([2, 4, 5], [checkpoint.pages_done for checkpoint in checkpoints])
+        self.assertEqual(2, checkpoints[-1].chunks_done)
+
+    def test_resume_skips_checkpointed_pages_and_clears_uncheckpointed_chunks(self):
+        checkpoint = self.module.IngestCheckpoint(pages_done=4, chunks_done=4, chars_done=71, reused_done=4)
+
+        _, chunk_count, reused = self.service.process_document(
+            b"%PDF", "book.pdf", "space", "user", file_id="file-1", checkpoint=checkpoint
+        )
+
+        self.assertEqual((5, 5), (chunk_count, reused))
+        self.assertEqual([(4, [5])], self.uploads)
+        self.assertEqual(4, self.page_requests[0][0])
+        self.module.delete_file_chunks.assert_called_once_with("space", "file-1", from_index=4)
+
+    def test_short_pdf_is_stored_in_one_transaction(self):
+        self.pages = self.pages[:3]
+        self.module.pdf_page_count.return_value = 3
+
+        with patch.object(self.module, "upload_chunks", return_value=("file-1", 3, 0)) as upload:
+            self.service.process_document(b"%PDF", "paper.pdf", "space", "user", file_id="file-1")
+
+        upload.assert_called_once()
+        self.module.delete_file_chunks.assert_not_called()
+
+    def test_pdfs_may_exceed_the_text_upload_size_limit(self):
+        self.assertGreater(self.service.max_upload_bytes("book.pdf"), self.service.max_upload_bytes("notes.txt"))
+        with self.assertRaises(ValueError):
+            self.service.validate_file("notes.txt", self.module.MAX_FILE_SIZE_BYTES + 1)
+
+    def test_only_pdfs_long_enough_for_large_document_mode_keep_the_larger_limit(self):
+        oversized = b"%PDF" + b" " * self.module.MAX_FILE_SIZE_BYTES
+
+        self.service.process_document(oversized, "book.pdf", "space", "user", file_id="file-1")
+        self.module.pdf_page_count.return_value = 3
+        with self.assertRaises(self.module.DocumentValidationError):
+            self.service.process_document(oversized, "paper.pdf", "space", "user", file_id="file-1")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from services import embedding_cache
+from services.embedding_cache import CachedEmbeddingService
+
+
+def make_inner_service():
+    service = Mock(model_name="gemini-embedding-001", output_dimensionality=768, normalize=False)
+    service.embed_queries.side_effect = lambda texts: [[float(len(t)), 0.5] for t in texts]
+    return service
+
+
+class CachedEmbeddingServiceTests(unittest.TestCase):
+    def test_repeated_queries_hit_memory_cache(self):
+        inner = make_inner_service()
+        cache = CachedEmbeddingService(inner, maxsize=8, ttl_seconds=60)
+
+        first = cache.embed_queries(["summarize", "key points"])
+        second = cache.embed_queries(["key points", "summarize", "new"])
+
+        self.assertEqual(first, [[9.0, 0.5], [10.0, 0.5]])
+        self.assertEqual(second, [[10.0, 0.5], [9.0, 0.5], [3.0, 0.5]])
+        self.assertEqual(inner.embed_queries.call_count, 2)
+        inner.embed_queries.assert_called_with(["new"])
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 3)
+
+    def test_lru_evicts_least_recently_used_entry(self):
+        inner = make_inner_service()
+        cache = CachedEmbeddingService(inner, maxsize=2, ttl_seconds=60)
+
+        cache.embed_query("a")
+        cache.embed_query("b")
+        cache.embed_query("a")
+        cache.embed_query("c")
+        cache.embed_query("a")
+        cache.embed_query("b")
+
+        inner.embed_queries.assert_called_with(["b"])
+        self.assertEqual(inner.embed_queries.call_count, 4)
+
+    def test_short_provider_response_raises_instead_of_caching_misaligned_vectors(self):
+        inner = make_inner_service()
+        inner.embed_queries.side_effect = lambda texts: [[1.0, 0.5]]
+        cache = CachedEmbeddingService(inner, maxsize=8, ttl_seconds=60)
+
+        with self.assertRaisesRegex(ValueError, "returned 1 vectors for 2 queries"):
+            cache.embed_queries(["a", "b"])
+        self.assertEqual(0, cache.stats()["size"])
+
+    def test_disk_tier_survives_new_instance(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.sqlite3")
+            first = CachedEmbeddingService(make_inner_service(), maxsize=8, ttl_seconds=60, disk_path=path)
+            first.embed_query("what are the key points")
+            first.close()
+
+            inner = make_inner_service()
+            second = CachedEmbeddingService(inner, maxsize=8, ttl_seconds=60, disk_path=path)
+            embedding = second.embed_query("what are the key points")
+            second.close()
+
+        self.assertEqual(embedding, [23.0, 0.5])
+        inner.embed_queries.assert_not_called()
+        self.assertEqual(second.stats()["disk_hits"], 1)
+
+    def test_disk_tier_deletes_expired_rows_and_evicts_oldest_beyond_its_cap(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.sqlite3")
+            cache = CachedEmbeddingService(
+                make_inner_service(), maxsize=8, ttl_seconds=60, disk_path=path, disk_maxsize=2
+            )
+            clock = Mock()
+            with patch.object(embedding_cache, "DISK_PRUNE_INTERVAL", 2), \
+                    patch.object(embedding_cache, "time", clock):
+                for text, age in [("expired", 120), ("old", 30), ("newer", 20), ("newest", 10)]:
+                    clock.time.return_value = time.time() - age
+                    cache.embed_query(text)
+            rows = cache._disk.execute("SELECT count(*) FROM query_embeddings").fetchone()[0]
+            cache.close()
+
+            inner = make_inner_service()
+            reopened = CachedEmbeddingService(inner, maxsize=8, ttl_seconds=60, disk_path=path, disk_maxsize=2)
+            reopened.embed_queries(["newer", "newest", "old"])
+            reopened.close()
+
+        self.assertEqual(2, rows)
+        inner.embed_queries.assert_called_once_with(["old"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,8 @@ import sys
 import unittest
 from unittest.mock import Mock
 
+from google.genai import errors
+
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 os.environ.setdefault("GEMINI_API_KEY", "test-key")
@@ -59,6 +61,127 @@ class GeminiEmbeddingServiceTests(unittest.TestCase):
         self.assertEqual(kwargs["config"].task_type, "RETRIEVAL_QUERY")
         self.assertIsNone(kwargs["config"].title)
 
+    def test_embed_queries_batches_all_queries_in_one_request(self):
+        client = Mock()
+        client.models.embed_content.return_value.embeddings = [
+            Mock(values=[0.1]),
+            Mock(values=[0.2]),
+        ]
+        service = GeminiEmbeddingService(
+            api_key="test-key",
+            model_name="gemini-embedding-001",
+            output_dimensionality=768,
+            client=client,
+        )
+
+        embeddings = service.embed_queries(["first", "second"])
+
+        self.assertEqual(embeddings, [[0.1], [0.2]])
+        client.models.embed_content.assert_called_once()
+        _, kwargs = client.models.embed_content.call_args
+        self.assertEqual(kwargs["contents"], ["first", "second"])
+        self.assertEqual(kwargs["config"].task_type, "RETRIEVAL_QUERY")
+
+    def test_embed_documents_splits_batches_and_preserves_order(self):
+        client = Mock()
+        client.models.embed_content.side_effect = lambda model, contents, config: Mock(
+            embeddings=[Mock(values=[float(text)]) for text in contents]
+        )
+        service = GeminiEmbeddingService(
+            api_key="test-key",
+            model_name="gemini-embedding-001",
+            output_dimensionality=768,
+            client=client,
+            batch_size=3,
+            max_parallel_batches=3,
+        )
+
+        texts = [str(i) for i in range(8)]
+        embeddings = service.embed_documents(texts)
+
+        self.assertEqual(embeddings, [[float(i)] for i in range(8)])
+        self.assertEqual(client.models.embed_content.call_count, 3)
+        batch_sizes = sorted(len(call.kwargs["contents"]) for call in client.models.embed_content.call_args_list)
+        self.assertEqual(batch_sizes, [2, 3, 3])
+
+    def test_embed_documents_respects_token_budget(self):
+        service = GeminiEmbeddingService(
+            api_key="test-key",
+            model_name="gemini-embedding-001",
+            output_dimensionality=768,
+            client=Mock(),
+            batch_token_budget=30,
+        )
+
+        batches = service._split_batches(["x" * 80, "y" * 80, "z" * 200])
+
+        self.assertEqual([len(batch) for batch in batches], [1, 1, 1])
+
+    def test_failed_batch_is_retried_on_its_own(self):
+        calls = []
+
+        def embed_content(model, contents, config):
+            calls.append(list(contents))
+            if contents == ["b"] and calls.count(["b"]) == 1:
+                raise errors.ServerError(503, {"error": {"code": 503, "status": "UNAVAILABLE"}})
+            return Mock(embeddings=[Mock(values=[ord(text)]) for text in contents])
+
+        client = Mock()
+        client.models.embed_content.side_effect = embed_content
+        sleeps = []
+        service = GeminiEmbeddingService(
+            api_key="test-key",
+            model_name="gemini-embedding-001",
+            output_dimensionality=768,
+            client=client,
+            batch_size=1,
+            sleep=sleeps.append,
+        )
+
+        embeddings = service.embed_documents(["a", "b", "c"])
+
+        self.assertEqual(embeddings, [[97], [98], [99]])
+        self.assertEqual(calls.count(["a"]), 1)
+        self.assertEqual(calls.count(["b"]), 2)
+        self.assertEqual(sleeps, [service.retry_base_delay])
+
+    def test_rate_limited_batch_is_retried_but_bad_requests_are_not(self):
+        client = Mock()
+        client.models.embed_content.side_effect = [
+            errors.ClientError(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}),
+            Mock(embeddings=[Mock(values=[1.0])]),
+            errors.ClientError(400, {"error": {"code": 400, "status": "INVALID_ARGUMENT"}}),
+        ]
+        sleeps = []
+        service = GeminiEmbeddingService(
+            api_key="test-key",
+            model_name="gemini-embedding-001",
+            output_dimensionality=768,
+            client=client,
+            sleep=sleeps.append,
+        )
+
+        self.assertEqual([[1.0]], service.embed_documents(["a"]))
+        with self.assertRaises(errors.ClientError):
+            service.embed_documents(["b"])
+
+        self.assertEqual(3, client.models.embed_content.call_count)
+        self.assertEqual([service.retry_base_delay], sleeps)
+
+    def test_normalize_returns_unit_vectors(self):
+        client = Mock()
+        client.models.embed_content.return_value.embeddings = [Mock(values=[3.0, 4.0])]
+        service = GeminiEmbeddingService(
+            api_key="test-key",
+            model_name="gemini-embedding-001",
+            output_dimensionality=2,
+            client=client,
+            normalize=True,
+        )
+
+        self.assertEqual(service.embed_query("q"), [0.6, 0.8])
+        self.assertEqual(service.embed_documents(["chunk"]), [[0.6, 0.8]])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,267 @@
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import types
+import unittest
+from importlib import import_module, reload
+from unittest.mock import Mock, patch
+
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("DATABASE_URL", "sqlite:///test.db")
+os.environ.setdefault("FRONTEND_URL", "http://localhost:3000")
+os.environ.setdefault("BACKEND_URL", "http://localhost:8000")
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test-client-id")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test-client-secret")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("OPENROUTER_API_KEY", "test-openrouter-key")
+
+
+BOUNDARY = "test-boundary"
+
+
+def multipart_body(parts):
+    """multipart/form-data body of (name, filename or None, content) parts."""
+    body = b""
+    for name, filename, content in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + content + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+class IngestionServiceTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        fake_db_utils = types.ModuleType("db_utils")
+        fake_db_utils.get_db_session = Mock()
+        fake_db_utils.engine = Mock()
+        fake_db_utils.Document = Mock()
+        fake_db_utils.Spaces = Mock()
+        fake_db_utils.verify_space_access = Mock(return_value=True)
+        fake_db_utils.new_content_version = Mock(return_value="version-2")
+        fake_db_utils.create_ingestion_job = Mock()
+        fake_db_utils.get_ingestion_job = Mock()
+        fake_db_utils.claim_next_ingestion_job = Mock()
+        fake_db_utils.update_ingestion_job = Mock()
+        sys.modules["db_utils"] = fake_db_utils
+        reload(import_module("vector_store"))
+        reload(import_module("services.document_service"))
+        cls.module = reload(import_module("services.ingestion_service"))
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.service = self.module.IngestionService(spool_dir=self.tmp.name)
+        self.service.document_service = Mock()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_job(self, attempts=1):
+        payload_path = os.path.join(self.tmp.name, "job-1")
+        with open(payload_path, "wb") as f:
+            f.write(b"%PDF")
+        return {
+            "id": "job-1",
+            "user_id": "user",
+            "space_id": "space",
+            "filename": "paper.pdf",
+            "file_id": "file-1",
+            "source": "file",
+            "payload_path": payload_path,
+            "attempts": attempts,
+        }
+
+    def test_successful_job_is_completed_and_payload_removed(self):
+        job = self.make_job()
+        received = {}
+
+        def process(payload, *args, **kwargs):
+            # Extraction gets the spooled file itself, not a copy of its bytes
+            received["content"] = payload.read()
+            received["args"] = args
+            received["file_id"] = kwargs["file_id"]
+            return "file-1", 12, 4
+
+        self.service.document_service.process_document.side_effect = process
+
+        with patch.object(self.module, "update_ingestion_job") as update:
+            self.service.process_job(job)
+
+        self.assertEqual(received["content"], b"%PDF")
+        self.assertEqual(received["args"], ("paper.pdf", "space", "user"))
+        self.assertEqual(received["file_id"], "file-1")
+        update.assert_called_with(
+            "job-1", status="completed", stage="done",
+            chunks_total=12, chunks_embedded=12, reused_chunks=4, error=None
+        )
+        self.assertFalse(os.path.exists(job["payload_path"]))
+
+    def test_progress_callback_updates_job_row(self):
+        job = self.make_job()
+
+        def process(*args, progress, **kwargs):
+            progress("embedding", chunks_total=10, chunks_embedded=3)
+            return "file-1", 10, 0
+
+        self.service.document_service.process_document.side_effect = process
+
+        with patch.object(self.module, "update_ingestion_job") as update:
+            self.service.process_job(job)
+
+        update.assert_any_call("job-1", stage="embedding", chunks_total=10, chunks_embedded=3)
+
+    def test_transient_failure_requeues_until_attempts_exhausted(self):
+        job = self.make_job(attempts=1)
+        self.service.document_service.process_document.side_effect = RuntimeError("503")
+
+        with patch.object(self.module, "update_ingestion_job") as update:
+            self.service.process_job(job)
+        fields = update.call_args.kwargs
+        self.assertEqual(("queued", "queued", "503"), (fields["status"], fields["stage"], fields["error"]))
+        self.assertTrue(os.path.exists(job["payload_path"]))
+
+        job["attempts"] = self.module.INGEST_MAX_ATTEMPTS
+        with patch.object(self.module, "update_ingestion_job") as update, \
+                patch.object(self.module, "delete_file_chunks") as delete_chunks:
+            self.service.process_job(job)
+        update.assert_called_with("job-1", status="failed", error="Failed to process document")
+        delete_chunks.assert_called_once_with("space", "file-1")
+        self.assertFalse(os.path.exists(job["payload_path"]))
+
+    def test_worker_survives_a_failed_job_status_write(self):
+        job = self.make_job()
+        self.service.document_service.process_document.side_effect = RuntimeError("db down")
+        claims = []
+
+        def claim(stale_seconds):
+            claims.append(stale_seconds)
+            if len(claims) == 1:
+                return job
+            self.service._stop.set()
+            return None
+
+        with patch.object(self.module, "claim_next_ingestion_job", side_effect=claim), \
+                patch.object(self.module, "update_ingestion_job", side_effect=RuntimeError("db down")), \
+                patch.object(self.module, "INGEST_POLL_INTERVAL_SECONDS", 0), \
+                patch.object(self.service, "_maintain_indexes") as maintain:
+            self.service._run_worker()
+
+        self.assertEqual(2, len(claims))
+        maintain.assert_not_called()
+
+    def test_only_validation_errors_fail_a_job_without_retry(self):
+        job = self.make_job(attempts=1)
+        self.service.document_service.process_document.side_effect = ValueError(
+            "Embedding provider returned 3 vectors for 4 texts"
+        )
+        with patch.object(self.module, "update_ingestion_job") as update:
+            self.service.process_job(job)
+        self.assertEqual("queued", update.call_args.kwargs["status"])
+
+        self.service.document_service.process_document.side_effect = self.module.DocumentValidationError(
+            "PDF has 3000 pages. Maximum allowed is 2000 pages."
+        )
+        with patch.object(self.module, "update_ingestion_job") as update, \
+                patch.object(self.module, "delete_file_chunks"):
+            self.service.process_job(job)
+        update.assert_called_with("job-1", status="failed", error="PDF has 3000 pages. Maximum allowed is 2000 pages.")
+        self.assertFalse(os.path.exists(job["payload_path"]))
+
+    def test_requeued_job_backs_off_exponentially(self):
+        delays = []
+        for attempts in (1, 2, 10):
+            job = self.make_job(attempts=attempts)
+            self.service.document_service.process_document.side_effect = RuntimeError("503")
+            with patch.object(self.module, "INGEST_MAX_ATTEMPTS", 20), \
+                    patch.object(self.module, "update_ingestion_job") as update:
+                before = self.module.datetime.now(self.module.timezone.utc)
+                self.service.process_job(job)
+            delays.append(round((update.call_args.kwargs["retry_at"] - before).total_seconds()))
+
+        base = self.module.INGEST_RETRY_BASE_SECONDS
+        self.assertEqual([base, base * 2, self.module.INGEST_RETRY_MAX_SECONDS], delays)
+
+    def receive(self, parts, chunk_size=700):
+        body = multipart_body(parts)
+
+        async def stream():
+            for i in range(0, len(body), chunk_size):
+                yield body[i:i + chunk_size]
+
+        return asyncio.run(self.service.receive_upload(stream(), f"multipart/form-data; boundary={BOUNDARY}"))
+
+    def test_upload_is_parsed_into_the_spool_and_hashed_as_it_arrives(self):
+        self.service.document_service.max_upload_bytes.return_value = 10000
+
+        with patch.object(self.module, "create_ingestion_job", side_effect=lambda **job: job) as create:
+            upload = self.receive([("space_id", None, b"space"), ("file", "paper.pdf", b"x" * 2500)])
+            job = self.service.enqueue_upload(upload, "space", "user")
+
+        self.assertEqual({"space_id": "space"}, upload.fields)
+        self.assertEqual(("paper.pdf", 2500), (job["filename"], upload.size))
+        self.assertEqual(hashlib.sha256(b"x" * 2500).hexdigest(), job["content_sha256"])
+        # The spool file is the only copy; the job id names it
+        self.assertEqual([job["job_id"]], os.listdir(self.tmp.name))
+        with open(create.call_args.kwargs["payload_path"], "rb") as f:
+            self.assertEqual(b"x" * 2500, f.read())
+
+    def test_oversized_upload_is_rejected_while_streaming(self):
+        self.service.document_service.max_upload_bytes.return_value = 1500
+
+        with patch.object(self.module, "UPLOAD_READ_CHUNK_BYTES", 1000), \
+                patch.object(self.module.MultipartSpool, "write", autospec=True,
+                             side_effect=self.module.MultipartSpool.write) as write:
+            with self.assertRaises(ValueError):
+                self.receive([("space_id", None, b"space"), ("file", "paper.pdf", b"x" * 5000)])
+
+        # Parsing stops at the block that crosses the limit; the rest of the body is never parsed
+        self.assertEqual(2, write.call_count)
+        self.assertEqual([], os.listdir(self.tmp.name))
+
+    def test_unsupported_file_type_is_rejected_before_it_is_written(self):
+        self.service.document_service.validate_file.side_effect = ValueError("Unsupported file type.")
+
+        with self.assertRaises(ValueError):
+            self.receive([("file", "slides.pptx", b"x" * 100)])
+
+        self.assertEqual([], os.listdir(self.tmp.name))
+
+    def test_queueing_an_upload_does_not_parse_the_document(self):
+        self.service.document_service.max_upload_bytes.return_value = 10000
+        upload = self.receive([("file", "paper.pdf", b"x" * 2500)])
+
+        with patch.object(self.module, "create_ingestion_job", side_effect=lambda **job: job):
+            self.service.enqueue_upload(upload, "space", "user")
+
+        # Page counts and the size limit for short PDFs are checked by the worker
+        called = {name for name, _, _ in self.service.document_service.method_calls}
+        self.assertEqual({"validate_file", "max_upload_bytes"}, called)
+
+    def test_checkpointed_job_resumes_and_records_new_checkpoints(self):
+        job = self.make_job(attempts=2)
+        job.update(checkpoint_page=40, checkpoint_chunk=120, checkpoint_char=90000, checkpoint_reused=7)
+
+        def process(payload, *args, checkpoint, on_checkpoint, **kwargs):
+            self.assertEqual(self.module.IngestCheckpoint(40, 120, 90000, 7), checkpoint)
+            on_checkpoint(self.module.IngestCheckpoint(60, 180, 130000, 9))
+            return "file-1", 180, 9
+
+        self.service.document_service.process_document.side_effect = process
+
+        with patch.object(self.module, "update_ingestion_job") as update:
+            self.service.process_job(job)
+
+        update.assert_any_call(
+            "job-1", checkpoint_page=60, checkpoint_chunk=180, checkpoint_char=130000, checkpoint_reused=9
+        )
+        update.assert_called_with(
+            "job-1", status="completed", stage="done",
+            chunks_total=180, chunks_embedded=180, reused_chunks=9, error=None
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import sys
+import types
+import unittest
+from importlib import import_module, reload
+from unittest.mock import Mock, patch
+
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("DATABASE_URL", "sqlite:///test.db")
+os.environ.setdefault("FRONTEND_URL", "http://localhost:3000")
+os.environ.setdefault("BACKEND_URL", "http://localhost:8000")
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test-client-id")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test-client-secret")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("OPENROUTER_API_KEY", "test-openrouter-key")
+
+
+class NormalizeEmbeddingsTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        fake_db_utils = types.ModuleType("db_utils")
+        fake_db_utils.get_db_session = Mock()
+        fake_db_utils.engine = Mock()
+        fake_db_utils.Document = types.SimpleNamespace(__tablename__="documents")
+        sys.modules["db_utils"] = fake_db_utils
+        reload(import_module("vector_index"))
+        cls.module = reload(import_module("migrations"))
+
+    def test_embeddings_are_normalized_in_committed_batches_by_id(self):
+        connection = Mock()
+        connection.execute.return_value.scalars.return_value.all.side_effect = [[1, 2], [5, 7], [9], []]
+
+        with patch.object(self.module.settings, "DISTANCE_METRIC", "cosine"), \
+                patch.object(self.module, "EMBEDDING_NORMALIZE_BATCH", 2):
+            self.module._normalize_embeddings(connection)
+
+        cursors = [call.args[1]["after"] for call in connection.execute.call_args_list]
+        self.assertEqual([0, 2, 7, 9], cursors)
+        self.assertEqual(3, connection.commit.call_count)
+
+    def test_l2_metric_leaves_embeddings_alone(self):
+        connection = Mock()
+
+        with patch.object(self.module.settings, "DISTANCE_METRIC", "l2"):
+            self.module._normalize_embeddings(connection)
+
+        connection.execute.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,268 @@
+import os
+import sys
+import tempfile
+import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import Mock, patch
+
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("DATABASE_URL", "sqlite:///test.db")
+os.environ.setdefault("FRONTEND_URL", "http://localhost:3000")
+os.environ.setdefault("BACKEND_URL", "http://localhost:8000")
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test-client-id")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test-client-secret")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("OPENROUTER_API_KEY", "test-openrouter-key")
+
+import pdf_utils
+
+
+def whitespace_encoder():
+    # One token per word keeps the tests offline and the budgets easy to follow
+    encoder = Mock()
+    encoder.encode.side_effect = lambda text: text.split()
+    encoder.decode.side_effect = lambda tokens: " ".join(tokens)
+    return encoder
+
+
+def make_pdf(page_texts):
+    """Smallest PDF PyPDF2 can extract text from: one Helvetica text line per page."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        content_ref = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {content_ref} 0 R /Resources << /Font << /F1 3 0 R >> >> >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+
+def completed(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class ChunkerTests(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(pdf_utils, "get_encoder", return_value=whitespace_encoder())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def chunks(self, pages, chunk_tokens=10, overlap=4):
+        return list(pdf_utils.iter_chunks(pages, chunk_tokens=chunk_tokens, overlap=overlap))
+
+    def test_offsets_and_pages_point_back_into_the_extracted_text(self):
+        pages = [
+            (1, "The first sentence is here. Another one follows it!\n\nA new paragraph starts. It has words."),
+            (2, "Second page text. More text here. And the final sentence."),
+        ]
+        joined = "\n".join(text for _, text in pages)
+
+        chunks = self.chunks(pages)
+
+        for chunk in chunks:
+            self.assertEqual(chunk.text, joined[chunk.char_start:chunk.char_end])
+            self.assertLessEqual(chunk.token_count, 10)
+        self.assertEqual((1, 1), (chunks[0].page_start, chunks[0].page_end))
+        self.assertEqual(2, chunks[-1].page_end)
+        self.assertTrue(any(c.page_start == 1 and c.page_end == 2 for c in chunks))
+
+    def test_chunks_end_on_sentences_and_overlap_whole_sentences(self):
+        text = "One two three. Four five six. Seven eight nine. Ten eleven twelve."
+
+        chunks = self.chunks([(None, text)], chunk_tokens=7, overlap=3)
+
+        self.assertEqual([
+            "One two three. Four five six.",
+            "Four five six. Seven eight nine.",
+            "Seven eight nine. Ten eleven twelve.",
+        ], [chunk.text for chunk in chunks])
+        self.assertIsNone(chunks[0].page_start)
+
+    def test_paragraph_end_is_preferred_once_half_the_budget_is_used(self):
+        text = "Alpha beta gamma delta. Epsilon zeta.\n\nEta theta. Iota kappa lambda."
+
+        chunks = self.chunks([(None, text)], chunk_tokens=10, overlap=0)
+
+        self.assertEqual("Alpha beta gamma delta. Epsilon zeta.", chunks[0].text)
+        self.assertEqual("Eta theta. Iota kappa lambda.", chunks[1].text)
+
+    def test_sentence_longer_than_a_chunk_is_cut_between_words(self):
+        text = " ".join(f"w{i}" for i in range(25))
+
+        chunks = self.chunks([(None, text)], chunk_tokens=10, overlap=0)
+
+        self.assertEqual([10, 10, 5], [chunk.token_count for chunk in chunks])
+        self.assertEqual(text, " ".join(chunk.text for chunk in chunks))
+
+    def test_token_count_matches_encoding_the_stored_chunk_text(self):
+        # One token per character, so whitespace trimmed off a chunk would show in its count
+        encoder = Mock()
+        encoder.encode.side_effect = list
+        pages = [(1, "  Alpha beta gamma.\n\nDelta epsilon zeta.  \n"), (2, "Eta theta iota.   ")]
+
+        with patch.object(pdf_utils, "get_encoder", return_value=encoder):
+            chunks = list(pdf_utils.iter_chunks(pages, chunk_tokens=30, overlap=0))
+
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual([len(chunk.text) for chunk in chunks], [chunk.token_count for chunk in chunks])
+
+    def test_chunking_in_parts_keeps_offsets_into_the_whole_text(self):
+        pages = [(1, "First page text here."), (2, "Second page text here."), (3, "Third page text here.")]
+        joined = "\n".join(text for _, text in pages)
+
+        head = self.chunks(pages[:2], chunk_tokens=50)
+        offset = pdf_utils.pages_end_offset(pages[:2])
+        tail = list(pdf_utils.iter_chunks(pages[2:], chunk_tokens=50, char_offset=offset))
+
+        self.assertEqual(len(joined[:offset]), offset)
+        for chunk in head + tail:
+            self.assertEqual(chunk.text, joined[chunk.char_start:chunk.char_end])
+        self.assertEqual(3, tail[0].page_start)
+
+    def test_chunks_are_yielded_before_later_pages_are_read(self):
+        read = []
+
+        def pages():
+            for number in range(1, 4):
+                read.append(number)
+                yield number, "Some words on this page. And a few more here."
+
+        stream = pdf_utils.iter_chunks(pages(), chunk_tokens=10, overlap=0)
+        first = next(stream)
+
+        self.assertEqual(1, first.page_start)
+        self.assertLess(len(read), 3)
+
+
+class ExtractionTests(unittest.TestCase):
+    def test_pdf_pages_are_extracted_from_memory_in_order(self):
+        content = make_pdf(["First page.", "Second page.", "Third page."])
+
+        with patch.object(pdf_utils, "get_extraction_pool") as get_pool:
+            pages = list(pdf_utils.iter_document_pages(content, "paper.pdf"))
+
+        self.assertEqual([(1, "First page."), (2, "Second page."), (3, "Third page.")], pages)
+        get_pool.assert_not_called()
+
+    def test_long_pdfs_are_extracted_on_the_pool_in_page_order(self):
+        content = make_pdf([f"Page {i}." for i in range(1, 10)])
+
+        with ThreadPoolExecutor(max_workers=3) as pool, \
+                patch.object(pdf_utils, "_extraction_workers", return_value=2), \
+                patch.object(pdf_utils, "get_extraction_pool", return_value=pool):
+            pages = list(pdf_utils.iter_document_pages(content, "paper.pdf"))
+
+        self.assertEqual([(i, f"Page {i}.") for i in range(1, 10)], pages)
+
+    def test_spooled_files_are_opened_by_path_in_pool_workers(self):
+        content = make_pdf([f"Page {i}." for i in range(1, 10)])
+
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as spooled, \
+                ThreadPoolExecutor(max_workers=2) as executor, \
+                patch.object(pdf_utils, "_extraction_workers", return_value=2), \
+                patch.object(pdf_utils, "get_extraction_pool", return_value=Mock(wraps=executor)) as get_pool:
+            spooled.write(content)
+            spooled.flush()
+            spooled.seek(0)
+            pages = list(pdf_utils.iter_document_pages(spooled, "paper.pdf"))
+
+        self.assertEqual([(i, f"Page {i}.") for i in range(1, 10)], pages)
+        sources = {call.args[1] for call in get_pool.return_value.submit.call_args_list}
+        self.assertEqual({spooled.name}, sources)
+
+    def test_in_memory_pdfs_reach_pool_workers_as_one_temporary_file(self):
+        content = make_pdf([f"Page {i}." for i in range(1, 10)])
+
+        with ThreadPoolExecutor(max_workers=2) as executor, \
+                patch.object(pdf_utils, "_extraction_workers", return_value=2), \
+                patch.object(pdf_utils, "get_extraction_pool", return_value=Mock(wraps=executor)) as get_pool:
+            pages = list(pdf_utils.iter_document_pages(content, "paper.pdf"))
+
+        self.assertEqual([(i, f"Page {i}.") for i in range(1, 10)], pages)
+        sources = {call.args[1] for call in get_pool.return_value.submit.call_args_list}
+        self.assertEqual(1, len(sources))
+        path = sources.pop()
+        self.assertIsInstance(path, str)
+        self.assertFalse(os.path.exists(path))
+
+    def test_pool_keeps_a_bounded_number_of_ranges_in_flight(self):
+        content = make_pdf([f"Page {i}." for i in range(1, 41)])
+        pool = Mock()
+        pool.submit.side_effect = lambda fn, *args: completed(fn(*args))
+
+        with patch.object(pdf_utils, "_extraction_workers", return_value=2), \
+                patch.object(pdf_utils, "get_extraction_pool", return_value=pool):
+            pages = pdf_utils.iter_document_pages(content, "book.pdf", max_pages=100)
+            first = next(pages)
+            submitted = pool.submit.call_count
+            rest = list(pages)
+
+        self.assertEqual((1, "Page 1."), first)
+        # Two ranges per worker, topped up by one as the first range is handed over
+        self.assertEqual(5, submitted)
+        self.assertEqual([(i, f"Page {i}.") for i in range(2, 41)], rest)
+
+    def test_extraction_can_resume_from_a_page(self):
+        content = make_pdf([f"Page {i}." for i in range(1, 6)])
+
+        pages = list(pdf_utils.iter_document_pages(content, "paper.pdf", start_page=3))
+
+        self.assertEqual([(4, "Page 4."), (5, "Page 5.")], pages)
+
+    def test_extraction_can_stop_before_a_page(self):
+        content = make_pdf([f"Page {i}." for i in range(1, 6)])
+
+        pages = list(pdf_utils.iter_document_pages(content, "paper.pdf", start_page=1, stop_page=3))
+
+        self.assertEqual([(2, "Page 2."), (3, "Page 3.")], pages)
+
+    def test_broken_pool_falls_back_to_in_process_extraction(self):
+        content = make_pdf([f"Page {i}." for i in range(1, 10)])
+        pool = Mock()
+        submitted = []
+
+        def submit(fn, *args):
+            submitted.append(args)
+            if len(submitted) == 1:
+                return completed(fn(*args))
+            future = Future()
+            future.set_exception(BrokenProcessPool("worker died"))
+            return future
+
+        pool.submit.side_effect = submit
+
+        with patch.object(pdf_utils, "_extraction_workers", return_value=2), \
+                patch.object(pdf_utils, "get_extraction_pool", return_value=pool), \
+                patch.object(pdf_utils, "shutdown_extraction_pool"):
+            pages = list(pdf_utils.iter_document_pages(content, "paper.pdf"))
+
+        self.assertEqual([(i, f"Page {i}.") for i in range(1, 10)], pages)
+
+    def test_text_uploads_are_decoded_like_text_mode_files(self):
+        pages = list(pdf_utils.iter_document_pages(b"line one\r\nline\x00 two\xff", "notes.txt"))
+
+        self.assertEqual([(None, "line one\nline two")], pages)
+
+    def test_unsupported_extension_is_rejected(self):
+        with self.assertRaises(ValueError):
+            list(pdf_utils.iter_document_pages(b"data", "slides.pptx"))
+
+
+if __name__ == "__main__":
+    unittest.main()
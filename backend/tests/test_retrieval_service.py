@@ -0,0 +1,214 @@
+import asyncio
+import os
+import sys
+import threading
+import types
+import unittest
+from importlib import import_module, reload
+from unittest.mock import Mock, patch
+
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("DATABASE_URL", "sqlite:///test.db")
+os.environ.setdefault("FRONTEND_URL", "http://localhost:3000")
+os.environ.setdefault("BACKEND_URL", "http://localhost:8000")
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test-client-id")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test-client-secret")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("OPENROUTER_API_KEY", "test-openrouter-key")
+
+from services.answer_cache import AnswerCache, MemoryAnswerBackend, SemanticAnswerCache
+
+
+class RetrievalServiceTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        fake_db_utils = types.ModuleType("db_utils")
+        fake_db_utils.get_db_session = Mock()
+        fake_db_utils.engine = Mock()
+        fake_db_utils.Document = Mock()
+        fake_db_utils.Spaces = Mock()
+        fake_db_utils.verify_space_access = Mock(return_value=True)
+        fake_db_utils.new_content_version = Mock(return_value="version-2")
+        fake_db_utils.get_space_content_version = Mock(return_value="version-1")
+        sys.modules["db_utils"] = fake_db_utils
+        reload(import_module("vector_store"))
+        cls.module = reload(import_module("services.better_retrieval_service"))
+
+    def test_searches_run_as_one_batch_off_the_event_loop(self):
+        loop_thread = threading.get_ident()
+        worker_threads = []
+
+        def batch_search(queries, top_k, space_id, user_id):
+            worker_threads.append(threading.get_ident())
+            return {query: [{"doc_id": query}] for query in queries}
+
+        service = self.module.RetrievalService(max_workers=2)
+        try:
+            with patch.object(
+                self.module, "query_documents_hybrid_batch", side_effect=batch_search
+            ) as batch:
+                results = asyncio.run(
+                    service.execute_searches_parallel(["a", "b", "c"], "space", "user", top_k=5)
+                )
+        finally:
+            service.shutdown()
+
+        self.assertEqual(results["c"], [{"doc_id": "c"}])
+        batch.assert_called_once_with(queries=["a", "b", "c"], top_k=5, space_id="space", user_id="user")
+        self.assertNotIn(loop_thread, worker_threads)
+
+    def test_stream_query_sends_sources_before_tokens(self):
+        pipeline = self.module.RAGPipeline.__new__(self.module.RAGPipeline)
+        pipeline.strategy_service = self.module.StrategyService()
+        pipeline.answer_cache = None
+        pipeline.semantic_cache = None
+        search_results = {"q": [{"doc_id": "d1", "text": "t", "filename": "f.pdf", "distance": 0.2}]}
+        pipeline.retrieval_service = Mock()
+        pipeline.retrieval_service.execute_searches_parallel.side_effect = (
+            lambda **kwargs: asyncio.sleep(0, result=search_results)
+        )
+        pipeline.synthesis_service = Mock()
+        pipeline.synthesis_service.build_prompt.return_value = {
+            "prompt": "p",
+            "sources": [{"doc_id": "d1"}],
+            "debug": {"context_tokens": 1, "chunks_used": 1, "chunks_available": 1},
+        }
+
+        async def stream_answer(prepared, provider=None, model=None):
+            for text in ["Hel", "lo"]:
+                yield text
+
+        pipeline.synthesis_service.stream_answer.side_effect = stream_answer
+
+        async def collect():
+            return [event async for event in pipeline.stream_query("q", "space", "user")]
+
+        events = asyncio.run(collect())
+
+        self.assertEqual([e["event"] for e in events], ["sources", "token", "token", "done"])
+        self.assertEqual(events[0]["data"]["sources"], [{"doc_id": "d1"}])
+        self.assertEqual("".join(e["data"]["text"] for e in events[1:3]), "Hello")
+
+    def make_cached_pipeline(self):
+        pipeline = self.module.RAGPipeline.__new__(self.module.RAGPipeline)
+        pipeline.strategy_service = self.module.StrategyService()
+        pipeline.answer_cache = AnswerCache(MemoryAnswerBackend(maxsize=8, ttl_seconds=60))
+        pipeline.semantic_cache = None
+        pipeline.retrieval_service = Mock()
+        pipeline.retrieval_service.execute_searches_parallel.side_effect = (
+            lambda **kwargs: asyncio.sleep(0, result={"q": []})
+        )
+        pipeline.synthesis_service = Mock()
+        pipeline.synthesis_service.ai_service.resolve_model.side_effect = (
+            lambda provider, model: (provider or "openrouter", model or "default-model")
+        )
+        pipeline.synthesis_service.synthesize_answer.side_effect = lambda **kwargs: asyncio.sleep(0, result={
+            "answer": "answer",
+            "sources": [{"doc_id": "d1"}],
+            "debug": {"context_tokens": 1, "chunks_used": 1, "chunks_available": 1},
+        })
+        return pipeline
+
+    def test_repeated_question_is_answered_from_cache(self):
+        pipeline = self.make_cached_pipeline()
+
+        with patch.object(self.module, "get_space_content_version", return_value="version-1"):
+            first = asyncio.run(pipeline.process_query("What is RAG?", "space", "user"))
+            second = asyncio.run(pipeline.process_query("  what is rag ", "space", "user"))
+            other_model = asyncio.run(pipeline.process_query("What is RAG?", "space", "user", model="other"))
+
+        self.assertFalse(first["debug"]["cache_hit"])
+        self.assertTrue(second["debug"]["cache_hit"])
+        self.assertEqual(second["answer"], "answer")
+        self.assertEqual(second["sources"], [{"doc_id": "d1"}])
+        self.assertFalse(other_model["debug"]["cache_hit"])
+        self.assertEqual(pipeline.synthesis_service.synthesize_answer.call_count, 2)
+
+    def test_new_content_version_misses_cache(self):
+        pipeline = self.make_cached_pipeline()
+
+        with patch.object(self.module, "get_space_content_version", side_effect=["version-1", "version-2"]):
+            asyncio.run(pipeline.process_query("q", "space", "user"))
+            result = asyncio.run(pipeline.process_query("q", "space", "user"))
+
+        self.assertFalse(result["debug"]["cache_hit"])
+        self.assertEqual(pipeline.retrieval_service.execute_searches_parallel.call_count, 2)
+
+    def test_inaccessible_space_bypasses_cache(self):
+        pipeline = self.make_cached_pipeline()
+        pipeline.retrieval_service.execute_searches_parallel.side_effect = ValueError("Unauthorized")
+
+        with patch.object(self.module, "get_space_content_version", return_value=None):
+            with self.assertRaises(ValueError):
+                asyncio.run(pipeline.process_query("q", "space", "intruder"))
+
+        pipeline.synthesis_service.ai_service.resolve_model.assert_not_called()
+
+    def test_streamed_answer_is_cached_and_replayed(self):
+        pipeline = self.make_cached_pipeline()
+        pipeline.synthesis_service.build_prompt.side_effect = lambda *args: {
+            "prompt": "p",
+            "sources": [{"doc_id": "d1"}],
+            "debug": {"context_tokens": 1, "chunks_used": 1, "chunks_available": 1},
+        }
+
+        async def stream_answer(prepared, provider=None, model=None):
+            for text in ["Hel", "lo"]:
+                yield text
+
+        pipeline.synthesis_service.stream_answer.side_effect = stream_answer
+
+        async def collect():
+            return [event async for event in pipeline.stream_query("q", "space", "user")]
+
+        with patch.object(self.module, "get_space_content_version", return_value="version-1"):
+            asyncio.run(collect())
+            events = asyncio.run(collect())
+
+        self.assertEqual([e["event"] for e in events], ["sources", "token", "done"])
+        self.assertTrue(events[0]["data"]["debug"]["cache_hit"])
+        self.assertEqual(events[1]["data"]["text"], "Hello")
+        self.assertEqual(pipeline.synthesis_service.stream_answer.call_count, 1)
+
+    def test_paraphrase_is_answered_from_semantic_cache(self):
+        pipeline = self.make_cached_pipeline()
+        pipeline.semantic_cache = SemanticAnswerCache(threshold=0.9, max_per_scope=8, max_scopes=8, ttl_seconds=60)
+        vectors = {"summarize this": [1.0, 0.0], "give me a summary": [0.98, 0.2], "list the authors": [0.0, 1.0]}
+        embedding_service = Mock()
+        embedding_service.embed_query.side_effect = lambda text: vectors[text]
+
+        with patch.object(self.module, "get_space_content_version", return_value="version-1"), \
+                patch.object(self.module, "get_embedding_service", return_value=embedding_service):
+            asyncio.run(pipeline.process_query("summarize this", "space", "user"))
+            paraphrase = asyncio.run(pipeline.process_query("give me a summary", "space", "user"))
+            unrelated = asyncio.run(pipeline.process_query("list the authors", "space", "user"))
+
+        self.assertTrue(paraphrase["debug"]["cache_hit"])
+        self.assertGreater(paraphrase["debug"]["cache_similarity"], 0.9)
+        self.assertEqual(paraphrase["sources"], [{"doc_id": "d1"}])
+        self.assertFalse(unrelated["debug"]["cache_hit"])
+        self.assertEqual(pipeline.retrieval_service.execute_searches_parallel.call_count, 2)
+
+    def test_semantic_cache_opt_out_still_uses_exact_cache(self):
+        pipeline = self.make_cached_pipeline()
+        pipeline.semantic_cache = SemanticAnswerCache(threshold=0.9, max_per_scope=8, max_scopes=8, ttl_seconds=60)
+        embedding_service = Mock()
+        embedding_service.embed_query.return_value = [1.0, 0.0]
+
+        with patch.object(self.module, "get_space_content_version", return_value="version-1"), \
+                patch.object(self.module, "get_embedding_service", return_value=embedding_service):
+            asyncio.run(pipeline.process_query("summarize this", "space", "user"))
+            paraphrase = asyncio.run(
+                pipeline.process_query("give me a summary", "space", "user", use_semantic_cache=False)
+            )
+            repeat = asyncio.run(pipeline.process_query("summarize this", "space", "user", use_semantic_cache=False))
+
+        self.assertFalse(paraphrase["debug"]["cache_hit"])
+        self.assertTrue(repeat["debug"]["cache_hit"])
+        embedding_service.embed_query.assert_called_once_with("summarize this")
+
+
+if __name__ == "__main__":
+    unittest.main()
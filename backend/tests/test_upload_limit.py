@@ -0,0 +1,58 @@
+import os
+import sys
+import unittest
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from upload_limit import RequestBodyLimitMiddleware
+
+
+async def echo_length(request: Request) -> JSONResponse:
+    return JSONResponse({"length": len(await request.body())})
+
+
+def make_client(max_bytes: int) -> TestClient:
+    app = Starlette(routes=[
+        Route("/documents/upload", echo_length, methods=["POST"]),
+        Route("/other", echo_length, methods=["POST"]),
+    ])
+    app.add_middleware(RequestBodyLimitMiddleware, max_bytes=max_bytes, paths=["/documents/upload"])
+    return TestClient(app)
+
+
+class RequestBodyLimitTests(unittest.TestCase):
+    def test_body_within_the_limit_reaches_the_route(self):
+        response = make_client(100).post("/documents/upload", content=b"x" * 100)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"length": 100}, response.json())
+
+    def test_declared_content_length_over_the_limit_is_rejected(self):
+        response = make_client(100).post("/documents/upload", content=b"x" * 101)
+
+        self.assertEqual(413, response.status_code)
+
+    def test_body_without_content_length_is_cut_off_at_the_limit(self):
+        def body():
+            for _ in range(5):
+                yield b"x" * 50
+
+        response = make_client(100).post("/documents/upload", content=body())
+
+        self.assertEqual(413, response.status_code)
+
+    def test_other_paths_are_not_limited(self):
+        response = make_client(100).post("/other", content=b"x" * 500)
+
+        self.assertEqual(200, response.status_code)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import sys
+import types
+import unittest
+from importlib import import_module, reload
+from unittest.mock import Mock
+
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("DATABASE_URL", "sqlite:///test.db")
+os.environ.setdefault("FRONTEND_URL", "http://localhost:3000")
+os.environ.setdefault("BACKEND_URL", "http://localhost:8000")
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test-client-id")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test-client-secret")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("OPENROUTER_API_KEY", "test-openrouter-key")
+
+
+class VectorIndexManagerTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        fake_db_utils = types.ModuleType("db_utils")
+        fake_db_utils.engine = Mock()
+        fake_db_utils.Document = types.SimpleNamespace(__tablename__="documents")
+        sys.modules["db_utils"] = fake_db_utils
+        cls.module = reload(import_module("vector_index"))
+
+    def test_small_spaces_are_searched_exactly(self):
+        manager = self.module.VectorIndexManager("ivfflat")
+
+        self.assertEqual(manager.choose_plan(400, False, "0.8.0"), "exact")
+        self.assertEqual(manager.choose_plan(50_000, True, "0.7.4"), "space_index")
+        self.assertEqual(manager.choose_plan(50_000, False, "0.8.0"), "iterative_index")
+        self.assertEqual(manager.choose_plan(50_000, False, "0.7.4"), "global_index")
+
+    def test_exact_plan_sets_no_index_settings(self):
+        manager = self.module.VectorIndexManager("hnsw")
+        session = Mock()
+
+        manager.apply_search_settings(session, 20, "exact")
+
+        session.execute.assert_not_called()
+
+    def test_iterative_plan_enables_iterative_scan(self):
+        manager = self.module.VectorIndexManager("hnsw")
+        session = Mock()
+
+        manager.apply_search_settings(session, 20, "iterative_index")
+
+        statements = [str(call.args[0]) for call in session.execute.call_args_list]
+        self.assertEqual(statements, [
+            "SET LOCAL hnsw.ef_search = 40",
+            "SET LOCAL hnsw.iterative_scan = strict_order",
+        ])
+
+    def test_ivfflat_probes_grow_with_candidates(self):
+        manager = self.module.VectorIndexManager("ivfflat")
+
+        self.assertEqual(manager.search_settings(20, lists=100), {"ivfflat.probes": 10})
+        self.assertEqual(manager.search_settings(60, lists=100), {"ivfflat.probes": 30})
+        self.assertEqual(manager.search_settings(1000, lists=100), {"ivfflat.probes": 100})
+
+    def test_space_index_probes_use_its_own_list_count(self):
+        manager = self.module.VectorIndexManager("ivfflat")
+        session = Mock()
+        session.execute.return_value.one.return_value = Mock(
+            chunk_count=50_000,
+            has_space_index=True,
+            space_options=["lists=4"],
+            global_options=["lists=1000"],
+            version="0.8.0",
+        )
+
+        plan, lists = manager.plan_search(session, "space")
+        self.assertEqual(("space_index", 4), (plan, lists))
+
+        session.reset_mock()
+        manager.apply_search_settings(session, 20, plan, lists=lists)
+        statements = [str(call.args[0]) for call in session.execute.call_args_list]
+        self.assertEqual(statements, ["SET LOCAL ivfflat.probes = 2"])
+
+    def test_rebuild_only_when_lists_are_far_from_target(self):
+        manager = self.module.VectorIndexManager("ivfflat")
+
+        self.assertFalse(manager.needs_rebuild(5_000, None))
+        self.assertTrue(manager.needs_rebuild(200_000, None))
+        self.assertFalse(manager.needs_rebuild(200_000, 150))
+        self.assertTrue(manager.needs_rebuild(200_000, 100))
+
+    def test_halfvec_storage_over_fetches_and_builds_expression_index(self):
+        manager = self.module.VectorIndexManager("hnsw", metric="cosine", storage="halfvec", dimension=768)
+
+        self.assertEqual(manager.candidate_count(20), 20 * self.module.RESCORE_CANDIDATE_MULTIPLIER)
+        self.assertEqual(
+            manager.search_distance("embedding", "q.embedding", "global_index"),
+            "(embedding::halfvec(768)) <=> (q.embedding::halfvec(768))",
+        )
+        # Small spaces are scanned exactly at full precision
+        self.assertEqual(manager.search_distance("embedding", "q.embedding", "exact"), "embedding <=> q.embedding")
+        self.assertIn(
+            "USING hnsw ((embedding::halfvec(768)) halfvec_cosine_ops)",
+            manager.index_ddl("ix", manager.index_options(None)),
+        )
+
+    def test_binary_storage_uses_hamming_distance(self):
+        manager = self.module.VectorIndexManager("hnsw", metric="l2", storage="binary", dimension=768)
+
+        self.assertEqual(
+            manager.search_distance("embedding", "q.embedding", "global_index"),
+            "(binary_quantize(embedding)::bit(768)) <~> (binary_quantize(q.embedding)::bit(768))",
+        )
+        self.assertEqual(manager.opclass, "bit_hamming_ops")
+
+    def test_prefix_search_takes_configured_candidates_from_leading_dimensions(self):
+        manager = self.module.VectorIndexManager(
+            "hnsw", metric="l2", storage="halfvec", dimension=768, prefix_dimension=128, prefix_candidates=100
+        )
+
+        self.assertEqual(manager.candidate_count(20), 100)
+        self.assertEqual(manager.candidate_count(40), 40 * self.module.RESCORE_CANDIDATE_MULTIPLIER)
+        self.assertEqual(manager.first_pass_label, "prefix128_halfvec")
+        self.assertEqual(
+            manager.search_distance("embedding", "q.embedding", "global_index"),
+            "((subvector(embedding, 1, 128)::vector(128))::halfvec(128)) <-> "
+            "((subvector(q.embedding, 1, 128)::vector(128))::halfvec(128))",
+        )
+
+    def test_prefix_as_long_as_the_vector_is_ignored(self):
+        manager = self.module.VectorIndexManager("hnsw", storage="full", dimension=768, prefix_dimension=768)
+
+        self.assertFalse(manager.rescores)
+        self.assertEqual(manager.candidate_count(20), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,7 +3,7 @@ import sys
 import types
 import unittest
 from importlib import import_module, reload
-from unittest.mock import Mock, patch
+from unittest.mock import MagicMock, Mock, patch
 
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -22,9 +22,11 @@ class VectorStoreEmbeddingTests(unittest.TestCase):
     def setUpClass(cls):
         fake_db_utils = types.ModuleType("db_utils")
         fake_db_utils.get_db_session = Mock()
+        fake_db_utils.engine = Mock()
         fake_db_utils.Document = Mock()
         fake_db_utils.Spaces = Mock()
         fake_db_utils.verify_space_access = Mock(return_value=True)
+        fake_db_utils.new_content_version = Mock(return_value="version-2")
         sys.modules["db_utils"] = fake_db_utils
         cls.vector_store = reload(import_module("vector_store"))
 
@@ -36,6 +38,10 @@ class VectorStoreEmbeddingTests(unittest.TestCase):
             GEMINI_API_KEY="test-key",
             EMBEDDING_MODEL="gemini-embedding-001",
             EMBEDDING_DIMENSION=768,
+            EMBEDDING_CACHE_SIZE=16,
+            EMBEDDING_CACHE_TTL_SECONDS=60,
+            EMBEDDING_CACHE_PATH="",
+            DISTANCE_METRIC="inner_product",
         )
 
         with patch.object(self.vector_store, "settings", fake_settings), patch.object(
@@ -45,12 +51,133 @@ class VectorStoreEmbeddingTests(unittest.TestCase):
             second = self.vector_store.get_embedding_service()
 
         self.assertIs(first, second)
+        self.assertIs(first.service, service_cls.return_value)
         service_cls.assert_called_once_with(
             api_key="test-key",
             model_name="gemini-embedding-001",
             output_dimensionality=768,
+            normalize=True,
         )
 
+    def test_hybrid_batch_embeds_once_and_groups_rows_per_query(self):
+        embedding_service = Mock()
+        embedding_service.embed_queries.return_value = [[0.1], [0.2]]
+        rows = [
+            types.SimpleNamespace(idx=0, doc_id="a", text="alpha", chunk_index=0, filename="f.pdf", token_count=120, distance=0.5, score=0.03, lexical=True),
+            types.SimpleNamespace(idx=0, doc_id="c", text="gamma", chunk_index=2, filename="f.pdf", token_count=80, distance=0.3, score=0.01, lexical=False),
+            types.SimpleNamespace(idx=1, doc_id="b", text="beta", chunk_index=1, filename="f.pdf", token_count=95, distance=0.4, score=0.02, lexical=False),
+        ]
+        session = Mock()
+        session.execute.return_value.all.return_value = rows
+        db_session = Mock()
+        db_session.return_value.__enter__ = Mock(return_value=session)
+        db_session.return_value.__exit__ = Mock(return_value=False)
+
+        with patch.object(self.vector_store, "get_embedding_service", return_value=embedding_service), \
+                patch.object(self.vector_store, "get_db_session", db_session), \
+                patch.object(self.vector_store, "verify_space_access", return_value=True), \
+                patch.object(self.vector_store, "Document", types.SimpleNamespace(__tablename__="documents")), \
+                patch.object(self.vector_store, "get_index_manager") as index_manager:
+            index_manager.return_value.plan_search.return_value = ("exact", None)
+            index_manager.return_value.search_distance.return_value = "embedding <-> q.embedding"
+            results = self.vector_store.query_documents_hybrid_batch(
+                ["alpha", "gamma", "alpha"], top_k=1, space_id="space", user_id="user"
+            )
+
+        embedding_service.embed_queries.assert_called_once_with(["alpha", "gamma"])
+        index_manager.return_value.apply_search_settings.assert_called_once_with(session, 2, "exact", lists=None)
+        self.assertEqual(results.plan, "exact")
+        statement, params = session.execute.call_args.args
+        self.assertIn("(embedding <-> q.embedding) + 0", str(statement))
+        self.assertIn("ts_rank_cd(text_search, q.terms)", str(statement))
+        self.assertEqual(params["text_0"], "alpha")
+        self.assertEqual(params["text_1"], "gamma")
+        session.execute.assert_called_once()
+        # Rows arrive in fused order; each query keeps its top_k
+        self.assertEqual(["a"], [r["doc_id"] for r in results["alpha"]])
+        self.assertEqual(["b"], [r["doc_id"] for r in results["gamma"]])
+        self.assertAlmostEqual(0.5, results["alpha"][0]["distance"])
+        self.assertAlmostEqual(0.03, results["alpha"][0]["score"])
+        self.assertTrue(results["alpha"][0]["lexical"])
+        self.assertEqual(120, results["alpha"][0]["token_count"])
+
+    def test_upload_embeds_only_chunks_without_stored_vectors(self):
+        known_hash = self.vector_store.chunk_content_hash("boilerplate", "paper.pdf")
+        session = Mock()
+        session.query.return_value.filter.return_value.distinct.return_value.all.return_value = [
+            (known_hash, [0.9, 0.9]),
+        ]
+        embedding_service = Mock()
+        embedding_service.embed_documents.return_value = [[0.1, 0.2]]
+
+        with patch.object(self.vector_store, "get_embedding_service", return_value=embedding_service):
+            embeddings, hashes, reused = self.vector_store._embed_chunks_with_reuse(
+                session, ["boilerplate", "new text", "new text"], "paper.pdf"
+            )
+
+        embedding_service.embed_documents.assert_called_once_with(["new text"], title="paper.pdf", progress=None)
+        self.assertEqual(embeddings, [[0.9, 0.9], [0.1, 0.2], [0.1, 0.2]])
+        self.assertEqual(hashes[0], known_hash)
+        self.assertEqual(reused, 2)
+
+    def test_content_hash_depends_on_title(self):
+        self.assertNotEqual(
+            self.vector_store.chunk_content_hash("same text", "a.pdf"),
+            self.vector_store.chunk_content_hash("same text", "b.pdf"),
+        )
+
+    def test_bulk_insert_streams_rows_in_fixed_size_batches(self):
+        session = Mock()
+        rows = ({"chunk_index": i} for i in range(1201))
+
+        with patch.object(self.vector_store, "insert") as insert:
+            inserted = self.vector_store._bulk_insert_chunks(session, rows, batch_size=500)
+
+        self.assertEqual(inserted, 1201)
+        self.assertEqual(
+            [len(call.args[1]) for call in session.execute.call_args_list],
+            [500, 500, 201],
+        )
+        session.execute.assert_called_with(insert.return_value, [{"chunk_index": i} for i in range(1000, 1201)])
+        session.commit.assert_not_called()
+
+    def test_upload_chunks_embeds_and_inserts_batch_by_batch(self):
+        session = Mock()
+        session.query.return_value.filter_by.return_value.first.return_value = Mock(user_id="user")
+        db_session = MagicMock()
+        db_session.return_value.__enter__.return_value = session
+        pulled = []
+
+        def chunks():
+            for i in range(5):
+                pulled.append(i)
+                yield self.vector_store.TextChunk(f"chunk {i}", 2, i * 10, i * 10 + 7, page_start=i + 1, page_end=i + 1)
+
+        def embed(session, texts, title, progress):
+            # The chunker has only been drained as far as the current batch
+            self.assertEqual(len(pulled), min(5, embed.calls * 2 + len(texts)))
+            embed.calls += 1
+            progress("embedding", chunks_total=len(texts), chunks_embedded=len(texts), reused_chunks=1)
+            return [[0.1]] * len(texts), ["h"] * len(texts), 1
+        embed.calls = 0
+
+        inserted = []
+        progress = Mock()
+        with patch.object(self.vector_store, "get_db_session", db_session), \
+                patch.object(self.vector_store, "INGEST_STREAM_BATCH_SIZE", 2), \
+                patch.object(self.vector_store, "_embed_chunks_with_reuse", side_effect=embed), \
+                patch.object(self.vector_store, "_bulk_insert_chunks", side_effect=lambda s, rows: inserted.extend(rows)):
+            file_id, count, reused = self.vector_store.upload_chunks(
+                chunks(), "space", "user", "paper.pdf", "file-1", progress
+            )
+
+        self.assertEqual(("file-1", 5, 3), (file_id, count, reused))
+        self.assertEqual([f"doc_file-1_{i}" for i in range(5)], [row["doc_id"] for row in inserted])
+        self.assertEqual((40, 47, 5), (inserted[4]["char_start"], inserted[4]["char_end"], inserted[4]["page_start"]))
+        progress.assert_any_call("embedding", chunks_total=4, chunks_embedded=4, reused_chunks=2)
+        progress.assert_any_call("embedding", chunks_total=5, chunks_embedded=5, reused_chunks=3)
+        session.commit.assert_called_once()
+
 
 if __name__ == "__main__":
     unittest.main()
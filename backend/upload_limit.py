@@ -0,0 +1,69 @@
+import logging
+from typing import Iterable
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+logger = logging.getLogger(__name__)
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class RequestBodyLimitMiddleware:
+    """
+    Reject request bodies over `max_bytes` on `paths` with 413 before the
+    multipart parser spools them. Content-Length is checked up front; bodies
+    without one are counted as they arrive and cut off at the limit.
+    """
+
+    def __init__(self, app: ASGIApp, max_bytes: int, paths: Iterable[str]) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message: Message) -> None:
+            # Whatever the app makes of the aborted body is replaced by the 413
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded:
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope: Scope, receive: Receive, send: Send) -> None:
+        logger.warning(f"Rejected request body over {self.max_bytes} bytes on {scope['path']}")
+        response = JSONResponse(
+            {"detail": f"Request too large. Maximum size is {self.max_bytes // (1024 * 1024)}MB."},
+            status_code=413
+        )
+        await response(scope, receive, send)
@@ -0,0 +1,446 @@
+"""Vector index management for documents.embedding.
+
+IVFFlat trains its lists on the rows present when the index is built, and
+`create_all` builds it on an empty table, so the index is retrained
+concurrently once the table is large enough. HNSW needs no retraining.
+Per-query `hnsw.ef_search` / `ivfflat.probes` are derived from the number of
+candidates requested.
+
+With a halfvec or binary VECTOR_STORAGE, or a SEARCH_PREFIX_DIMENSION, the
+index is built on a compressed or truncated expression of the embedding;
+searches over-fetch candidates from it and rescore them with the full vector. `python vector_index.py compare` reports recall and latency
+of the configured index against an exact scan.
+
+Searches are planned per space: small spaces are scanned exactly, large
+spaces get their own partial index, and everything else walks the global
+index (with pgvector >= 0.8 iterative scans, so the space filter does not
+starve the result set).
+
+Run `python vector_index.py status|rebuild|compare [space_id]`.
+"""
+import hashlib
+import logging
+import math
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text as sql_text
+
+from config.config import settings
+from constants import (
+    IVFFLAT_REBUILD_MIN_ROWS,
+    IVFFLAT_ROWS_PER_LIST,
+    HNSW_EF_SEARCH_MIN,
+    HNSW_EF_SEARCH_MAX,
+    VECTOR_INDEX_CHECK_INTERVAL_SECONDS,
+    EXACT_SEARCH_MAX_CHUNKS,
+    SPACE_INDEX_MIN_CHUNKS,
+    RESCORE_CANDIDATE_MULTIPLIER,
+)
+from db_utils import engine, Document
+from distance_metrics import FULL, OPERATORS, distance_sql, index_metric, index_opclass, storage_expression
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "ix_documents_embedding"
+# Arbitrary constant so only one process rebuilds at a time
+REBUILD_LOCK_ID = 7_453_011
+
+PLAN_EXACT = "exact"
+PLAN_SPACE_INDEX = "space_index"
+PLAN_ITERATIVE_INDEX = "iterative_index"
+PLAN_GLOBAL_INDEX = "global_index"
+
+
+def lists_option(options: Optional[Sequence[str]]) -> Optional[int]:
+    """The `lists` storage parameter from an index's pg_class.reloptions."""
+    for option in options or []:
+        key, _, value = option.partition("=")
+        if key == "lists":
+            return int(value)
+    return None
+
+
+def supports_iterative_scan(version: Optional[str]) -> bool:
+    """Iterative index scans were added in pgvector 0.8.0."""
+    if not version:
+        return False
+    try:
+        return tuple(int(part) for part in version.split(".")[:2]) >= (0, 8)
+    except ValueError:
+        return False
+
+
+class VectorIndexManager:
+
+    def __init__(
+        self,
+        index_type: str = settings.VECTOR_INDEX_TYPE,
+        metric: str = settings.DISTANCE_METRIC,
+        storage: str = settings.VECTOR_STORAGE,
+        dimension: int = settings.EMBEDDING_DIMENSION,
+        prefix_dimension: int = settings.SEARCH_PREFIX_DIMENSION,
+        prefix_candidates: int = settings.PREFIX_SEARCH_CANDIDATES,
+    ):
+        self.index_type = index_type
+        self.metric = metric
+        self.storage = storage
+        self.dimension = dimension
+        # A "prefix" as long as the vector is just the full vector
+        self.prefix_dimension = prefix_dimension if 0 < prefix_dimension < dimension else 0
+        self.prefix_candidates = prefix_candidates
+        self.opclass = index_opclass(index_metric(metric, self.prefix_dimension), storage)
+        self.table = Document.__tablename__
+        self._last_check = 0.0
+        self._lists = settings.IVFFLAT_LISTS
+
+    def search_settings(self, candidates: int, lists: Optional[int] = None) -> Dict[str, int]:
+        """GUCs to SET LOCAL before an ANN query that needs `candidates` rows.
+
+        `lists` is the list count of the index being searched; per-space partial
+        indexes have far fewer lists than the global one.
+        """
+        if self.index_type == "hnsw":
+            ef_search = min(HNSW_EF_SEARCH_MAX, max(HNSW_EF_SEARCH_MIN, candidates * 2))
+            return {"hnsw.ef_search": ef_search}
+
+        lists = lists or self._lists
+        # sqrt(lists) is pgvector's recommended starting point; widen it for larger result sets
+        probes = math.ceil(math.sqrt(lists) * max(1.0, candidates / 20))
+        return {"ivfflat.probes": min(lists, probes)}
+
+    @property
+    def rescores(self) -> bool:
+        return self.storage != FULL or bool(self.prefix_dimension)
+
+    @property
+    def first_pass_label(self) -> str:
+        parts = [f"prefix{self.prefix_dimension}"] if self.prefix_dimension else []
+        if self.storage != FULL:
+            parts.append(self.storage)
+        return "_".join(parts) or FULL
+
+    def candidate_count(self, limit: int) -> int:
+        """Rows to pull from the index for a query that wants `limit` results."""
+        if self.prefix_dimension:
+            return max(self.prefix_candidates, limit * RESCORE_CANDIDATE_MULTIPLIER)
+        return limit * RESCORE_CANDIDATE_MULTIPLIER if self.rescores else limit
+
+    def index_distance(self, column: str, query: str) -> str:
+        return distance_sql(column, query, self.metric, self.storage, self.dimension, self.prefix_dimension)
+
+    def search_distance(self, column: str, query: str, plan: str) -> str:
+        """Distance expression for the first (index) pass of a search."""
+        if plan == PLAN_EXACT:
+            return distance_sql(column, query, self.metric)
+        return self.index_distance(column, query)
+
+    def index_ddl(self, name: str, options: str, where: Optional[str] = None, concurrently: bool = True) -> str:
+        expression = storage_expression("embedding", self.storage, self.dimension, self.prefix_dimension)
+        return (
+            f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {name} ON {self.table} "
+            f"USING {self.index_type} ({expression} {self.opclass}) WITH ({options})"
+            + (f" WHERE {where}" if where else "")
+        )
+
+    def apply_search_settings(
+        self,
+        session,
+        candidates: int,
+        plan: str = PLAN_GLOBAL_INDEX,
+        lists: Optional[int] = None,
+    ) -> None:
+        if plan == PLAN_EXACT:
+            return
+        for name, value in self.search_settings(candidates, lists).items():
+            session.execute(sql_text(f"SET LOCAL {name} = {int(value)}"))
+        if plan == PLAN_ITERATIVE_INDEX:
+            # IVFFlat only supports relaxed ordering; the caller re-sorts by distance anyway
+            order = "strict_order" if self.index_type == "hnsw" else "relaxed_order"
+            session.execute(sql_text(f"SET LOCAL {self.index_type}.iterative_scan = {order}"))
+
+    def plan_search(self, session, space_id: str) -> Tuple[str, Optional[int]]:
+        """Pick how to search one space, in a single cheap round trip.
+
+        Returns the plan and the IVFFlat list count of the index it walks.
+        """
+        row = session.execute(sql_text(f"""
+            SELECT
+                (SELECT count(*) FROM (
+                    SELECT 1 FROM {self.table} WHERE space_id = :space_id LIMIT :cap
+                ) AS s) AS chunk_count,
+                to_regclass(:index_name) IS NOT NULL AS has_space_index,
+                (SELECT reloptions FROM pg_class WHERE oid = to_regclass(:index_name)) AS space_options,
+                (SELECT reloptions FROM pg_class WHERE oid = to_regclass(:global_name)) AS global_options,
+                (SELECT extversion FROM pg_extension WHERE extname = 'vector') AS version
+        """), {
+            "space_id": space_id,
+            "cap": EXACT_SEARCH_MAX_CHUNKS + 1,
+            "index_name": self.space_index_name(space_id),
+            "global_name": INDEX_NAME,
+        }).one()
+        plan = self.choose_plan(row.chunk_count, row.has_space_index, row.version)
+        options = row.space_options if plan == PLAN_SPACE_INDEX else row.global_options
+        return plan, lists_option(options)
+
+    def choose_plan(self, chunk_count: int, has_space_index: bool, version: Optional[str]) -> str:
+        if chunk_count <= EXACT_SEARCH_MAX_CHUNKS:
+            return PLAN_EXACT
+        if has_space_index:
+            return PLAN_SPACE_INDEX
+        if supports_iterative_scan(version):
+            return PLAN_ITERATIVE_INDEX
+        return PLAN_GLOBAL_INDEX
+
+    def space_index_name(self, space_id: str) -> str:
+        return f"{INDEX_NAME}_space_{hashlib.sha1(space_id.encode('utf-8')).hexdigest()[:16]}"
+
+    def maybe_index_space(self, space_id: str) -> bool:
+        """Give a space its own partial index once it reaches SPACE_INDEX_MIN_CHUNKS."""
+        with engine.connect() as connection:
+            chunk_count = connection.execute(
+                sql_text(f"SELECT count(*) FROM {self.table} WHERE space_id = :space_id"),
+                {"space_id": space_id},
+            ).scalar()
+            exists = connection.execute(
+                sql_text("SELECT to_regclass(:name) IS NOT NULL"),
+                {"name": self.space_index_name(space_id)},
+            ).scalar()
+
+        if exists or chunk_count < SPACE_INDEX_MIN_CHUNKS:
+            return False
+        return self.create_space_index(space_id, chunk_count)
+
+    def create_space_index(self, space_id: str, chunk_count: int) -> bool:
+        name = self.space_index_name(space_id)
+        options = self.index_options(self.target_lists(chunk_count))
+        space_literal = space_id.replace("'", "''")
+
+        with self._build_connection() as connection:
+            if connection is None:
+                return False
+            try:
+                logger.info(f"Building partial {self.index_type} index {name} for space {space_id}")
+                connection.execute(sql_text(
+                    self.index_ddl(name, options, where=f"space_id = '{space_literal}'")
+                ))
+            except Exception:
+                # A failed concurrent build leaves an INVALID index behind
+                connection.execute(sql_text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                raise
+        return True
+
+    def drop_space_index(self, space_id: str) -> None:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(sql_text(f"DROP INDEX CONCURRENTLY IF EXISTS {self.space_index_name(space_id)}"))
+
+    def target_lists(self, row_count: int) -> int:
+        """pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) above that."""
+        if row_count <= 1_000_000:
+            return max(1, row_count // IVFFLAT_ROWS_PER_LIST)
+        return int(math.sqrt(row_count))
+
+    def status(self) -> Dict[str, Any]:
+        with engine.connect() as connection:
+            row_count = self._estimated_rows(connection)
+            current_lists = self._current_lists(connection)
+            progress = connection.execute(sql_text("""
+                SELECT phase, blocks_done, blocks_total, tuples_done, tuples_total
+                FROM pg_stat_progress_create_index
+                WHERE relid = CAST(:table AS regclass)
+            """), {"table": self.table}).mappings().first()
+
+        return {
+            "index_type": self.index_type,
+            "estimated_rows": row_count,
+            "lists": current_lists,
+            "target_lists": self.target_lists(row_count) if self.index_type == "ivfflat" else None,
+            "build_progress": dict(progress) if progress else None,
+        }
+
+    def needs_rebuild(self, row_count: int, current_lists: Optional[int]) -> bool:
+        if self.index_type != "ivfflat" or row_count < IVFFLAT_REBUILD_MIN_ROWS:
+            return False
+        if current_lists is None:
+            return True
+        target = self.target_lists(row_count)
+        # Only retrain when the list count is off by 2x or more
+        return target >= current_lists * 2 or target * 2 <= current_lists
+
+    def maybe_rebuild(self) -> bool:
+        """Rebuild the IVFFlat index if it is due; cheap to call after every ingest."""
+        now = time.monotonic()
+        if now - self._last_check < VECTOR_INDEX_CHECK_INTERVAL_SECONDS:
+            return False
+        self._last_check = now
+
+        with engine.connect() as connection:
+            row_count = self._estimated_rows(connection)
+            current_lists = self._current_lists(connection)
+
+        if not self.needs_rebuild(row_count, current_lists):
+            return False
+
+        self.rebuild(self.target_lists(row_count))
+        return True
+
+    def rebuild(self, lists: Optional[int] = None) -> None:
+        """Build a replacement index CONCURRENTLY, then swap it in.
+
+        Queries keep using the old index until the swap, which only takes a brief lock.
+        """
+        new_name = f"{INDEX_NAME}_new"
+        if self.index_type == "ivfflat" and lists is None:
+            with engine.connect() as connection:
+                lists = self.target_lists(self._estimated_rows(connection))
+        options = self.index_options(lists)
+
+        with self._build_connection() as connection:
+            if connection is None:
+                return
+            logger.info(f"Building {self.index_type} index {new_name} ({options})")
+            connection.execute(sql_text(f"DROP INDEX CONCURRENTLY IF EXISTS {new_name}"))
+            connection.execute(sql_text(self.index_ddl(new_name, options)))
+            with engine.begin() as swap:
+                swap.execute(sql_text(f"DROP INDEX IF EXISTS {INDEX_NAME}"))
+                swap.execute(sql_text(f"ALTER INDEX {new_name} RENAME TO {INDEX_NAME}"))
+            if lists:
+                self._lists = int(lists)
+            logger.info(f"Swapped in rebuilt vector index {INDEX_NAME}")
+
+    def compare(self, space_id: Optional[str] = None, sample: int = 20, top_k: int = 10) -> Dict[str, Any]:
+        """Recall@k and latency of the configured index (with rescoring) against an exact scan.
+
+        Stored embeddings are used as queries, so no embedding API calls are made.
+        """
+        where = "WHERE space_id = :space_id" if space_id else ""
+        exact = distance_sql("embedding", "CAST(:query AS vector)", self.metric)
+        approximate = self.index_distance("embedding", "CAST(:query AS vector)")
+        candidates = self.candidate_count(top_k)
+
+        exact_sql = sql_text(f"""
+            SELECT id FROM {self.table} {where}
+            ORDER BY ({exact}) + 0
+            LIMIT :top_k
+        """)
+        index_sql = sql_text(f"""
+            SELECT id FROM (
+                SELECT id, embedding FROM {self.table} {where}
+                ORDER BY {approximate}
+                LIMIT :candidates
+            ) AS c
+            ORDER BY embedding {OPERATORS[self.metric]} CAST(:query AS vector)
+            LIMIT :top_k
+        """)
+
+        recalls: List[float] = []
+        exact_ms: List[float] = []
+        index_ms: List[float] = []
+        with engine.connect() as connection:
+            with connection.begin():
+                # A space-filtered query can use the space's partial index, which has its own list count
+                lists = self._index_lists(connection, self.space_index_name(space_id)) if space_id else None
+                lists = lists or self._index_lists(connection, INDEX_NAME)
+                queries = connection.execute(
+                    sql_text(f"SELECT embedding::text FROM {self.table} {where} ORDER BY random() LIMIT :sample"),
+                    {"space_id": space_id, "sample": sample},
+                ).scalars().all()
+
+            for query in queries:
+                params = {"query": query, "space_id": space_id, "top_k": top_k, "candidates": candidates}
+                with connection.begin():
+                    started = time.perf_counter()
+                    truth = set(connection.execute(exact_sql, params).scalars())
+                    exact_ms.append((time.perf_counter() - started) * 1000)
+
+                with connection.begin():
+                    for name, value in self.search_settings(candidates, lists).items():
+                        connection.execute(sql_text(f"SET LOCAL {name} = {int(value)}"))
+                    started = time.perf_counter()
+                    found = set(connection.execute(index_sql, params).scalars())
+                    index_ms.append((time.perf_counter() - started) * 1000)
+
+                if truth:
+                    recalls.append(len(truth & found) / len(truth))
+
+        def mean(values: List[float]) -> Optional[float]:
+            return round(sum(values) / len(values), 3) if values else None
+
+        return {
+            "index_type": self.index_type,
+            "storage": self.storage,
+            "prefix_dimension": self.prefix_dimension or None,
+            "metric": self.metric,
+            "queries": len(queries),
+            "top_k": top_k,
+            "candidates": candidates,
+            "recall": mean(recalls),
+            "exact_ms": mean(exact_ms),
+            "index_ms": mean(index_ms),
+        }
+
+    def index_options(self, lists: Optional[int]) -> str:
+        if self.index_type == "hnsw":
+            return f"m = {int(settings.HNSW_M)}, ef_construction = {int(settings.HNSW_EF_CONSTRUCTION)}"
+        return f"lists = {int(lists or self._lists)}"
+
+    @contextmanager
+    def _build_connection(self) -> Iterator[Any]:
+        """AUTOCOMMIT connection holding the build lock, or None if another process holds it."""
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            locked = connection.execute(
+                sql_text("SELECT pg_try_advisory_lock(:id)"), {"id": REBUILD_LOCK_ID}
+            ).scalar()
+            if not locked:
+                logger.info("Vector index build already running in another process")
+                yield None
+                return
+            try:
+                yield connection
+            finally:
+                connection.execute(sql_text("SELECT pg_advisory_unlock(:id)"), {"id": REBUILD_LOCK_ID})
+
+    def _estimated_rows(self, connection) -> int:
+        # reltuples is kept current by autovacuum and avoids a full COUNT(*) on a large table
+        estimate = connection.execute(
+            sql_text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+            {"table": self.table},
+        ).scalar()
+        return max(0, int(estimate or 0))
+
+    def _current_lists(self, connection) -> Optional[int]:
+        lists = self._index_lists(connection, INDEX_NAME)
+        if lists is not None:
+            self._lists = lists
+        return lists
+
+    def _index_lists(self, connection, name: str) -> Optional[int]:
+        options = connection.execute(
+            sql_text("SELECT reloptions FROM pg_class WHERE oid = to_regclass(:name)"),
+            {"name": name},
+        ).scalar()
+        return lists_option(options)
+
+
+_index_manager: Optional[VectorIndexManager] = None
+
+
+def get_index_manager() -> VectorIndexManager:
+    global _index_manager
+    if _index_manager is None:
+        _index_manager = VectorIndexManager()
+    return _index_manager
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    manager = get_index_manager()
+    if command == "rebuild":
+        manager.rebuild()
+    elif command == "compare":
+        print(manager.compare(sys.argv[2] if len(sys.argv) > 2 else None))
+    else:
+        print(manager.status())
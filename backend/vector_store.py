@@ -1,40 +1,152 @@
+import hashlib
 import logging
 import uuid
 from datetime import datetime
-from typing import List, Dict, Any
+from itertools import batched
+from typing import Callable, Iterable, List, Dict, Any, Optional, Tuple
 
-from sqlalchemy import func, cast, text
+from sqlalchemy import bindparam, insert, text
 from pgvector.sqlalchemy import Vector
-from google import genai
 
-from db_utils import get_db_session, Document, Spaces, verify_space_access
-from constants import DEFAULT_SPACE_NAME
+from db_utils import get_db_session, Document, Spaces, new_content_version, verify_space_access
+from pdf_utils import TextChunk
+from constants import (
+    DEFAULT_SPACE_NAME,
+    DOCUMENT_INSERT_BATCH_SIZE,
+    INGEST_STREAM_BATCH_SIZE,
+    FULL_TEXT_CONFIG,
+    RRF_K,
+)
 from config.config import settings
-from prompts import CLASSIFICATION_PROMPT_TEMPLATE
 from services.embedding_service import GeminiEmbeddingService
+from services.embedding_cache import CachedEmbeddingService
+from vector_index import get_index_manager, PLAN_EXACT
+from distance_metrics import OPERATORS, normalize, normalizes
 
 logger = logging.getLogger(__name__)
 
+# Called with a stage name and progress counters, e.g. progress("embedding", chunks_embedded=40)
+ProgressCallback = Callable[..., None]
+
+
+def offset_progress(progress: Optional[ProgressCallback], **offsets: int) -> Optional[ProgressCallback]:
+    """Wrap `progress` so counters reported for one part of an upload count toward the whole."""
+    if progress is None:
+        return None
+    return lambda stage, **counts: progress(
+        stage, **{key: value + offsets.get(key, 0) for key, value in counts.items()}
+    )
+
 # Lazy load embedding service with caching
 _embedding_service = None
 
 
-def get_embedding_service() -> GeminiEmbeddingService:
+def get_embedding_service() -> CachedEmbeddingService:
     global _embedding_service
     if _embedding_service is None:
         logger.info("Initializing Gemini embedding service (first use)...")
-        _embedding_service = GeminiEmbeddingService(
-            api_key=settings.GEMINI_API_KEY,
-            model_name=settings.EMBEDDING_MODEL,
-            output_dimensionality=settings.EMBEDDING_DIMENSION,
+        _embedding_service = CachedEmbeddingService(
+            GeminiEmbeddingService(
+                api_key=settings.GEMINI_API_KEY,
+                model_name=settings.EMBEDDING_MODEL,
+                output_dimensionality=settings.EMBEDDING_DIMENSION,
+                normalize=normalizes(settings.DISTANCE_METRIC),
+            ),
+            maxsize=settings.EMBEDDING_CACHE_SIZE,
+            ttl_seconds=settings.EMBEDDING_CACHE_TTL_SECONDS,
+            disk_path=settings.EMBEDDING_CACHE_PATH or None,
+            disk_maxsize=settings.EMBEDDING_CACHE_DISK_SIZE,
         )
         logger.info("Gemini embedding service initialized")
     return _embedding_service
 
-genai_client = genai.Client(api_key=settings.GEMINI_API_KEY)
-
-def upload_document(chunks: List[str], space_id: str, user_id: str, filename: str = None) -> str:
-    file_id = str(uuid.uuid4())
+def chunk_content_hash(text: str, title: Optional[str] = None) -> str:
+    """Content address for a chunk embedding; the title is part of the Gemini input."""
+    key = "\x1f".join([
+        settings.EMBEDDING_MODEL,
+        str(settings.EMBEDDING_DIMENSION),
+        title or "",
+        text,
+    ])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def _embed_chunks_with_reuse(
+    session,
+    chunks: List[str],
+    title: Optional[str],
+    progress: Optional[ProgressCallback] = None
+) -> Tuple[List[List[float]], List[str], int]:
+    """Embed only chunks whose content hash has no stored vector yet.
+
+    Returns the embeddings in chunk order, their content hashes and how many were reused.
+    """
+    hashes = [chunk_content_hash(chunk, title) for chunk in chunks]
+    unique_hashes = list(dict.fromkeys(hashes))
+
+    existing = (
+        session.query(Document.content_hash, Document.embedding)
+        .filter(Document.content_hash.in_(unique_hashes))
+        .distinct(Document.content_hash)
+        .all()
+    )
+    vectors = {content_hash: list(embedding) for content_hash, embedding in existing}
+    if normalizes(settings.DISTANCE_METRIC):
+        # Rows stored before a switch to cosine/IP may not have been normalized yet
+        vectors = {content_hash: normalize(vector) for content_hash, vector in vectors.items()}
+
+    # Repeated chunks inside one upload are embedded once
+    missing = {}
+    for content_hash, chunk in zip(hashes, chunks):
+        if content_hash not in vectors and content_hash not in missing:
+            missing[content_hash] = chunk
+
+    reused = len(chunks) - len(missing)
+    if progress:
+        progress("embedding", chunks_total=len(chunks), chunks_embedded=reused, reused_chunks=reused)
+
+    if missing:
+        on_batch = None
+        if progress:
+            on_batch = lambda done: progress("embedding", chunks_embedded=reused + done)
+        embeddings = get_embedding_service().embed_documents(
+            list(missing.values()), title=title, progress=on_batch
+        )
+        if len(embeddings) != len(missing):
+            raise ValueError(
+                f"Embedding provider returned {len(embeddings)} vectors for {len(missing)} chunks"
+            )
+        vectors.update(zip(missing.keys(), embeddings))
+
+    return [vectors[content_hash] for content_hash in hashes], hashes, reused
+
+def _bulk_insert_chunks(session, rows: Iterable[Dict[str, Any]], batch_size: int = DOCUMENT_INSERT_BATCH_SIZE) -> int:
+    """Insert chunk rows as multi-row INSERT statements of `batch_size` rows.
+
+    Runs inside the caller's transaction, so a failure in any batch rolls back the whole upload.
+    """
+    inserted = 0
+    for batch in batched(rows, batch_size):
+        session.execute(insert(Document), list(batch))
+        inserted += len(batch)
+    return inserted
+
+def upload_chunks(
+    chunks: Iterable[TextChunk],
+    space_id: str,
+    user_id: str,
+    filename: str = None,
+    file_id: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None,
+    first_index: int = 0
+) -> Tuple[str, int, int]:
+    """Embed and store chunks as the chunker yields them.
+
+    Chunks are taken INGEST_STREAM_BATCH_SIZE at a time, so embedding starts
+    while later pages are still being extracted. Everything is inserted in one
+    transaction; `first_index` numbers the chunks when a document is stored in
+    parts. Returns the file id, the chunk count and how many embeddings were reused.
+    """
+    file_id = file_id or str(uuid.uuid4())
 
     with get_db_session() as session:
         try:
@@ -56,84 +168,230 @@ def upload_document(chunks: List[str], space_id: str, user_id: str, filename: st
                 # Space exists but doesn't belong to this user
                 raise ValueError(f"Unauthorized: Space {space_id} does not belong to user {user_id}")
 
-            embeddings = get_embedding_service().embed_documents(chunks, title=filename)
-            if len(embeddings) != len(chunks):
-                raise ValueError(
-                    f"Embedding provider returned {len(embeddings)} vectors for {len(chunks)} chunks"
+            stored = 0
+            reused = 0
+            for batch in batched(chunks, INGEST_STREAM_BATCH_SIZE):
+                # Counters from _embed_chunks_with_reuse are per batch; report them for the whole upload
+                batch_progress = offset_progress(
+                    progress, chunks_total=stored, chunks_embedded=stored, reused_chunks=reused
                 )
 
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                doc = Document(
-                    doc_id=f"doc_{file_id}_{i}",
-                    original_file_id=filename,
-                    chunk_index=i,
-                    text=chunk,
-                    space_id=space_id,
-                    embedding=embedding
+                texts = [chunk.text for chunk in batch]
+                embeddings, hashes, batch_reused = _embed_chunks_with_reuse(session, texts, filename, batch_progress)
+                if len(embeddings) != len(batch):
+                    raise ValueError(
+                        f"Embedding provider returned {len(embeddings)} vectors for {len(batch)} chunks"
+                    )
+
+                rows = (
+                    {
+                        "doc_id": f"doc_{file_id}_{i}",
+                        "original_file_id": filename,
+                        "chunk_index": i,
+                        "text": chunk.text,
+                        "space_id": space_id,
+                        "embedding": embedding,
+                        "content_hash": content_hash,
+                        "token_count": chunk.token_count,
+                        "char_start": chunk.char_start,
+                        "char_end": chunk.char_end,
+                        "page_start": chunk.page_start,
+                        "page_end": chunk.page_end,
+                    }
+                    for i, (chunk, embedding, content_hash) in enumerate(
+                        zip(batch, embeddings, hashes), start=first_index + stored
+                    )
                 )
-                session.add(doc)
+                _bulk_insert_chunks(session, rows)
+                stored += len(batch)
+                reused += batch_reused
+
+            if progress:
+                progress("storing", chunks_total=stored, chunks_embedded=stored)
 
+            if stored:
+                _touch_space_content(session, space_id)
             session.commit()
-            logger.info(f"Uploaded {len(chunks)} chunks for file {filename} to space {space_id}")
-            return file_id
+            logger.info(
+                f"Uploaded {stored} chunks for file {filename} to space {space_id} "
+                f"({reused} reused, {stored - reused} embedded)"
+            )
+            return file_id, stored, reused
 
         except Exception as e:
             logger.error(f"Error uploading document: {str(e)}", exc_info=True)
             session.rollback()
             raise
 
+def delete_file_chunks(space_id: str, file_id: str, from_index: int = 0) -> int:
+    """Delete the chunks of one upload, optionally only those from `from_index` on."""
+    with get_db_session() as session:
+        try:
+            deleted = (
+                session.query(Document)
+                .filter(
+                    Document.space_id == space_id,
+                    Document.doc_id.startswith(f"doc_{file_id}_", autoescape=True),
+                    Document.chunk_index >= from_index
+                )
+                .delete(synchronize_session=False)
+            )
+            if deleted:
+                _touch_space_content(session, space_id)
+            session.commit()
+            return deleted
+
+        except Exception as e:
+            logger.error(f"Error deleting chunks of file {file_id}: {str(e)}", exc_info=True)
+            session.rollback()
+            raise
+
+def _touch_space_content(session, space_id: str) -> None:
+    # New content version in the same transaction as the chunk change, so cached answers expire with it
+    session.query(Spaces).filter(Spaces.id == space_id).update(
+        {Spaces.content_version: new_content_version()}, synchronize_session=False
+    )
+
 def query_documents_hybrid(
     query: str,
     top_k: int = 10,
     space_id: str = "default",
     user_id: str = None
 ) -> List[Dict[str, Any]]:
+    return query_documents_hybrid_batch([query], top_k, space_id, user_id)[query]
+
+class SearchResults(dict):
+    """Results keyed by query, plus the search plan that produced them."""
+
+    def __init__(self, *args, plan: Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.plan = plan
+
+def query_documents_hybrid_batch(
+    queries: List[str],
+    top_k: int = 10,
+    space_id: str = "default",
+    user_id: str = None
+) -> SearchResults:
+    """Embed every query in one request and run every search in one statement.
+
+    Each query runs two channels: nearest neighbours by embedding and a
+    full-text match on `text_search` ranked by ts_rank_cd. Their rankings are
+    merged with reciprocal rank fusion, so exact terms (identifiers, names,
+    error codes) are found even when they are not among the vector hits.
+
+    Small spaces are scanned exactly; larger ones go through an ANN index
+    (see VectorIndexManager.plan_search). With halfvec/binary storage or a
+    Matryoshka prefix index, the index pass over-fetches candidates, which are
+    rescored with the full-precision, full-dimension vector.
+    """
+    queries = list(dict.fromkeys(queries))
+    if not queries:
+        return SearchResults()
+
     # Verify user has access to this space
     if user_id:
         has_access = verify_space_access(space_id, user_id)
         if not has_access:
             raise ValueError(f"Unauthorized: User {user_id} does not have access to space {space_id}")
-    query_embedding = get_embedding_service().embed_query(query)
-
+    query_embeddings = get_embedding_service().embed_queries(queries)
+
+    dimension = settings.EMBEDDING_DIMENSION
+    # Terms are OR-ed so a chunk matching any of them is a lexical candidate; ts_rank_cd rewards matching more
+    query_rows = ", ".join(
+        f"({i}, CAST(:query_{i} AS vector({dimension})), "
+        f"CAST(replace(CAST(plainto_tsquery('{FULL_TEXT_CONFIG}', :text_{i}) AS text), '&', '|') AS tsquery))"
+        for i in range(len(queries))
+    )
+    params = {f"query_{i}": embedding for i, embedding in enumerate(query_embeddings)}
+    params.update({f"text_{i}": query for i, query in enumerate(queries)})
+    limit = top_k * 2
+    distance = f"embedding {OPERATORS[settings.DISTANCE_METRIC]} q.embedding"
+
+    index_manager = get_index_manager()
     with get_db_session() as session:
-        semantic_results = (
-            session.query(
-                Document.doc_id,
-                Document.text,
-                Document.chunk_index,
-                Document.original_file_id.label("filename"),
-                func.l2_distance(
-                    Document.embedding,
-                    cast(query_embedding, Vector(settings.EMBEDDING_DIMENSION)),
-                ).label("distance"),
+        plan, lists = index_manager.plan_search(session, space_id)
+        plan_label = plan
+        first_pass = index_manager.search_distance("embedding", "q.embedding", plan)
+        if plan == PLAN_EXACT:
+            # "+ 0" hides the distance operator from the planner so it filters by space and sorts exactly
+            first_pass = f"({first_pass}) + 0"
+            candidates = limit
+        else:
+            candidates = index_manager.candidate_count(limit)
+            if index_manager.rescores:
+                plan_label = f"{plan}+{index_manager.first_pass_label}_rescore"
+
+        statement = text(f"""
+            WITH q(idx, embedding, terms) AS (VALUES {query_rows}),
+            semantic AS (
+                SELECT q.idx, s.id, row_number() OVER (PARTITION BY q.idx ORDER BY s.distance) AS rank
+                FROM q
+                CROSS JOIN LATERAL (
+                    SELECT c.id, c.{distance} AS distance
+                    FROM (
+                        SELECT id, embedding
+                        FROM {Document.__tablename__}
+                        WHERE space_id = :space_id
+                        ORDER BY {first_pass}
+                        LIMIT :candidates
+                    ) AS c
+                    ORDER BY distance
+                    LIMIT :limit
+                ) AS s
+            ),
+            lexical AS (
+                SELECT q.idx, l.id, row_number() OVER (PARTITION BY q.idx ORDER BY l.score DESC, l.id) AS rank
+                FROM q
+                CROSS JOIN LATERAL (
+                    SELECT id, ts_rank_cd(text_search, q.terms) AS score
+                    FROM {Document.__tablename__}
+                    WHERE space_id = :space_id AND text_search @@ q.terms
+                    ORDER BY score DESC
+                    LIMIT :limit
+                ) AS l
+            ),
+            fused AS (
+                SELECT idx, id, sum(1.0 / (:rrf_k + rank)) AS score, bool_or(is_lexical) AS lexical
+                FROM (
+                    SELECT idx, id, rank, false AS is_lexical FROM semantic
+                    UNION ALL
+                    SELECT idx, id, rank, true AS is_lexical FROM lexical
+                ) AS ranked
+                GROUP BY idx, id
             )
-            .filter(Document.space_id == space_id)
-            .order_by("distance")
-            .limit(top_k * 2)
-            .all()
+            SELECT f.idx, d.doc_id, d.text, d.chunk_index, d.original_file_id AS filename,
+                   d.token_count, d.{distance} AS distance, f.score, f.lexical
+            FROM fused AS f
+            JOIN q ON q.idx = f.idx
+            JOIN {Document.__tablename__} AS d ON d.id = f.id
+            ORDER BY f.idx, f.score DESC, distance
+        """).bindparams(
+            *[bindparam(f"query_{i}", type_=Vector(dimension)) for i in range(len(queries))]
         )
-
-        query_terms = query.lower().split()
-        boosted_results = []
-
-        for r in semantic_results:
-            doc_id, text, _chunk_idx, filename, distance = r
-            text_lower = text.lower()
-
-            keyword_matches = sum(1 for term in query_terms if term in text_lower)
-            boosted_distance = distance - (keyword_matches * 0.1)
-
-            boosted_results.append({
-                "doc_id": doc_id,
-                "text": text,
-                "distance": boosted_distance,
-                "filename": filename
+        params.update({"space_id": space_id, "limit": limit, "candidates": candidates, "rrf_k": RRF_K})
+        index_manager.apply_search_settings(session, candidates, plan, lists=lists)
+        rows = session.execute(statement, params).all()
+
+    results = SearchResults(plan=plan_label)
+    for query in queries:
+        results[query] = []
+    for row in rows:
+        query_results = results[queries[row.idx]]
+        if len(query_results) < top_k:
+            query_results.append({
+                "doc_id": row.doc_id,
+                "text": row.text,
+                "chunk_index": row.chunk_index,
+                "token_count": row.token_count,
+                "distance": row.distance,
+                "score": float(row.score),
+                "lexical": bool(row.lexical),
+                "filename": row.filename
             })
 
-        boosted_results.sort(key=lambda x: x["distance"])
-
-        logger.info(f"Found {len(boosted_results)} results for query in space {space_id}")
-        return boosted_results[:top_k]
+    logger.info(f"Ran {len(queries)} searches in one round trip for space {space_id} ({plan_label} plan)")
+    return results
 
 def expand_query(query: str) -> str:
     expansions = {
@@ -171,6 +429,7 @@ def get_all_chunks_from_space(space_id: str, max_chunks: int = 50, user_id: str
                     Document.text,
                     Document.chunk_index,
                     Document.original_file_id.label("filename"),
+                    Document.token_count,
                 )
                 .filter(Document.space_id == space_id)
                 .order_by(Document.original_file_id, Document.chunk_index)
@@ -183,7 +442,8 @@ def get_all_chunks_from_space(space_id: str, max_chunks: int = 50, user_id: str
                     "doc_id": r[0],
                     "text": r[1],
                     "chunk_index": r[2],
-                    "filename": r[3]
+                    "filename": r[3],
+                    "token_count": r[4]
                 }
                 for r in results
             ]
@@ -194,29 +454,3 @@ def get_all_chunks_from_space(space_id: str, max_chunks: int = 50, user_id: str
         except Exception as e:
             logger.error(f"Error retrieving chunks from space {space_id}: {str(e)}", exc_info=True)
             raise
-
-def classify_query(query: str) -> str:
-    try:
-        classification_prompt = CLASSIFICATION_PROMPT_TEMPLATE.format(query=query)
-
-        response = genai_client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=classification_prompt,
-            config={
-                "temperature": 0.05,
-                "max_output_tokens": 10,
-            }
-        )
-
-        classification = response.text.strip().lower()
-
-        if classification not in ["specific", "analyze_all", "prev_context", "cross_document"]:
-            logger.warning(f"Invalid classification '{classification}', defaulting to 'specific'")
-            classification = "specific"
-
-        logger.info(f"Query classified as: {classification}")
-        return classification
-
-    except Exception as e:
-        logger.error(f"Error classifying query with AI: {str(e)}, defaulting to 'specific'")
-        return "specific"
@@ -1,6 +1,6 @@
 import { useState, useEffect } from 'react';
 import { Document } from '@/types';
-import { getSpaceDetails, uploadDocument as uploadDocumentAPI, uploadText as uploadTextAPI, deleteDocument as deleteDocumentAPI } from '@/lib/api/documents';
+import { getSpaceDetails, uploadDocument as uploadDocumentAPI, uploadText as uploadTextAPI, deleteDocument as deleteDocumentAPI, waitForIngestionJob } from '@/lib/api/documents';
 import { getFileType } from '@/lib/utils';
 import { toast } from 'sonner';
 
@@ -48,7 +48,8 @@ export const useDocuments = (spaceId: string) => {
     setDocuments(prev => [...prev, newDoc]);
 
     try {
-      await uploadDocumentAPI(spaceId, file);
+      const result = await uploadDocumentAPI(spaceId, file);
+      await waitForIngestionJob(result.job_id);
 
       setDocuments(prev =>
         prev.map(doc =>
@@ -83,6 +84,7 @@ export const useDocuments = (spaceId: string) => {
 
     try {
       const result = await uploadTextAPI(spaceId, textContent);
+      await waitForIngestionJob(result.job_id);
       const finalFilename = result.filename || result.fileid;
 
       setDocuments(prev =>
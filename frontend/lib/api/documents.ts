@@ -22,7 +22,51 @@ export const getSpaceDetails = async (spaceId: string): Promise<SpaceDetails> =>
   }
 };
 
-export const uploadDocument = async (spaceId: string, file: File): Promise<{ message: string }> => {
+export interface UploadResult {
+  fileid: string;
+  filename?: string;
+  job_id: string;
+  status: string;
+}
+
+export interface IngestionJob {
+  job_id: string;
+  status: 'queued' | 'running' | 'completed' | 'failed';
+  stage: string;
+  filename: string;
+  fileid: string;
+  space_id: string;
+  chunks_total: number;
+  chunks_embedded: number;
+  reused_chunks: number;
+  error?: string | null;
+}
+
+const JOB_POLL_INTERVAL_MS = 1500;
+
+export const getIngestionJob = async (jobId: string): Promise<IngestionJob> => {
+  const response = await authFetch(`/documents/jobs/${jobId}`);
+  if (!response.ok) {
+    throw new Error('Failed to fetch upload status');
+  }
+  return await response.json();
+};
+
+// Uploads are processed in the background; resolves once the document is searchable
+export const waitForIngestionJob = async (jobId: string): Promise<IngestionJob> => {
+  while (true) {
+    const job = await getIngestionJob(jobId);
+    if (job.status === 'completed') {
+      return job;
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Failed to process document');
+    }
+    await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+  }
+};
+
+export const uploadDocument = async (spaceId: string, file: File): Promise<UploadResult> => {
   const formData = new FormData();
   formData.append('space_id', spaceId);
   formData.append('file', file);
@@ -49,7 +93,7 @@ export const uploadDocument = async (spaceId: string, file: File): Promise<{ mes
   return await response.json();
 };
 
-export const uploadText = async (spaceId: string, textContent: string): Promise<{ fileid: string; chunk_count: number; filename?: string }> => {
+export const uploadText = async (spaceId: string, textContent: string): Promise<UploadResult> => {
   const formData = new FormData();
   formData.append('space_id', spaceId);
   formData.append('text_content', textContent);